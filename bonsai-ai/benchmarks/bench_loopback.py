@@ -0,0 +1,281 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+"""
+End-to-end loopback benchmark for the simulator pipeline.
+
+Trains a simulator against a local `bonsai_ai.testing.BrainServer`, so
+every step goes through `Simulator.run`, `Simulator_WS`, the websocket
+and the server and back. The server runs in a separate process so that
+it does not share the interpreter lock with the simulator.
+
+Each scenario changes one setting of the baseline (4 state fields, no
+Luminance, one prediction per message, recording off): the number of
+state fields, the size of a Luminance frame added to the state, the
+number of predictions per message, and recording. With --matrix, every
+combination is run instead.
+
+For each scenario, throughput is the number of steps per second, and
+step latency is the time between `simulate` returning and the next
+`simulate` call, which is the time spent in the SDK, the network and the
+server. With batches, only the first step of a batch waits for the
+server, so p50 falls as the batch grows while p99 stays near the round
+trip.
+
+Results are written as JSON. With --compare, steps/sec is compared with
+a previous results file, and the exit status is 1 if any scenario got
+slower by more than --threshold.
+
+Usage:
+    python benchmarks/bench_loopback.py [--steps N] [--output FILE]
+        [--compare PREVIOUS.json] [--threshold 0.1] [--matrix]
+"""
+
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from bonsai_ai import Brain, Config, Luminance, Simulator
+from bonsai_ai.testing import BrainServer
+from bonsai_ai.version import __version__
+
+FIELD_COUNTS = (4, 64, 1024)
+FRAME_SIZES = ('84x84', '256x256')
+BATCH_SIZES = (1, 8, 64)
+BASELINE = {'fields': 4, 'frame': None, 'batch_size': 1, 'record': False}
+
+
+def _frame_size(text):
+    width, _, height = text.partition('x')
+    return int(width), int(height)
+
+
+def state_schema(fields, frame):
+    schema = [('f{}'.format(i), 'double') for i in range(fields)]
+    if frame is not None:
+        schema.append(('frame', 'luminance'))
+    return schema
+
+
+def initial_state(fields, frame):
+    state = {'f{}'.format(i): float(i) for i in range(fields)}
+    if frame is not None:
+        width, height = _frame_size(frame)
+        state['frame'] = Luminance(
+            width, height, bytes(4 * width * height))
+    return state
+
+
+def _serve(settings, pipe):
+    """ Runs a BrainServer until told to stop, in a child process """
+    server = BrainServer(
+        state_schema=state_schema(settings['fields'], settings['frame']),
+        batch_size=settings['batch_size'],
+        episode_length=settings['episode_length'], episodes=1)
+    server.start()
+    pipe.send(server.port)
+    pipe.recv()
+    server.stop()
+    pipe.send(server.stats())
+
+
+class LoopbackSim(Simulator):
+    """ Returns the same state every step, timing each step """
+    def __init__(self, brain, name, state):
+        super(LoopbackSim, self).__init__(brain, name)
+        self.state = state
+        self.entries = []
+        self.gaps = []
+        self._returned = None
+
+    def episode_start(self, parameters):
+        self._returned = time.perf_counter()
+        return self.state
+
+    def simulate(self, action):
+        now = time.perf_counter()
+        self.entries.append(now)
+        self.gaps.append(now - self._returned)
+        self._returned = time.perf_counter()
+        return self.state, 1.0, False
+
+
+def percentile(values, p):
+    """ Nearest-rank percentile of sorted `values` """
+    index = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+
+def run_scenario(scenario, steps, warmup, record_dir, sdk_args):
+    """ Returns the results of one scenario """
+    # the server ends the episode after whole batches only
+    batch_size = scenario['batch_size']
+    episode_length = -(-(steps + warmup + 1) // batch_size) * batch_size
+    settings = dict(scenario, episode_length=episode_length)
+
+    pipe, child_pipe = multiprocessing.Pipe()
+    server = multiprocessing.Process(
+        target=_serve, args=(settings, child_pipe), daemon=True)
+    server.start()
+    port = pipe.recv()
+
+    args = [__name__, '--accesskey=bench', '--username=bench',
+            '--url=http://127.0.0.1:{}'.format(port), '--brain=loopback']
+    if scenario['record']:
+        args.append('--record={}'.format(os.path.join(
+            record_dir, 'record.{}'.format(scenario['record']))))
+    sim = LoopbackSim(Brain(Config(args + sdk_args)), 'loopback_simulator',
+                      initial_state(scenario['fields'], scenario['frame']))
+    while sim.run():
+        continue
+
+    pipe.send('stop')
+    stats = pipe.recv()
+    server.join()
+
+    # steps are measured from the entry of the first step after warmup
+    entries = sim.entries[warmup:warmup + steps + 1]
+    gaps = sorted(sim.gaps[warmup + 1:warmup + steps + 1])
+    seconds = entries[-1] - entries[0]
+    return dict(
+        scenario,
+        steps=len(gaps),
+        seconds=seconds,
+        steps_per_sec=len(gaps) / seconds,
+        latency_p50_us=percentile(gaps, 50) * 1e6,
+        latency_p99_us=percentile(gaps, 99) * 1e6,
+        messages=stats['messages'],
+    )
+
+
+def scenarios(args):
+    """ Returns the scenarios selected by the command line """
+    record = [False, args.record_format]
+    if args.matrix:
+        return [
+            {'fields': fields, 'frame': frame, 'batch_size': batch_size,
+             'record': rec}
+            for fields, frame, batch_size, rec in itertools.product(
+                args.fields, [None] + args.frames, args.batch_sizes, record)]
+
+    sweeps = [('fields', args.fields), ('frame', args.frames),
+              ('batch_size', args.batch_sizes), ('record', record)]
+    selected = [dict(BASELINE)]
+    for name, values in sweeps:
+        for value in values:
+            scenario = dict(BASELINE, **{name: value})
+            if scenario not in selected:
+                selected.append(scenario)
+    return selected
+
+
+def _key(result):
+    return (result['fields'], result['frame'], result['batch_size'],
+            result['record'])
+
+
+def compare(results, path, threshold):
+    """ Prints the change in steps/sec since the results in `path`, and
+    returns the number of scenarios that slowed by more than
+    `threshold` """
+    with open(path) as f:
+        previous = {_key(r): r for r in json.load(f)['results']}
+    regressions = 0
+    print()
+    print('{:<40} {:>12} {:>12} {:>8}'.format(
+        'scenario', 'before', 'after', 'change'))
+    for result in results:
+        before = previous.get(_key(result))
+        if before is None:
+            continue
+        change = result['steps_per_sec'] / before['steps_per_sec'] - 1
+        flag = ''
+        if change < -threshold:
+            regressions += 1
+            flag = ' REGRESSION'
+        print('{:<40} {:>12.0f} {:>12.0f} {:>+7.1%}{}'.format(
+            _describe(result), before['steps_per_sec'],
+            result['steps_per_sec'], change, flag))
+    return regressions
+
+
+def _describe(scenario):
+    return 'fields={} frame={} batch={} record={}'.format(
+        scenario['fields'], scenario['frame'] or '-',
+        scenario['batch_size'], scenario['record'] or 'off')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--steps', type=int, default=2000,
+                        help='measured steps per scenario')
+    parser.add_argument('--warmup', type=int, default=100,
+                        help='steps run before measuring')
+    parser.add_argument('--fields', type=int, nargs='+',
+                        default=list(FIELD_COUNTS),
+                        help='state field counts')
+    parser.add_argument('--frames', nargs='+', default=list(FRAME_SIZES),
+                        help='Luminance frame sizes, as WIDTHxHEIGHT')
+    parser.add_argument('--batch-sizes', type=int, nargs='+',
+                        default=list(BATCH_SIZES),
+                        help='predictions per message')
+    parser.add_argument('--record-format', default='csv',
+                        choices=('json', 'csv', 'npz', 'parquet'),
+                        help='file format of the recording scenarios')
+    parser.add_argument('--matrix', action='store_true',
+                        help='run every combination of the settings')
+    parser.add_argument('--sdk-args', nargs=argparse.REMAINDER, default=[],
+                        help='further simulator arguments, such as '
+                             '--pipeline; must come last')
+    parser.add_argument('--output', default='loopback_results.json',
+                        help='JSON file to write the results to')
+    parser.add_argument('--compare', default=None,
+                        help='JSON results of a previous run')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown in steps/sec reported as a '
+                             'regression by --compare')
+    args = parser.parse_args()
+    for frame in args.frames:
+        _frame_size(frame)
+
+    print('{:<40} {:>10} {:>10} {:>10}'.format(
+        'scenario', 'steps/sec', 'p50 (us)', 'p99 (us)'))
+    results = []
+    record_dir = tempfile.mkdtemp()
+    try:
+        for scenario in scenarios(args):
+            result = run_scenario(scenario, args.steps, args.warmup,
+                                  record_dir, args.sdk_args)
+            results.append(result)
+            print('{:<40} {:>10.0f} {:>10.1f} {:>10.1f}'.format(
+                _describe(result), result['steps_per_sec'],
+                result['latency_p50_us'], result['latency_p99_us']))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(record_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'sdk_version': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'steps': args.steps,
+            'sdk_args': args.sdk_args,
+            'results': results,
+        }, f, indent=2)
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+"""
+Micro-benchmark for decoding predictions into actions.
+
+Compares the per-schema `MessageDecoder` formats against the previous
+`dict_for_message`, which walked the message descriptor on every call,
+for schemas with 4, 64 and 1024 fields.
+
+Usage:
+    python benchmarks/bench_proto_to_state.py [--number N]
+"""
+
+import argparse
+import timeit
+
+from bonsai_ai.common.proto_to_state import numpy
+from bonsai_ai.inkling_factory import InklingMessageFactory
+
+from bench_state_to_proto import FIELD_COUNTS, schema_and_state
+
+
+def walk_descriptor(message):
+    """ The previous dict_for_message, for comparison """
+    result = {}
+    for field in message.DESCRIPTOR.fields:
+        result[field.name] = getattr(message, field.name)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--number', type=int, default=2000,
+                        help='decodes per measurement')
+    args = parser.parse_args()
+
+    formats = ['dict', 'record']
+    if numpy is not None:
+        formats.append('numpy')
+
+    factory = InklingMessageFactory()
+    print(('{:>7} {:>11}' + ' {:>11}' * len(formats)).format(
+        'fields', 'walk (us)', *('{} (us)'.format(f) for f in formats)))
+    for field_count in FIELD_COUNTS:
+        schema, state = schema_and_state(field_count)
+        codec = factory.codec_for_proto(schema)
+        message = codec.from_dict(state)
+        # scale down so that every row takes a similar time
+        number = max(args.number * 4 // field_count, 10)
+
+        decoders = [walk_descriptor] + [
+            (lambda fmt: lambda m: codec.decoder.decode(m, fmt))(fmt)
+            for fmt in formats]
+        timings = []
+        for decode in decoders:
+            seconds = min(timeit.repeat(
+                lambda: decode(message), number=number, repeat=3))
+            timings.append(seconds / number * 1e6)
+
+        print(('{:>7}' + ' {:>11.2f}' * len(timings)).format(
+            field_count, *timings))
+
+
+if __name__ == '__main__':
+    main()
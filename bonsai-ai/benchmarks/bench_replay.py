@@ -0,0 +1,156 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+"""
+Offline replay benchmark for the SDK's decode and encode path.
+
+Replays a capture file (see `--capture`) into a simulator with
+`bonsai_ai.capture.replay`, so every step goes through `Simulator.run`
+and `Simulator_WS` without a network or a server. Without --capture, a
+capture is first made by training against a local
+`bonsai_ai.testing.BrainServer`.
+
+The simulator returns the same state every step: --fields fields named
+f0, f1, ..., or the state in --state-json, which must match the state of
+the captured simulator.
+
+For each of --repeat replays, throughput is the number of steps per
+second, and the time spent in each phase of a step is taken from
+`Simulator.timings`. Results are written as JSON.
+
+Usage:
+    python benchmarks/bench_replay.py [--capture FILE] [--repeat N]
+        [--steps N] [--fields N] [--state-json FILE] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from bonsai_ai import Brain, Config, Simulator
+from bonsai_ai.capture import INBOUND, read_capture, replay
+from bonsai_ai.testing import BrainServer
+from bonsai_ai.version import __version__
+
+
+class ReplaySim(Simulator):
+    """ Returns the same state every step, counting steps """
+    def __init__(self, brain, name, state):
+        super(ReplaySim, self).__init__(brain, name)
+        self.state = state
+        self.steps = 0
+
+    def episode_start(self, parameters):
+        return self.state
+
+    def simulate(self, action):
+        self.steps += 1
+        return self.state, 1.0, False
+
+
+def _config(url, *args):
+    return Config([__name__, '--accesskey=bench', '--username=bench',
+                   '--url={}'.format(url), '--brain=replay'] + list(args))
+
+
+def make_capture(path, state, steps):
+    """ Captures `steps` steps of training against a BrainServer """
+    fields = [(name, 'double') for name in sorted(state)]
+    with BrainServer(state_schema=fields,
+                     episode_length=steps, episodes=1) as server:
+        sim = ReplaySim(Brain(_config(server.url, '--capture={}'.format(
+            path))), 'replay_simulator', state)
+        while sim.run():
+            continue
+
+
+def run_replay(path, state, simulator_name):
+    """ Returns the results of one replay of the capture at `path` """
+    # nothing listens here; the simulator never connects
+    sim = ReplaySim(Brain(_config('http://127.0.0.1:1')), simulator_name,
+                    state)
+    start = time.perf_counter()
+    connection = replay(sim, path)
+    seconds = time.perf_counter() - start
+    timings = sim.timings()
+    return dict(
+        steps=sim.steps,
+        seconds=seconds,
+        steps_per_sec=sim.steps / seconds if seconds else 0.0,
+        messages=connection.received,
+        phases={phase: {'total': t['total'], 'mean': t['mean'],
+                        'p99': t['p99']}
+                for phase, t in timings.items() if t['count']},
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--capture', default=None,
+                        help='capture file to replay; made if not given')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of replays')
+    parser.add_argument('--steps', type=int, default=2000,
+                        help='steps of the capture made if none is given')
+    parser.add_argument('--fields', type=int, default=4,
+                        help='state fields of the simulator')
+    parser.add_argument('--state-json', default=None,
+                        help='JSON file of the state the simulator returns')
+    parser.add_argument('--simulator', default='replay_simulator',
+                        help='name of the simulator')
+    parser.add_argument('--output', default='replay_results.json',
+                        help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    if args.state_json:
+        with open(args.state_json) as f:
+            state = json.load(f)
+    else:
+        state = {'f{}'.format(i): float(i) for i in range(args.fields)}
+
+    temp_dir = None
+    path = args.capture
+    try:
+        if path is None:
+            temp_dir = tempfile.mkdtemp()
+            path = os.path.join(temp_dir, 'replay.cap')
+            make_capture(path, state, args.steps)
+        messages = sum(1 for frame in read_capture(path)
+                       if frame.direction == INBOUND)
+        print('{}: {} messages from the server'.format(
+            args.capture or 'new capture', messages))
+
+        print('{:<8} {:>10} {:>12} {:>12}'.format(
+            'replay', 'steps/sec', 'decode (us)', 'encode (us)'))
+        results = []
+        for i in range(args.repeat):
+            result = run_replay(path, state, args.simulator)
+            results.append(result)
+            phases = result['phases']
+            print('{:<8} {:>10.0f} {:>12.1f} {:>12.1f}'.format(
+                i, result['steps_per_sec'],
+                phases.get('decode', {}).get('mean', 0.0) * 1e6,
+                phases.get('encode', {}).get('mean', 0.0) * 1e6))
+            sys.stdout.flush()
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'sdk_version': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'capture': args.capture,
+            'results': results,
+        }, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+"""
+Micro-benchmark for converting simulator states into protobuf messages.
+
+Compares the table-driven `StateConverter` of a codec against the previous
+implementation, which walked the message descriptor on every call, for
+schemas with 4, 64 and 1024 fields.
+
+Usage:
+    python benchmarks/bench_state_to_proto.py [--number N]
+"""
+
+import argparse
+import timeit
+
+from google.protobuf.descriptor_pb2 import DescriptorProto, \
+    FieldDescriptorProto
+
+from bonsai_ai.common.state_to_proto import is_proto_type_boolean, \
+    is_proto_type_embedded_message, is_proto_type_float, \
+    is_proto_type_integer, is_proto_type_string
+from bonsai_ai.inkling_factory import InklingMessageFactory
+
+FIELD_COUNTS = (4, 64, 1024)
+
+# field types cycled through by the generated schemas, with a sample value
+# of the matching Python type
+FIELD_TYPES = (
+    (FieldDescriptorProto.TYPE_DOUBLE, 1.5),
+    (FieldDescriptorProto.TYPE_FLOAT, 0.25),
+    (FieldDescriptorProto.TYPE_INT64, 3),
+    (FieldDescriptorProto.TYPE_BOOL, True),
+)
+
+
+def walk_descriptor(state_msg, state):
+    """ The previous convert_state_to_proto, for comparison """
+    for field in state_msg.DESCRIPTOR.fields:
+        value = state[field.name]
+        if is_proto_type_embedded_message(field):
+            pass
+        elif is_proto_type_float(field):
+            setattr(state_msg, field.name, float(value))
+        elif is_proto_type_integer(field):
+            setattr(state_msg, field.name, int(value))
+        elif is_proto_type_boolean(field):
+            setattr(state_msg, field.name, bool(value))
+        elif is_proto_type_string(field):
+            setattr(state_msg, field.name, str(value))
+
+
+def schema_and_state(field_count):
+    schema = DescriptorProto()
+    schema.name = 'State{}'.format(field_count)
+    state = {}
+    for i in range(field_count):
+        field_type, value = FIELD_TYPES[i % len(FIELD_TYPES)]
+        field = schema.field.add()
+        field.name = 'f{}'.format(i)
+        field.number = i + 1
+        field.type = field_type
+        field.label = FieldDescriptorProto.LABEL_OPTIONAL
+        state[field.name] = value
+    return schema, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--number', type=int, default=2000,
+                        help='conversions per measurement')
+    args = parser.parse_args()
+
+    factory = InklingMessageFactory()
+    print('{:>7} {:>16} {:>16} {:>8}'.format(
+        'fields', 'walk (us/state)', 'table (us/state)', 'speedup'))
+    for field_count in FIELD_COUNTS:
+        schema, state = schema_and_state(field_count)
+        codec = factory.codec_for_proto(schema)
+        message = codec.new_message()
+        # scale down so that every row takes a similar time
+        number = max(args.number * 4 // field_count, 10)
+
+        timings = []
+        for convert in (walk_descriptor, codec.converter.convert):
+            seconds = min(timeit.repeat(
+                lambda: convert(message, state), number=number, repeat=3))
+            timings.append(seconds / number * 1e6)
+
+        print('{:>7} {:>16.2f} {:>16.2f} {:>7.2f}x'.format(
+            field_count, timings[0], timings[1], timings[0] / timings[1]))
+
+
+if __name__ == '__main__':
+    main()
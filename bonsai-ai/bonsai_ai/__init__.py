@@ -15,6 +15,11 @@ Classes:
     Simulator: A class for connecting an existing simulation such that it may
                be used to train and predict against a BRAIN.
     Predictor: A class for running predictions against a BRAIN.
+    PredictionCache: A local cache of the actions of a Predictor.
+    MetricsExporter: Publishes simulator statistics for Prometheus.
+    VectorSimulator: A Simulator that steps a batch of environment
+               instances per call.
+    SimulatorHost: A class for running many Simulators on one event loop.
     Luminance: A class for representing Luminance data in Inkling schemas.
 """
 
@@ -24,8 +29,12 @@ from .brain import Brain
 from .brain_controller import BrainController
 from .config import Config
 from .simulator import Simulator
+from .vector_simulator import VectorSimulator
+from .simulator_host import SimulatorHost
 from .inkling_types import Luminance
 from .predictor import Predictor
+from .prediction_cache import PredictionCache
+from .metrics import MetricsExporter
 from .event import (EpisodeStartEvent, SimulateEvent,
     EpisodeFinishEvent, FinishedEvent, UnknownEvent)
 from .version import __version__
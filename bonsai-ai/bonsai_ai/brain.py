@@ -1,5 +1,6 @@
 # Copyright (C) 2018 Bonsai, Inc.
 
+import time
 from urllib.parse import urljoin, urlparse, urlunparse
 
 import requests
@@ -27,6 +28,11 @@ class Brain(object):
     This class can be used to introspect information about a BRAIN on the
     server and is used to query status and other properties.
 
+    Properties are read from a snapshot of the BRAIN fetched by `refresh`.
+    A snapshot older than `cache_ttl` seconds is refreshed automatically on
+    the next read; with the default TTL of 0 (see `--brain-cache-ttl`),
+    every read fetches a new one.
+
     Attributes:
         config:         The configuration object used to connect to this BRAIN.
         description:    A user generated description of this BRAIN.
@@ -36,6 +42,7 @@ class Brain(object):
         state:          Current state of this BRAIN on the server.
         version:        The currently selected version of the BRAIN.
         latest_version: The latest version of the BRAIN.
+        cache_ttl:      Seconds for which a snapshot is considered fresh.
 
     Example:
         import sys, bonsai_ai
@@ -63,6 +70,8 @@ class Brain(object):
         self._state = None
         self._sims = None
         self.latest_version = None
+        self.cache_ttl = config.brain_cache_ttl
+        self._updated_at = None
         self._user_info = get_user_info()
         self.update()
 
@@ -134,19 +143,20 @@ class Brain(object):
         constructing a new Brain object.
         """
         try:
-            log.brain('Getting {} info...'.format(self.name))
+            log.brain('Getting %s info...', self.name)
             self._info = self._api.get_brain_info(self.name)
             if self._info['versions']:
                 self.latest_version = self._info['versions'][0]['version']
             else:
                 self.latest_version = 0
 
-            log.brain('Getting {} info...'.format(self.name))
+            log.brain('Getting %s info...', self.name)
             self._status = self._api.get_brain_status(self.name)
 
-            log.brain('Getting {} sims...'.format(self.name))
+            log.brain('Getting %s sims...', self.name)
             self._sims = self._api.get_simulator_info(self.name)
             self._state = self._status['state']
+            self._updated_at = time.monotonic()
 
         except requests.exceptions.Timeout as e:
             log.error('Request timeout in bonsai_ai.Brain: ' + repr(e))
@@ -154,17 +164,31 @@ class Brain(object):
             print(e)
             print('WARNING: ignoring failed update in Brain init.')
 
+    def refresh(self):
+        """
+        Fetches a new snapshot of the BRAIN from the server, regardless of
+        `cache_ttl`. Same as `update`.
+        """
+        self.update()
+
+    def _update_if_stale(self):
+        """ Refreshes the snapshot if it is older than cache_ttl, or if the
+        last update failed. """
+        if self._updated_at is None or \
+                time.monotonic() - self._updated_at >= self.cache_ttl:
+            self.update()
+
     @property
     def ready(self):
         """ Returns True when the BRAIN is ready for training. """
-        self.update()
+        self._update_if_stale()
         if self.config.predict:
             return self._state == STOPPED or self._state == COMPLETED
         return self._state == IN_PROGRESS
 
     @property
     def exists(self):
-        self.update()
+        self._update_if_stale()
         """ Returns True when the BRAIN exists (i.e. update succeeded) """
         if self.config.predict:
             return self._state is not None and self._version_exists()
@@ -172,7 +196,7 @@ class Brain(object):
         return self._state is not None
 
     def sim_exists(self, sim_name):
-        self.update()
+        self._update_if_stale()
         if not self._sims:
             return False
         return sim_name in self._sims
@@ -187,20 +211,20 @@ class Brain(object):
     @property
     def state(self):
         """ Returns the current state of the target BRAIN """
-        self.update()
+        self._update_if_stale()
         return self._state
 
     @property
     def status(self):
         """ Returns the current status of the target BRAIN """
-        self.update()
+        self._update_if_stale()
         return self._status
 
     @property
     def sample_rate(self):
         """ Returns the sample rate in iterations/second for
             all simulators connected to the brain """
-        self.update()
+        self._update_if_stale()
         try:
             rate = sum(
                 sims['sample_rate'] for sims in self._status['simulators'])
@@ -224,7 +248,7 @@ class Brain(object):
             :param version: Version of your brain.
                 Defaults to configured version.
         """
-        self.update()
+        self._update_if_stale()
         if version is None:
             version = self.version
         return self._api.training_episode_metrics(self.name, version)
@@ -240,7 +264,7 @@ class Brain(object):
             :param version: Version of your brain.
                 Defaults to configured version.
         """
-        self.update()
+        self._update_if_stale()
         if version is None:
             version = self.version
         return self._api.iteration_metrics(self.name, version)
@@ -255,7 +279,7 @@ class Brain(object):
             :param version: Version of your brain.
                 Defaults to configured version.
         """
-        self.update()
+        self._update_if_stale()
         if version is None:
             version = self.version
         return self._api.test_episode_metrics(self.name, version)
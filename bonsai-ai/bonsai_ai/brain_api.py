@@ -1,13 +1,16 @@
 """
 Copyright (C) 2019 Microsoft
 """
+import asyncio
+import copy
 import json
 import os
 from uuid import uuid4
 
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
 from urllib.request import getproxies
 
+import aiohttp
 import requests
 from requests.packages.urllib3.fields import RequestField
 from requests.packages.urllib3.filepost import encode_multipart_formdata
@@ -43,6 +46,10 @@ class BrainAPI():
     all the necessary parts to make it easy to hit the various endpoints
     that provide information about a Bonsai BRAIN
 
+    GET responses that carry an ETag are remembered, and repeating such a
+    request sends If-None-Match, so that a server which supports it can
+    answer 304 Not Modified instead of sending the same body again.
+
     In the event of an error the object will raise an error providing the
     consumer details, such as failing response codes and/or error messages.
     """
@@ -60,6 +67,8 @@ class BrainAPI():
             'User-Agent': self._user_info
         })
         self._http_methods = {'GET', 'PUT', 'POST', 'DELETE'}
+        # url -> (ETag, decoded body) of the last GET response with an ETag
+        self._etags = {}
 
     def get_brain_info(self, brain_name):
         url_path = _GET_INFO_URL_PATH_TEMPLATE.format(
@@ -219,13 +228,17 @@ class BrainAPI():
         param: data -> JSON Formatted Dictionary: json data to send with request
         """
 
-        log.api('Sending {} request to {}'.format(http_method, url))
+        log.api('Sending %s request to %s', http_method, url)
         request_id = str(uuid4())
         try:
             if http_method == 'GET':
+                headers = {'RequestId': request_id}
+                cached = self._etags.get(url)
+                if cached is not None:
+                    headers['If-None-Match'] = cached[0]
                 response = self._session.get(
                     url=url, allow_redirects=False,
-                    timeout=self._timeout, headers={'RequestId': request_id})
+                    timeout=self._timeout, headers=headers)
 
             elif http_method == 'PUT':
                 response = self._session.put(
@@ -253,12 +266,26 @@ class BrainAPI():
                 "\nRequest ID: {}".format(http_method, url, request_id)
             raise BonsaiServerError(message)
 
+        if http_method == 'GET' and response.status_code == 304 and \
+                url in self._etags:
+            log.api('Not modified: %s', url)
+            # a copy, so that callers cannot change the remembered body
+            return copy.deepcopy(self._etags[url][1])
+
         try:
             response.raise_for_status()
             self._log_response(response, request_id)
         except requests.exceptions.HTTPError as err:
             self._handle_http_error(response, request_id)
-        return self._dict(response)
+        result = self._dict(response)
+
+        if http_method == 'GET':
+            etag = response.headers.get('ETag')
+            if etag:
+                self._etags[url] = (etag, copy.deepcopy(result))
+            else:
+                self._etags.pop(url, None)
+        return result
 
     def _http_request(self, http_method, url, data=None):
         """
@@ -330,15 +357,18 @@ class BrainAPI():
 
     @staticmethod
     def _log_response(response, request_id):
+        if not log.is_enabled('api'):
+            return
+
         # load json, if any...
         try:
             dump = json.dumps(response.json(), indent=4, sort_keys=True)
         except ValueError:
             dump = "{}"
 
-        log.api("url: {} {}\n\tstatus: {}\n\tjson: {}\n\trequest_id:{}".format(
-            response.request.method, response.url,
-            response.status_code, dump, request_id))
+        log.api("url: %s %s\n\tstatus: %s\n\tjson: %s\n\trequest_id:%s",
+                response.request.method, response.url,
+                response.status_code, dump, request_id)
 
     @staticmethod
     def _handle_inkling_file(ink_file: str):
@@ -415,3 +445,236 @@ class BrainAPI():
         headers = {'Content-Type': content_type}
 
         return (headers, body)
+
+
+class AsyncBrainAPI():
+    """
+    An asyncio counterpart of `BrainAPI` for the read and training control
+    endpoints, for processes that manage many BRAINs at once.
+
+    Requests share one aiohttp session whose connector keeps up to `limit`
+    keep-alive connections open, so concurrent requests do not pay for a
+    new connection each. `get_brain` fetches the info, status and
+    simulators of a BRAIN concurrently, and `get_brains` does so for many
+    BRAINs at once. As with `BrainAPI`, GET responses that carry an ETag
+    are revalidated with If-None-Match.
+
+    Example:
+        async def sweep(config, names):
+            async with AsyncBrainAPI(config) as api:
+                return await api.get_brains(names)
+    """
+    def __init__(self, config, timeout=30, limit=100, loop=None):
+        self._config = config
+        self._access_key = config.accesskey
+        self._username = config.username
+        self._api_url = config.url
+        self._timeout = timeout
+        self._limit = limit
+        self._loop = loop
+        self._user_info = get_user_info()
+        self._session = None
+        # url -> (ETag, decoded body) of the last GET response with an ETag
+        self._etags = {}
+        # the token refresh in progress, shared by concurrent requests
+        self._refresh = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """ Closes the session and its pooled connections """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _url(self, template, **kwargs):
+        return urljoin(self._api_url, template.format(
+            username=self._username, **kwargs))
+
+    async def get_brain_info(self, brain_name):
+        return await self._http_request(
+            'GET', self._url(_GET_INFO_URL_PATH_TEMPLATE, brain=brain_name))
+
+    async def get_brain_status(self, brain_name):
+        return await self._http_request(
+            'GET', self._url(_STATUS_URL_PATH_TEMPLATE, brain=brain_name))
+
+    async def get_simulator_info(self, brain_name):
+        return await self._http_request(
+            'GET', self._url(_SIMS_INFO_URL_PATH_TEMPLATE, brain=brain_name))
+
+    async def get_brain(self, brain_name):
+        """
+        Fetches the info, status and simulators of a BRAIN concurrently.
+        Returns a dict with the keys 'info', 'status' and 'sims'.
+        """
+        info, status, sims = await asyncio.gather(
+            self.get_brain_info(brain_name),
+            self.get_brain_status(brain_name),
+            self.get_simulator_info(brain_name),
+            loop=self._loop)
+        return {'info': info, 'status': status, 'sims': sims}
+
+    async def get_brains(self, brain_names, return_exceptions=False):
+        """
+        Runs `get_brain` for every name concurrently, and returns a dict
+        from name to result. At most `limit` requests are in flight at a
+        time. With `return_exceptions`, a BRAIN whose requests failed maps
+        to the exception instead of failing the whole sweep.
+        """
+        brain_names = list(brain_names)
+        results = await asyncio.gather(
+            *[self.get_brain(name) for name in brain_names],
+            loop=self._loop, return_exceptions=return_exceptions)
+        return dict(zip(brain_names, results))
+
+    async def start_training(self, brain_name):
+        return await self._http_request(
+            'PUT', self._url(_TRAIN_URL_PATH_TEMPLATE, brain=brain_name))
+
+    async def stop_training(self, brain_name):
+        return await self._http_request(
+            'PUT', self._url(_STOP_URL_PATH_TEMPLATE, brain=brain_name))
+
+    async def resume_training(self, brain_name, version='latest'):
+        return await self._http_request(
+            'PUT', self._url(_RESUME_URL_PATH_TEMPLATE,
+                             brain=brain_name, version=version))
+
+    async def training_episode_metrics(self, brain_name, version):
+        return await self._http_request(
+            'GET', self._url(_TRAIN_METRICS_URL_PATH_TEMPLATE,
+                             brain=brain_name, version=version))
+
+    async def test_episode_metrics(self, brain_name, version):
+        return await self._http_request(
+            'GET', self._url(_TEST_METRICS_URL_PATH_TEMPLATE,
+                             brain=brain_name, version=version))
+
+    async def iteration_metrics(self, brain_name, version):
+        return await self._http_request(
+            'GET', self._url(_ITERATION_METRICS_URL_PATH_TEMPLATE,
+                             brain=brain_name, version=version))
+
+    def _get_session(self):
+        if self._session is None:
+            loop = self._loop or asyncio.get_event_loop()
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._limit, loop=loop),
+                headers={'User-Agent': self._user_info},
+                loop=loop)
+        return self._session
+
+    def _proxy(self):
+        # aiohttp only supports http proxies, see SimulatorConnection
+        proxy = self._config.proxy
+        if proxy and urlparse(proxy).scheme == '':
+            proxy = 'http://' + proxy
+        return proxy
+
+    async def _try_http_request(self, http_method, url, data=None):
+        log.api('Sending %s request to %s', http_method, url)
+        request_id = str(uuid4())
+        # sent per request, so that a refreshed token takes effect
+        headers = {'RequestId': request_id, 'Authorization': self._access_key}
+        cached = self._etags.get(url) if http_method == 'GET' else None
+        if cached is not None:
+            headers['If-None-Match'] = cached[0]
+
+        try:
+            async with self._get_session().request(
+                    http_method, url, data=data, headers=headers,
+                    allow_redirects=False, timeout=self._timeout,
+                    proxy=self._proxy()) as response:
+                text = await response.text()
+        except aiohttp.ClientConnectionError:
+            message = \
+                "Connection Error, {} Request failed. Unable to connect to " \
+                "domain: {}\nRequest ID: {}".format(http_method, url, request_id)
+            raise BonsaiServerError(message)
+        except asyncio.TimeoutError:
+            message = "{} Request failed. Request to {} timed out" \
+                "\nRequest ID: {}".format(http_method, url, request_id)
+            raise BonsaiServerError(message)
+
+        if cached is not None and response.status == 304:
+            log.api('Not modified: %s', url)
+            # a copy, so that callers cannot change the remembered body
+            return copy.deepcopy(cached[1])
+
+        result = {}
+        if text.strip():
+            try:
+                result = json.loads(text)
+            except ValueError as e:
+                if response.status < 400:
+                    log.error('Unable to decode json from {}\n{}'.format(
+                        url, e))
+
+        if response.status >= 400:
+            self._handle_http_error(result, response, request_id)
+        log.api("url: %s %s\n\tstatus: %s\n\trequest_id:%s",
+                http_method, url, response.status, request_id)
+
+        if http_method == 'GET':
+            etag = response.headers.get('ETag')
+            if etag:
+                self._etags[url] = (etag, copy.deepcopy(result))
+            else:
+                self._etags.pop(url, None)
+        return result
+
+    async def _refresh_access_token(self):
+        """
+        Refreshes the access token on an executor thread, so that the
+        blocking refresh does not stall other requests. Requests that find
+        the token expired while a refresh is in progress wait for it
+        instead of starting another.
+        """
+        if self._refresh is None:
+            loop = self._loop or asyncio.get_event_loop()
+            self._refresh = loop.run_in_executor(
+                None, self._config.refresh_access_token)
+        refresh = self._refresh
+        try:
+            await asyncio.shield(refresh, loop=self._loop)
+        finally:
+            if self._refresh is refresh and refresh.done():
+                self._refresh = None
+        self._access_key = self._config.accesskey
+
+    async def _http_request(self, http_method, url, data=None):
+        """
+        Wrapper for _try_http_request(), will refresh token and retry if first
+        attempt fails due to expired token.
+        """
+        try:
+            return await self._try_http_request(http_method, url, data)
+        except BonsaiServerError as err:
+            error_lowercase = str(err).lower()
+            if 'token' in error_lowercase and 'expired' in error_lowercase:
+                await self._refresh_access_token()
+                return await self._try_http_request(http_method, url, data)
+            else:
+                raise err
+
+    @staticmethod
+    def _handle_http_error(result, response, request_id):
+        try:
+            message = \
+                'Request failed with error code "{}", error message:\n{}'.format(
+                    result["error"]["code"], result["error"]["message"])
+        except (KeyError, TypeError):
+            message = 'Request failed.'
+
+        message += '\nRequest ID: {}'.format(request_id)
+
+        span_id = response.headers.get('SpanID')
+        if span_id is not None:
+            message += '\nSpan ID: {}'.format(span_id)
+
+        raise BonsaiServerError(message)
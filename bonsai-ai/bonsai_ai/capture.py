@@ -0,0 +1,195 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+import os
+import struct
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+from aiohttp import WSMessage, WSMsgType
+
+from bonsai_ai.exceptions import UsageError
+from bonsai_ai.proto.generator_simulator_api_pb2 import ServerToSimulator
+
+# directions of the frames of a capture
+OUTBOUND = 0    # simulator to server
+INBOUND = 1     # server to simulator
+DISCONNECT = 2  # the connection was lost; the frame has no data
+
+# a capture file starts with MAGIC, followed by frames of a _FRAME header
+# (direction, seconds since the epoch, length of the data) and the data
+MAGIC = b'BONSAICAP\x01'
+_FRAME = struct.Struct('<BdI')
+
+Frame = namedtuple('Frame', ('direction', 'timestamp', 'data'))
+
+# the capture files of the simulators of this process, which later
+# simulators do not reuse
+_used_paths = set()
+_used_paths_lock = threading.Lock()
+
+
+def capture_path(template):
+    """
+    Returns the capture file of a new simulator configured with
+    `--capture=template`. "{pid}" in `template` is replaced by the process
+    ID, and "{sim}" by the number of simulators of the process that
+    captured before this one. A file already captured to by another
+    simulator of the process gets a "-1", "-2", ... suffix before its
+    extension instead, so that simulators never share a capture file.
+    """
+    with _used_paths_lock:
+        path = template.replace('{pid}', str(os.getpid())).replace(
+            '{sim}', str(len(_used_paths)))
+        root, ext = os.path.splitext(path)
+        suffix = 0
+        while os.path.abspath(path) in _used_paths:
+            suffix += 1
+            path = '{}-{}{}'.format(root, suffix, ext)
+        _used_paths.add(os.path.abspath(path))
+        return path
+
+
+class CaptureWriter(object):
+    """
+    Appends the websocket messages of a simulator to a capture file, each
+    with its direction and a timestamp. Enabled with `--capture`.
+
+    A closed writer reopens its file for appending on the next write, so
+    that a simulator run again after `close` keeps capturing to it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+
+    def write(self, direction, data=b'', timestamp=None):
+        """ Appends a frame """
+        if timestamp is None:
+            timestamp = time.time()
+        if self._file.closed:
+            self._file = open(self.path, 'ab')
+        self._file.write(_FRAME.pack(direction, timestamp, len(data)))
+        self._file.write(data)
+
+    def flush(self):
+        if not self._file.closed:
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_capture(path):
+    """ Yields the `Frame`s of a capture file, in order """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a capture file'.format(path))
+        while True:
+            header = f.read(_FRAME.size)
+            if not header:
+                return
+            if len(header) < _FRAME.size:
+                raise ValueError('{} is truncated'.format(path))
+            direction, timestamp, length = _FRAME.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                raise ValueError('{} is truncated'.format(path))
+            yield Frame(direction, timestamp, data)
+
+
+class ReplayConnection(object):
+    """
+    Stands in for the websocket connection of a simulator, serving the
+    messages the server sent in a capture instead of reading from the
+    network. The messages the simulator sends are counted and dropped.
+    Once the capture is exhausted, the simulator is sent FINISHED.
+    """
+    def __init__(self, frames, loop=None):
+        self._frames = deque(
+            f for f in frames if f.direction in (INBOUND, DISCONNECT))
+        self._ioloop = loop
+        self._connected = False
+        finished = ServerToSimulator()
+        finished.message_type = ServerToSimulator.FINISHED
+        self._finished = finished.SerializeToString()
+
+        # statistics, as kept by SimulatorConnection
+        self.connects = 0
+        self.disconnects = 0
+        self.sent = 0
+        self.sent_bytes = 0
+        self.received = 0
+
+    @property
+    def client(self):
+        return self if self._connected else None
+
+    @property
+    def closed(self):
+        return not self._connected
+
+    async def connect(self):
+        self._connected = True
+        self.connects += 1
+        return None
+
+    async def receive(self):
+        if not self._frames:
+            return WSMessage(WSMsgType.BINARY, self._finished, None)
+        frame = self._frames.popleft()
+        if frame.direction == DISCONNECT:
+            return WSMessage(WSMsgType.CLOSED, None, 'Replayed disconnect')
+        self.received += 1
+        return WSMessage(WSMsgType.BINARY, frame.data, None)
+
+    async def send_bytes(self, data):
+        self.sent += 1
+        self.sent_bytes += len(data)
+
+    async def service_until(self, future):
+        return await future
+
+    @contextmanager
+    def blocking(self):
+        yield
+
+    async def handle_disconnect(self, message=None):
+        self.disconnects += 1
+        self._connected = False
+
+    async def close(self):
+        self._connected = False
+
+
+def replay(sim, path):
+    """
+    Runs `sim` on the messages the server sent in the capture at `path`,
+    without a network connection, and returns the `ReplayConnection`.
+
+    The simulator's callbacks run as they would have on the captured
+    connection, while the SDK parses, decodes, encodes and serializes
+    every message for real, so that the SDK can be profiled and
+    benchmarked deterministically. The simulator must not be connected
+    yet, and must be configured for prediction if the capture is of
+    prediction traffic.
+
+    Example:
+        sim = MySimulator(brain, 'my_simulator')
+        connection = replay(sim, 'session.cap')
+        print(connection.received, sim.timings()['decode']['total'])
+    """
+    if sim._impl._sim_connection.client is not None:
+        raise UsageError('Cannot replay to a connected simulator')
+    connection = ReplayConnection(read_capture(path), sim._ioloop)
+    sim._impl._sim_connection = connection
+    while sim.run():
+        continue
+    return connection
@@ -1,15 +1,151 @@
 # Copyright (C) 2018 Bonsai, Inc.
 
+from keyword import iskeyword
+from operator import attrgetter, itemgetter
+
+from google.protobuf.descriptor import FieldDescriptor
+
+from bonsai_ai.exceptions import UsageError
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# numpy dtypes for the protobuf field types of Inkling messages; other
+# fields, such as embedded Luminance messages, are stored as objects
+CPPTYPE_DTYPES = {
+    FieldDescriptor.CPPTYPE_INT32: 'i4',
+    FieldDescriptor.CPPTYPE_INT64: 'i8',
+    FieldDescriptor.CPPTYPE_UINT32: 'u4',
+    FieldDescriptor.CPPTYPE_UINT64: 'u8',
+    FieldDescriptor.CPPTYPE_DOUBLE: 'f8',
+    FieldDescriptor.CPPTYPE_FLOAT: 'f4',
+    FieldDescriptor.CPPTYPE_BOOL: '?',
+}
+
+# the formats MessageDecoder.decode can produce
+DECODE_FORMATS = ('dict', 'record', 'numpy')
+
+
+def _values_getter(names):
+    """ Returns a function that reads the fields `names` of a message into
+    a tuple, with a single call into the protobuf runtime """
+    if not names:
+        return lambda message: ()
+    if len(names) == 1:
+        getter = attrgetter(names[0])
+        return lambda message: (getter(message),)
+    return attrgetter(*names)
+
+
+def _record_type(type_name, names):
+    """ Returns a tuple subclass for `names`, in the manner of a namedtuple,
+    whose items can also be read by field name and which has `keys()`, so
+    that a record can be used where a read-only dictionary is expected.
+    Unlike `namedtuple`, any number of fields is supported. """
+    index = {name: i for i, name in enumerate(names)}
+
+    def keys(self):
+        return names
+
+    def __getitem__(self, key):
+        if type(key) is str:
+            key = index[key]
+        return tuple.__getitem__(self, key)
+
+    def __repr__(self):
+        return '{}({})'.format(type_name, ', '.join(
+            '{}={!r}'.format(name, value)
+            for name, value in zip(names, self)))
+
+    def _asdict(self):
+        return dict(zip(names, self))
+
+    namespace = {
+        '__slots__': (),
+        '_fields': names,
+        '_make': classmethod(tuple.__new__),
+        'keys': keys,
+        '__getitem__': __getitem__,
+        '__repr__': __repr__,
+        '_asdict': _asdict,
+    }
+    for i, name in enumerate(names):
+        if name.isidentifier() and not iskeyword(name) and \
+                name not in namespace:
+            namespace[name] = property(itemgetter(i))
+    return type(type_name, (tuple,), namespace)
+
+
+class MessageDecoder(object):
+    """
+    Unpacks messages of a single schema.
+
+    The field names of the schema are resolved once, into a getter that
+    reads all fields of a message in one call, and into the record class
+    and NumPy dtype for the 'record' and 'numpy' formats.
+
+    Attributes:
+        field_names: Tuple of field names, in schema order.
+        record_type: The tuple subclass returned by `to_record`.
+        dtype:       The NumPy dtype of the rows returned by `to_row`, or
+                     None if NumPy is not installed.
+    """
+    def __init__(self, descriptor):
+        fields = descriptor.fields
+        self.field_names = tuple(field.name for field in fields)
+        self.values = _values_getter(self.field_names)
+        self.record_type = _record_type(
+            descriptor.name or 'Record', self.field_names)
+        self.dtype = None
+        if numpy is not None:
+            self.dtype = numpy.dtype(
+                [(field.name, CPPTYPE_DTYPES.get(field.cpp_type, 'O'))
+                 for field in fields])
+        self._decoders = {
+            'dict': self.to_dict,
+            'record': self.to_record,
+            'numpy': self.to_row,
+        }
+
+    def to_dict(self, message):
+        """ Returns the fields of `message` as a dictionary """
+        return dict(zip(self.field_names, self.values(message)))
+
+    def to_record(self, message):
+        """ Returns the fields of `message` as a `record_type` """
+        return self.record_type._make(self.values(message))
+
+    def to_row(self, message):
+        """ Returns the fields of `message` as a NumPy structured scalar """
+        if self.dtype is None:
+            raise UsageError("The 'numpy' format requires numpy")
+        return numpy.array(self.values(message), dtype=self.dtype)[()]
+
+    def decode(self, message, fmt='dict'):
+        """ Returns the fields of `message` in the format `fmt`, one of
+        'dict', 'record' or 'numpy' """
+        try:
+            decode = self._decoders[fmt]
+        except KeyError:
+            raise UsageError(
+                "Unknown format '{}', expected one of {}".format(
+                    fmt, ', '.join(repr(f) for f in DECODE_FORMATS)))
+        return decode(message)
+
 
 def dict_for_message(message):
     """
-    Unpack a protobuf message into a Python dictionary
+    Unpack a protobuf message into a Python dictionary, with a
+    MessageDecoder built for this call. Decoders are kept by
+    `InklingMessageCodec`, use its `decoder` to unpack many messages of
+    one schema.
     :return: dictionary
     """
-    result = {}
     # If the message is bogus, return an empty dictionary rather
     # than crashing.
-    if message is not None:
-        for field in message.DESCRIPTOR.fields:
-            result[field.name] = getattr(message, field.name)
-    return result
+    if message is None:
+        return {}
+    return MessageDecoder(message.DESCRIPTOR).to_dict(message)
@@ -2,13 +2,19 @@
 
 from bonsai_ai.logger import Logger
 from bonsai_ai.exceptions import SimStateError
+from bonsai_ai.inkling_types import Luminance
 
 
 log = Logger()
 
 
 def build_luminance_from_state(field_name, proto_msg, luminance):
-    """ This function sets a luminance datum onto a protobuf message """
+    """ This function sets a luminance datum onto a protobuf message. 2-D
+    arrays of shape (height, width) are accepted in place of a Luminance.
+    """
+    shape = getattr(luminance, 'shape', None)
+    if shape is not None and len(shape) == 2:
+        luminance = Luminance.from_array(luminance)
     if luminance.__class__.__name__ == 'Luminance':
         lum_attr = getattr(proto_msg, field_name)
         lum_attr.width = luminance.width
@@ -16,7 +22,7 @@ def build_luminance_from_state(field_name, proto_msg, luminance):
         lum_attr.pixels = luminance.pixels
     else:
         raise SimStateError(
-            "Expected bonsai.inkling_types.Luminance Got {}"
+            "Expected bonsai.inkling_types.Luminance or a 2-D array Got {}"
             .format(luminance.__class__))
 
 
@@ -32,8 +38,8 @@ def build_proto_from_embedded_type(message_type, field_name, field_data,
     be registered in the mapping inkling_type_proto_handler
     """
     if message_type is not None:
-        log.proto("Converting {} type into tensor form".format(
-                  str(message_type.full_name)))
+        log.proto("Converting %s type into tensor form",
+                  message_type.full_name)
         handler = inkling_type_proto_handler[message_type.full_name]
         handler(field_name, proto_msg, field_data)
     else:
@@ -83,49 +89,84 @@ def is_proto_type_string(field):
     return field.type == field.TYPE_STRING
 
 
-def convert_state_to_proto(state_msg, state):
-    for field in state_msg.DESCRIPTOR.fields:
+def _coercer(python_type, type_name):
+    """ Returns a function that coerces a value of a field to
+    `python_type`, raising SimStateError if it cannot """
+    def coerce(name, value):
         try:
-            value = state[field.name]
-        except KeyError:
+            return python_type(value)
+        except (TypeError, ValueError):
             raise SimStateError(
-                "The inkling file specifies a field named \"{}\" which was not"
-                " found in the SimState. Please check the inkling file state "
-                "schema and the return value from get_state()."
-                .format(field.name))
+                "Expected the field '{}' to be {}, but got {} "
+                "instead.".format(name, type_name, repr(value)))
+    return coerce
+
+
+def _identity(name, value):
+    return value
+
+
+def _ignore(state_msg, name, value):
+    pass
+
+
+def _embedded_setter(message_type):
+    def set_embedded(state_msg, name, value):
+        build_proto_from_embedded_type(message_type, name, value, state_msg)
+    return set_embedded
+
+
+class StateConverter(object):
+    """
+    Converts state dictionaries into messages of a single schema.
+
+    The per-field dispatch of the schema is resolved once, into a flat
+    tuple of (name, setter, coercer, exact_type) entries. Values whose
+    type is already `exact_type` are set without coercion.
+    """
+    def __init__(self, descriptor):
+        self.fields = tuple(
+            self._entry_for_field(field) for field in descriptor.fields)
+
+    @staticmethod
+    def _entry_for_field(field):
         # If the field is a message, assume it is Luminance.
         if is_proto_type_embedded_message(field):
-            build_proto_from_embedded_type(
-                field.message_type, field.name, value, state_msg)
-        elif is_proto_type_float(field):
-            try:
-                value = float(value)
-            except (TypeError, ValueError):
-                raise SimStateError(
-                    "Expected the field '{}' to be a float, but got {} "
-                    "instead.".format(field.name, repr(value)))
-            setattr(state_msg, field.name, value)
-        elif is_proto_type_integer(field):
-            try:
-                value = int(value)
-            except (TypeError, ValueError):
-                raise SimStateError(
-                    "Expected the field '{}' to be an integer, but got {} "
-                    "instead.".format(field.name, repr(value)))
-            setattr(state_msg, field.name, value)
-        elif is_proto_type_boolean(field):
+            return (field.name, _embedded_setter(field.message_type),
+                    _identity, None)
+        if is_proto_type_float(field):
+            return (field.name, setattr,
+                    _coercer(float, 'a float'), float)
+        if is_proto_type_integer(field):
+            return (field.name, setattr,
+                    _coercer(int, 'an integer'), int)
+        if is_proto_type_boolean(field):
+            return (field.name, setattr,
+                    _coercer(bool, 'a boolean'), bool)
+        if is_proto_type_string(field):
+            return (field.name, setattr,
+                    _coercer(str, 'a string'), str)
+        # other types must be present, but are not converted
+        return (field.name, _ignore, _identity, None)
+
+    def convert(self, state_msg, state):
+        """ Sets the fields of `state_msg` from the dictionary `state` """
+        for name, setter, coerce, exact_type in self.fields:
             try:
-                value = bool(value)
-            except (TypeError, ValueError):
+                value = state[name]
+            except KeyError:
                 raise SimStateError(
-                    "Expected the field '{}' to be a boolean, but got {} "
-                    "instead.".format(field.name, repr(value)))
-            setattr(state_msg, field.name, value)
-        elif is_proto_type_string(field):
-            try:
-                value = str(value)
-            except (TypeError, ValueError):
-                raise SimStateError(
-                    "Expected the field '{}' to be a string, but got {} "
-                    "instead.".format(field.name, repr(value)))
-            setattr(state_msg, field.name, value)
+                    "The inkling file specifies a field named \"{}\" which "
+                    "was not found in the SimState. Please check the inkling "
+                    "file state schema and the return value from "
+                    "get_state().".format(name))
+            if type(value) is not exact_type:
+                value = coerce(name, value)
+            setter(state_msg, name, value)
+
+
+def convert_state_to_proto(state_msg, state):
+    """ Fills `state_msg` from `state` with a StateConverter built for this
+    call. Converters are kept by `InklingMessageCodec`, use its `converter`
+    to convert many states of one schema. """
+    StateConverter(state_msg.DESCRIPTOR).convert(state_msg, state)
@@ -68,7 +68,11 @@ _PREDICT_HELP = \
     """
 _VERBOSE_HELP = "Enables logging. Alias for --log=all"
 _PERFORMANCE_HELP = \
-    "Enables time delta logging. Alias for --log=perf.all"
+    """
+    Periodically logs where the time of simulator steps goes: network
+    wait, protobuf parse, action decode, simulate, state encode, recording
+    and send. Alias for --log=perf.
+    """
 _LOG_HELP = \
     """
     Enable logging. Parameters are a list of log domains.
@@ -80,7 +84,14 @@ _RECORD_HELP = \
     Enable record simulation data to a file (current) or
     external service (not yet implemented).
     Parameter is the target file for recorded data. Data format will be
-    inferred from the file extension. Currently supports ".json" and ".csv".
+    inferred from the file extension. Currently supports ".json", ".csv",
+    ".npz" (requires numpy) and ".parquet" (requires numpy and pyarrow).
+    """
+_RECORD_BUFFERED_HELP = \
+    """
+    Write recorded data from a background thread, flushing the record
+    file periodically instead of after every record. Recommended for long
+    recorded training runs.
     """
 _RETRY_TIMEOUT_HELP = \
     """
@@ -93,6 +104,61 @@ _NETWORK_TIMEOUT_HELP = \
     Time in seconds to wait before retrying network connections.
     Must be greater than zero.
     """
+_BRAIN_CACHE_TTL_HELP = \
+    """
+    Time in seconds for which Brain properties such as state and status are
+    served from the last fetched snapshot before the server is queried
+    again. The default of 0 queries the server on every access.
+    """
+_REUSE_TRANSPORT_HELP = \
+    """
+    Keep the HTTP session of the simulator connection open across
+    reconnects, caching DNS lookups and sharing one SSL context, so that
+    reconnecting after a dropped connection is faster.
+    """
+_RETRY_BACKOFF_BASE_HELP = \
+    """
+    Base of the exponential reconnect backoff in milliseconds. The n-th
+    reconnect attempt waits a random time of up to base * 2^(n-1)
+    milliseconds. The default is 50.
+    """
+_RETRY_BACKOFF_MAX_HELP = \
+    """
+    Maximum time in seconds to wait between reconnect attempts.
+    The default is 60.
+    """
+_PIPELINE_HELP = \
+    """
+    Send each simulator state to the server as soon as it is computed, so
+    that the server works on the reply while the code between calls to
+    run() executes. The reply is received in the background while the
+    event loop runs, that is between calls to arun() or in a
+    SimulatorHost; with the synchronous run() it is received and decoded
+    when the next run() starts, so only the early send is gained.
+    """
+_METRICS_PORT_HELP = \
+    """
+    Serve simulator and predictor statistics for scraping by Prometheus,
+    in the OpenMetrics text format, on http://<host>:<port>/metrics.
+    A port of 0 serves each process on a free port, which is logged, so
+    that several processes started with the same flags do not collide; a
+    port that cannot be bound is logged and the simulator runs without
+    serving metrics.
+    """
+_METRICS_TEXTFILE_HELP = \
+    """
+    Write simulator and predictor statistics to this file every 15
+    seconds, in the Prometheus text format, for the node exporter
+    textfile collector. "{pid}" in the path is replaced by the process ID.
+    """
+_CAPTURE_HELP = \
+    """
+    Write every message exchanged with the server, with timestamps, to
+    this capture file, for replay with bonsai_ai.capture.replay.
+    "{pid}" in the path is replaced by the process ID and "{sim}" by the
+    index of the simulator in the process. Simulators of a process never
+    share a file: a file already in use gets a "-1", "-2", ... suffix.
+    """
 # legacy help strings
 _TRAIN_BRAIN_HELP = "The name of the BRAIN to connect to for training."
 _PREDICT_BRAIN_HELP = \
@@ -173,10 +239,19 @@ class Config(object):
         self._proxy = None
         self._retry_timeout_seconds = 300
         self._network_timeout_seconds = 60
+        self._retry_backoff_base_milliseconds = 50
+        self._retry_backoff_max_seconds = 60
+        self._brain_cache_ttl_seconds = 0
+        self.reuse_transport = False
+        self.pipeline = False
+        self.metrics_port = None
+        self.metrics_textfile = None
+        self.capture_file = None
 
         self.verbose = False
         self.record_file = None
         self.record_enabled = False
+        self.record_buffered = False
         self.file_paths = set()
         self._config_parser = RawConfigParser(allow_no_value=True)
         self._read_config()
@@ -279,6 +354,42 @@ class Config(object):
                 'Network timeout must be a positive integer.')
         self._network_timeout_seconds = value
 
+    @property
+    def retry_backoff_base(self):
+        return self._retry_backoff_base_milliseconds
+
+    @retry_backoff_base.setter
+    def retry_backoff_base(self, value):
+        value = float(value)
+        if value < 0:
+            raise ValueError(
+                'Retry backoff base must be a positive number or 0.')
+        self._retry_backoff_base_milliseconds = value
+
+    @property
+    def retry_backoff_max(self):
+        return self._retry_backoff_max_seconds
+
+    @retry_backoff_max.setter
+    def retry_backoff_max(self, value):
+        value = float(value)
+        if value < 0:
+            raise ValueError(
+                'Retry backoff maximum must be a positive number or 0.')
+        self._retry_backoff_max_seconds = value
+
+    @property
+    def brain_cache_ttl(self):
+        return self._brain_cache_ttl_seconds
+
+    @brain_cache_ttl.setter
+    def brain_cache_ttl(self, value):
+        value = float(value)
+        if value < 0:
+            raise ValueError(
+                'Brain cache TTL must be a positive number or 0.')
+        self._brain_cache_ttl_seconds = value
+
     def refresh_access_token(self):
         if self._aad_client:
             self.accesskey = self._aad_client.get_access_token()
@@ -410,10 +521,27 @@ class Config(object):
         parser.add_argument('--log', nargs='+', help=_LOG_HELP)
         parser.add_argument('--record', nargs=1, default=None,
                             help=_RECORD_HELP)
+        parser.add_argument('--record-buffered', action='store_true',
+                            help=_RECORD_BUFFERED_HELP)
         parser.add_argument('--retry-timeout', type=int,
                             help=_RETRY_TIMEOUT_HELP)
         parser.add_argument('--network-timeout', type=int,
                             help=_NETWORK_TIMEOUT_HELP)
+        parser.add_argument('--retry-backoff-base', type=float,
+                            help=_RETRY_BACKOFF_BASE_HELP)
+        parser.add_argument('--retry-backoff-max', type=float,
+                            help=_RETRY_BACKOFF_MAX_HELP)
+        parser.add_argument('--brain-cache-ttl', type=float,
+                            help=_BRAIN_CACHE_TTL_HELP)
+        parser.add_argument('--reuse-transport', action='store_true',
+                            help=_REUSE_TRANSPORT_HELP)
+        parser.add_argument('--pipeline', action='store_true',
+                            help=_PIPELINE_HELP)
+        parser.add_argument('--metrics-port', type=int,
+                            help=_METRICS_PORT_HELP)
+        parser.add_argument('--metrics-textfile',
+                            help=_METRICS_TEXTFILE_HELP)
+        parser.add_argument('--capture', help=_CAPTURE_HELP)
 
         args, remainder = parser.parse_known_args(argv[1:])
 
@@ -440,9 +568,7 @@ class Config(object):
             log.set_enable_all(args.verbose)
 
         if args.performance:
-            # logging::log().set_enabled(true);
-            # logging::log().set_enable_all_perf(true);
-            pass
+            log.set_enabled('perf')
 
         if args.log is not None:
             for domain in args.log:
@@ -452,12 +578,39 @@ class Config(object):
             self.record_file = args.record[0]
             self.record_enabled = True
 
+        if args.record_buffered:
+            self.record_buffered = True
+
         if args.retry_timeout is not None:
             self.retry_timeout = args.retry_timeout
 
         if args.network_timeout is not None:
             self.network_timeout = args.network_timeout
 
+        if args.retry_backoff_base is not None:
+            self.retry_backoff_base = args.retry_backoff_base
+
+        if args.retry_backoff_max is not None:
+            self.retry_backoff_max = args.retry_backoff_max
+
+        if args.brain_cache_ttl is not None:
+            self.brain_cache_ttl = args.brain_cache_ttl
+
+        if args.reuse_transport:
+            self.reuse_transport = True
+
+        if args.pipeline:
+            self.pipeline = True
+
+        if args.metrics_port is not None:
+            self.metrics_port = args.metrics_port
+
+        if args.metrics_textfile is not None:
+            self.metrics_textfile = args.metrics_textfile
+
+        if args.capture is not None:
+            self.capture_file = args.capture
+
         brain_version = None
         if args.predict is not None:
             if args.predict == "latest":
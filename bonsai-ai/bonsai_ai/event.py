@@ -6,6 +6,19 @@ class Event(object):
     pass
 
 
+def _to_dict(message, codec):
+    if codec is None:
+        return dict_for_message(message)
+    return codec.to_dict(message)
+
+
+def _from_dict(message, state, codec):
+    if codec is None:
+        convert_state_to_proto(message, state)
+    else:
+        codec.converter.convert(message, state)
+
+
 class EpisodeStartEvent(Event):
     """
     This event is generated at the start of a training episode.
@@ -23,9 +36,11 @@ class EpisodeStartEvent(Event):
             if state is not None:
                 event.initial_state = state
     """
-    def __init__(self, initial_properties, initial_state):
+    def __init__(self, initial_properties, initial_state, codec=None):
         self._initial_properties = initial_properties
         self._initial_state = initial_state
+        # the InklingMessageCodec of the state schema, if known
+        self._codec = codec
 
     @property
     def initial_properties(self):
@@ -33,12 +48,12 @@ class EpisodeStartEvent(Event):
 
     @property
     def initial_state(self):
-        return dict_for_message(self._initial_state)
+        return _to_dict(self._initial_state, self._codec)
 
     @initial_state.setter
     def initial_state(self, state):
         if state is not None:
-            convert_state_to_proto(self._initial_state, state)
+            _from_dict(self._initial_state, state, self._codec)
 
 
 class SimulateEvent(Event):
@@ -51,10 +66,12 @@ class SimulateEvent(Event):
         reward:   The reward calculated from the updated.
         terminal: Whether the updated state is terminal
     """
-    def __init__(self, action, sim_step, prev_step_term):
+    def __init__(self, action, sim_step, prev_step_term, codec=None):
         self._action = action
         self._sim_step = sim_step
         self._prev_step_term = prev_step_term
+        # the InklingMessageCodec of the state schema, if known
+        self._codec = codec
 
     @property
     def action(self):
@@ -62,12 +79,12 @@ class SimulateEvent(Event):
 
     @property
     def state(self):
-        return dict_for_message(self._sim_step.state)
+        return _to_dict(self._sim_step.state, self._codec)
 
     @state.setter
     def state(self, state):
         if state is not None:
-            convert_state_to_proto(self._sim_step.state, state)
+            _from_dict(self._sim_step.state, state, self._codec)
 
     @property
     def reward(self):
@@ -1,20 +1,111 @@
 # Copyright (C) 2018 Bonsai, Inc.
 
-import uuid
 import os
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock, RLock
 
 # protobuf
 from google.protobuf.descriptor_pb2 import FileDescriptorProto
 from google.protobuf.message_factory import MessageFactory
-from google.protobuf.json_format import MessageToJson
 
 # bonsai
+from bonsai_ai.common.proto_to_state import MessageDecoder
+from bonsai_ai.common.state_to_proto import StateConverter
 from bonsai_ai.proto import inkling_types_pb2
 
+# number of schemas an InklingMessageFactory keeps compiled by default
+DEFAULT_MAX_SCHEMAS = 256
+
+
+class InklingMessageCodec(object):
+    """
+    Compiled form of a single Inkling schema.
+
+    A codec is built once per `DescriptorProto` by
+    `InklingMessageFactory.codec_for_proto` and holds everything needed to
+    create, parse and unpack messages of that schema, so that the per-step
+    path never has to consult the descriptor pool again.
+
+    Attributes:
+        message_cls: The generated protobuf message class.
+        fields:      Tuple of `FieldDescriptor`s, in schema order.
+        field_names: Tuple of field names, in schema order.
+        converter:   The `StateConverter` that fills messages of this
+                     schema from dictionaries.
+        decoder:     The `MessageDecoder` that unpacks messages of this
+                     schema into dictionaries, records or NumPy rows.
+    """
+    def __init__(self, message_cls):
+        self.message_cls = message_cls
+        self.fields = tuple(message_cls.DESCRIPTOR.fields)
+        self.field_names = tuple(f.name for f in self.fields)
+        # kept only here, so that they are evicted with the codec
+        self.converter = StateConverter(message_cls.DESCRIPTOR)
+        self.decoder = MessageDecoder(message_cls.DESCRIPTOR)
+
+    def new_message(self):
+        """ Returns an empty message for this schema """
+        return self.message_cls()
+
+    def parse(self, data):
+        """ Returns a message for this schema parsed from `data` """
+        message = self.message_cls()
+        message.ParseFromString(data)
+        return message
+
+    def to_dict(self, message):
+        """ Unpacks a message of this schema into a dictionary """
+        return self.decoder.to_dict(message)
+
+    def decode(self, data, fmt='dict'):
+        """ Parses `data` and unpacks it in the format `fmt`, one of
+        'dict', 'record' or 'numpy' """
+        return self.decoder.decode(self.parse(data), fmt)
+
+    def from_dict(self, state):
+        """ Returns a message for this schema filled from `state` """
+        message = self.message_cls()
+        self.converter.convert(message, state)
+        return message
+
 
 class InklingMessageFactory(object):
-    def __init__(self):
+    """
+    Compiles Inkling schemas into `InklingMessageCodec`s.
+
+    Each distinct schema is compiled once, into a package named after a
+    fingerprint of its serialized `DescriptorProto`, so that an equal
+    schema received again (after a reconnect, or by another simulator)
+    maps onto the message class already in the descriptor pool. At most
+    `max_size` codecs are kept, least recently used first out; once the
+    descriptor pool has seen `max_size` schemas it is replaced by a fresh
+    one, so that its size stays bounded as well. Codecs in use keep their
+    message classes alive regardless. All methods are thread safe.
+
+    `shared_factory()` returns the instance shared by all simulators and
+    predictors of the process.
+    """
+    def __init__(self, max_size=DEFAULT_MAX_SCHEMAS):
+        if max_size < 1:
+            raise ValueError(
+                "max_size must be at least 1, got {}".format(max_size))
+        self.max_size = max_size
+        self._lock = RLock()
+        self._new_message_factory()
+
+        # compiled codecs, keyed by serialized DescriptorProto
+        self._codecs = OrderedDict()
+        # front cache keyed by DescriptorProto identity; each entry pins
+        # its DescriptorProto, so that the id cannot be reused
+        self._codecs_by_id = OrderedDict()
+
+    def __len__(self):
+        return len(self._codecs)
+
+    def _new_message_factory(self):
         self._message_factory = MessageFactory()
+        self._pool_schemas = 0
         inkling_file_desc = FileDescriptorProto()
         inkling_types_pb2.DESCRIPTOR.CopyToProto(inkling_file_desc)
         self._message_factory.pool.Add(inkling_file_desc)
@@ -22,14 +113,57 @@ class InklingMessageFactory(object):
     def message_for_dynamic_message(self, dynamic_msg, desc_proto):
         if desc_proto is None:
             return None
-        message = self.new_message_from_proto(desc_proto)
-        message.ParseFromString(dynamic_msg)
-        return message
+        return self.codec_for_proto(desc_proto).parse(dynamic_msg)
 
     def new_message_from_proto(self, desc_proto):
-        # TODO(oren.leiman): in sdk1, this happens once for each
-        # DescriptorProto. Profile and consider refactoring.
-        package = self._create_package_name(desc_proto)
+        return self.codec_for_proto(desc_proto).new_message()
+
+    def codec_for_proto(self, desc_proto):
+        """
+        Returns the `InklingMessageCodec` for the given `DescriptorProto`,
+        compiling it on first use. Lookups of a `DescriptorProto` object
+        seen before only cost a dictionary access; an equal schema in a
+        new object costs one serialization. The `DescriptorProto` must not
+        be modified once it has been passed in.
+        """
+        if desc_proto is None:
+            return None
+        with self._lock:
+            entry = self._codecs_by_id.get(id(desc_proto))
+            if entry is not None and entry[0] is desc_proto:
+                self._codecs_by_id.move_to_end(id(desc_proto))
+                self._remember(entry[2], entry[1])
+                return entry[1]
+
+            if not desc_proto.name:
+                named = type(desc_proto)()
+                named.CopyFrom(desc_proto)
+                named.name = '__INTERNAL_ANONYMOUS__'
+            else:
+                named = desc_proto
+
+            key = named.SerializeToString()
+            codec = self._codecs.get(key)
+            if codec is None:
+                message_cls = self._message_cls_for_proto(named, key)
+                codec = InklingMessageCodec(message_cls)
+            self._remember(key, codec)
+
+            self._codecs_by_id[id(desc_proto)] = (desc_proto, codec, key)
+            if len(self._codecs_by_id) > self.max_size:
+                self._codecs_by_id.popitem(last=False)
+            return codec
+
+    def _remember(self, key, codec):
+        """ Marks `codec` as most recently used, evicting the least
+        recently used codec if the cache is full """
+        self._codecs[key] = codec
+        self._codecs.move_to_end(key)
+        if len(self._codecs) > self.max_size:
+            self._codecs.popitem(last=False)
+
+    def _message_cls_for_proto(self, desc_proto, key):
+        package = 'p' + sha1(key).hexdigest()
         desc = self._find_descriptor(desc_proto, package)
         if desc is None:
             raise Exception(
@@ -40,27 +174,24 @@ class InklingMessageFactory(object):
             raise Exception(
                 "new_message_from_proto: unable to get prototype")
 
-        return message_cls()
-
-    def _create_package_name(self, desc_proto):
-        if not desc_proto.name:
-            desc_proto.name = '__INTERNAL_ANONYMOUS__'
-        desc_proto_str = MessageToJson(desc_proto)
-        signature = hash(desc_proto_str)
-        return 'p{}'.format(signature).replace('-', '_')
+        return message_cls
 
     def _find_descriptor(self, desc_proto, package):
         if desc_proto is None:
             return None
         full_name = '{}.{}'.format(package, desc_proto.name)
-        pool = self._message_factory.pool
         try:
-            return pool.FindMessageTypeByName(full_name)
+            return self._message_factory.pool.FindMessageTypeByName(
+                full_name)
         except KeyError:
             pass
 
-        proto_name = str(uuid.uuid4())
-        proto_path = os.path.join(package, proto_name + '.proto')
+        if self._pool_schemas >= self.max_size:
+            self._new_message_factory()
+        pool = self._message_factory.pool
+
+        # the package is unique per schema, so one file name suffices
+        proto_path = os.path.join(package, 'schema.proto')
         file_desc_proto = FileDescriptorProto()
         file_desc_proto.message_type.add().MergeFrom(desc_proto)
         file_desc_proto.name = proto_path
@@ -71,5 +202,19 @@ class InklingMessageFactory(object):
         file_desc_proto.public_dependency.append(0)
 
         pool.Add(file_desc_proto)
+        self._pool_schemas += 1
         result = pool.FindFileByName(proto_path)
         return result.message_types_by_name[desc_proto.name]
+
+
+_shared_factory = None
+_shared_factory_lock = Lock()
+
+
+def shared_factory():
+    """ Returns the process-wide `InklingMessageFactory` """
+    global _shared_factory
+    with _shared_factory_lock:
+        if _shared_factory is None:
+            _shared_factory = InklingMessageFactory()
+        return _shared_factory
@@ -1,33 +1,108 @@
 # Copyright (C) 2018 Bonsai, Inc.
 
+import sys
+from array import array
 from struct import pack
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# weights for the relative luminance of linear RGB, according to
+# https://en.wikipedia.org/wiki/Relative_luminance
+_RGB_WEIGHTS = (0.2126, 0.7152, 0.0722)
+
 
 class Luminance(object):
-    """This class represents the inkling built in Luminance type."""
+    """This class represents the inkling built in Luminance type.
+
+    Pixels are stored as float32 little-endian bytes. They may be given as
+    such bytes, as a NumPy array, as any other object supporting the buffer
+    protocol (`array.array('f')`, `memoryview`), or as an iterable of
+    numbers. NumPy arrays and buffers are converted without per-pixel
+    Python code.
+    """
 
     def __init__(self, width, height, pixels):
         if type(pixels) is bytes:
-            if len(pixels) != width * height * 4:
-                raise ValueError(
-                    "Argument pixels has length {}, should be of length "
-                    "{}".format(len(pixels), width * height * 4))
+            self._check_length(len(pixels), width * height * 4)
             self.pixels = pixels
+        elif numpy is not None and isinstance(pixels, numpy.ndarray):
+            self._check_length(pixels.size, width * height)
+            self.pixels = numpy.ascontiguousarray(
+                pixels, dtype='<f4').tobytes()
         else:
-            try:  # Assume iterable
-                if len(pixels) != width * height:
-                    raise ValueError(
-                        "Argument pixels has length {}, should be of length "
-                        "{}".format(len(pixels), width * height))
-                self.pixels = pack('%sf' % len(pixels), *pixels)
-            except TypeError:  # Catch failure
-                raise TypeError(
-                    "Argument pixels has type {}, should be type "
-                    "bytes or iterable".format(type(pixels)))
+            try:
+                view = memoryview(pixels)
+            except TypeError:
+                view = None
+
+            if view is not None:
+                self.pixels = self._pack_buffer(view, width * height)
+            else:
+                try:  # Assume iterable
+                    self._check_length(len(pixels), width * height)
+                    self.pixels = pack('<%sf' % len(pixels), *pixels)
+                except TypeError:  # Catch failure
+                    raise TypeError(
+                        "Argument pixels has type {}, should be type "
+                        "bytes, buffer or iterable".format(type(pixels)))
 
         self.width = width
         self.height = height
 
+    @staticmethod
+    def _check_length(length, expected):
+        if length != expected:
+            raise ValueError(
+                "Argument pixels has length {}, should be of length "
+                "{}".format(length, expected))
+
+    @classmethod
+    def _pack_buffer(cls, view, count):
+        """ Returns float32 little-endian bytes for a buffer. Only `bytes`
+        are taken as packed floats; the items of any other buffer, such as
+        a bytearray, are pixel values. """
+        cls._check_length(view.nbytes // view.itemsize, count)
+        if view.format == 'f' and sys.byteorder == 'little':
+            return view.tobytes()
+
+        floats = array('f', memoryview(view.tobytes()).cast(view.format))
+        if sys.byteorder != 'little':
+            floats.byteswap()
+        return floats.tobytes()
+
+    @classmethod
+    def from_array(cls, pixels):
+        """Constructs a Luminance class from a 2-D array of shape
+        (height, width), such as a NumPy array or a 2-D memoryview.
+        """
+        shape = getattr(pixels, 'shape', None)
+        if shape is None or len(shape) != 2:
+            raise ValueError(
+                "Argument pixels must be 2-D, got shape {}".format(shape))
+        return cls(shape[1], shape[0], pixels)
+
+    @classmethod
+    def from_rgb_array(cls, rgb, scale=1.0 / 255):
+        """Constructs a Luminance class from a NumPy array of shape
+        (height, width, 3) or (height, width, 4) holding RGB(A) pixels.
+        The relative luminance of each pixel is multiplied by `scale`,
+        which by default maps 8-bit channels to [0, 1]. Requires NumPy.
+        """
+        if numpy is None:
+            raise ImportError("Luminance.from_rgb_array requires numpy")
+        rgb = numpy.asarray(rgb)
+        if rgb.ndim != 3 or rgb.shape[2] not in (3, 4):
+            raise ValueError(
+                "Argument rgb must have shape (height, width, 3 or 4), "
+                "got {}".format(rgb.shape))
+        weights = numpy.array(_RGB_WEIGHTS, dtype='f4') * scale
+        luminance = numpy.dot(rgb[:, :, :3], weights).astype('<f4')
+        return cls.from_array(luminance)
+
     @classmethod
     def from_pil_luminance_image(cls, image):
         """Constructs a Luminance class from the input PIL image. The
@@ -35,5 +110,9 @@ class Luminance(object):
         """
         if image.mode != "L":
             raise ValueError("Argument image must have mode 'L'")
-        pixels = [x / 255 for x in image.tobytes()]
+        if numpy is not None:
+            pixels = numpy.frombuffer(image.tobytes(), dtype=numpy.uint8)
+            pixels = pixels.astype('<f4') / 255
+        else:
+            pixels = [x / 255 for x in image.tobytes()]
         return cls(image.size[0], image.size[1], pixels)
@@ -4,6 +4,19 @@ from time import time
 from typing import Any, Dict, Optional
 
 
+def _noop(msg, *args):
+    return None
+
+
+def _format(msg, args):
+    """ Builds a deferred log message """
+    if callable(msg):
+        msg = msg()
+    if args:
+        msg = msg % args
+    return msg
+
+
 class Logger:
     """
     Entry point for runtime logging to custom and predefined domains.
@@ -25,6 +38,20 @@ class Logger:
     def bar(*args, **kwargs):
         log.mydomain("Hello, World!")
     ```
+
+    Messages that are expensive to build should be deferred so that
+    disabled domains cost close to nothing. A domain accepts %-style
+    arguments, which are only interpolated when the domain is enabled, or
+    a callable returning the message, which is only called when the domain
+    is enabled. `Logger.is_enabled` can be used to guard larger blocks.
+
+    ```
+    log.mydomain("state: %s", state)
+    log.mydomain(lambda: "state: {}".format(expensive(state)))
+
+    if log.is_enabled("mydomain"):
+        ...
+    ```
     """
 
     _impl = None # type: Optional[Dict[str, Any]]
@@ -43,10 +70,19 @@ class Logger:
     def __getattr__(self, attr):
         if self._enable_all or self._enabled_keys.get(attr, False):
             ts = datetime.fromtimestamp(time()).strftime("%Y-%m-%d %H:%M:%S")
-            return lambda msg: \
-                sys.stderr.write("[{0}][{1}] {2}\n".format(ts, attr, msg))
+            return lambda msg, *args: sys.stderr.write(
+                "[{0}][{1}] {2}\n".format(ts, attr, _format(msg, args)))
         else:
-            return lambda msg: None
+            return _noop
+
+    def is_enabled(self, key):
+        """
+        Returns True if the given logging domain is enabled.
+
+        Arguments:
+            key: `string`
+        """
+        return self._enable_all or self._enabled_keys.get(key, False)
 
     def set_enabled(self, key, enable=True):
         """
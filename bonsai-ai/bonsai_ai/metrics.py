@@ -0,0 +1,322 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+import atexit
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from weakref import WeakSet
+
+from bonsai_ai.logger import Logger
+
+log = Logger()
+
+OPENMETRICS_CONTENT_TYPE = \
+    'application/openmetrics-text; version=1.0.0; charset=utf-8'
+TEXT_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# seconds between the writes of a textfile
+TEXTFILE_INTERVAL = 15.0
+
+# (name, type, help, value of a simulator) of the counters and gauges
+_SCALARS = (
+    ('episodes', 'counter', 'Completed episodes.',
+     lambda sim: sim.episode_count),
+    ('iterations', 'counter', 'Simulation steps or predictions.',
+     lambda sim: sim._iteration_total),
+    ('episode_reward', 'gauge', 'Reward of the current episode so far.',
+     lambda sim: sim.episode_reward),
+    ('episode_rate', 'gauge', 'Episodes per second, a moving average.',
+     lambda sim: sim._episode_rate.rate),
+    ('iteration_rate', 'gauge', 'Iterations per second, a moving average.',
+     lambda sim: sim._iteration_rate.rate),
+    ('reconnects', 'counter', 'Connections made after the first.',
+     lambda sim: max(sim._impl._sim_connection.connects - 1, 0)),
+    ('disconnects', 'counter', 'Connections lost or closed by the server.',
+     lambda sim: sim._impl._sim_connection.disconnects),
+    ('sent_bytes', 'counter', 'Bytes sent to the server.',
+     lambda sim: sim._impl._sent_sizes.total),
+    ('received_bytes', 'counter', 'Bytes received from the server.',
+     lambda sim: sim._impl._received_sizes.total),
+)
+
+# (name, help, (extra labels, Histogram) pairs of a simulator)
+_HISTOGRAMS = (
+    ('sent_message_size_bytes', 'Sizes of the messages sent.',
+     lambda sim: [((), sim._impl._sent_sizes)]),
+    ('received_message_size_bytes', 'Sizes of the messages received.',
+     lambda sim: [((), sim._impl._received_sizes)]),
+    ('step_seconds', 'Time of a whole step, between successive messages '
+     'sent to the server.',
+     lambda sim: [((), sim._timings.step())]),
+    ('step_phase_seconds', 'Time spent in each phase of a step.',
+     lambda sim: [((('phase', phase),), histogram) for phase, histogram
+                  in sim._timings.histograms().items()]),
+)
+
+_UNITS = ('bytes', 'seconds')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace(
+        '"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    return '{' + ','.join(
+        '{}="{}"'.format(name, _escape(value))
+        for name, value in labels) + '}'
+
+
+def _number(value):
+    if isinstance(value, int):
+        return str(value)
+    value = float(value)
+    return '+Inf' if value == float('inf') else repr(value)
+
+
+class _HTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    exporter = None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        openmetrics = 'application/openmetrics-text' in \
+            self.headers.get('Accept', '')
+        body = self.server.exporter.render(openmetrics).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', OPENMETRICS_CONTENT_TYPE
+                         if openmetrics else TEXT_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.metrics(format, *args)
+
+
+class MetricsExporter(object):
+    """
+    Publishes the statistics of simulators and predictors for scrape-based
+    monitoring, such as Prometheus.
+
+    Each simulator is labelled by `brain`, `simulator`, `sim_id` and `mode`
+    ('train' or 'predict'), plus the constant `labels` given. The metrics
+    are its episode and iteration counters and rates, reconnects and
+    disconnects, bytes sent and received, and histograms of message sizes
+    and of the time of a whole step and of each of its phases (see
+    `Simulator.timings`).
+
+    The statistics are served over HTTP by `serve`, in the OpenMetrics
+    text format or, for scrapers that do not ask for it, the Prometheus
+    text format. `write_textfile` and `start_textfile` write them to a
+    file instead, for the node exporter textfile collector.
+
+    Simulators configured with `--metrics-port` or `--metrics-textfile`
+    are added to a process-wide exporter, see `default_exporter`.
+
+    Arguments:
+        namespace: Prefix of the metric names.
+        labels:    A dictionary of labels added to every metric.
+
+    Example:
+        exporter = bonsai_ai.MetricsExporter(labels={'rack': 'r7'})
+        exporter.serve(9464)
+        for sim in sims:
+            exporter.add(sim)
+    """
+    def __init__(self, namespace='bonsai_sim', labels=None):
+        self.namespace = namespace
+        self.labels = tuple(sorted((labels or {}).items()))
+        self.port = None
+        self.textfile = None
+        self._sims = WeakSet()
+        self._sims_lock = threading.Lock()
+        self._server = None
+        self._stop_textfile = None
+        self._threads = []
+
+    def add(self, sim):
+        """ Publishes the statistics of `sim` until it is garbage
+        collected or discarded """
+        with self._sims_lock:
+            self._sims.add(sim)
+
+    def discard(self, sim):
+        """ Stops publishing the statistics of `sim` """
+        with self._sims_lock:
+            self._sims.discard(sim)
+
+    def _sim_labels(self, sim):
+        return self.labels + (
+            ('brain', sim.brain.name or ''),
+            ('simulator', sim.name),
+            ('sim_id', sim._impl._sim_id),
+            ('mode', 'predict' if sim.predict else 'train'),
+        )
+
+    def _header(self, lines, family, kind, help, openmetrics):
+        lines.append('# HELP {} {}'.format(family, help))
+        lines.append('# TYPE {} {}'.format(family, kind))
+        unit = family.rsplit('_', 1)[-1]
+        if openmetrics and unit in _UNITS:
+            lines.append('# UNIT {} {}'.format(family, unit))
+
+    def render(self, openmetrics=True):
+        """ Returns the statistics of every simulator, in the OpenMetrics
+        text format, or in the Prometheus text format """
+        with self._sims_lock:
+            sims = list(self._sims)
+        sims = [(self._sim_labels(sim), sim) for sim in sims]
+        lines = []
+        for name, kind, help, value in _SCALARS:
+            family = '{}_{}'.format(self.namespace, name)
+            sample = family + '_total' if kind == 'counter' else family
+            # the Prometheus format names counters by their sample
+            self._header(lines, family if openmetrics else sample, kind,
+                         help, openmetrics)
+            for labels, sim in sims:
+                lines.append('{}{} {}'.format(
+                    sample, _labels(labels), _number(value(sim))))
+
+        for name, help, histograms in _HISTOGRAMS:
+            family = '{}_{}'.format(self.namespace, name)
+            self._header(lines, family, 'histogram', help, openmetrics)
+            for labels, sim in sims:
+                for extra, histogram in histograms(sim):
+                    labels_ = labels + extra
+                    buckets = histogram.buckets()
+                    for bound, count in buckets:
+                        le = (('le', _number(float(bound))),)
+                        lines.append('{}_bucket{} {}'.format(
+                            family, _labels(labels_ + le), count))
+                    lines.append('{}_count{} {}'.format(
+                        family, _labels(labels_), buckets[-1][1]))
+                    lines.append('{}_sum{} {}'.format(
+                        family, _labels(labels_), _number(histogram.total)))
+
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port=9464, host=''):
+        """ Serves the statistics on http://host:port/metrics from a
+        background thread. A port of 0 picks a free port. Returns the
+        port. """
+        if self._server is not None:
+            raise RuntimeError(
+                'Already serving on port {}'.format(self.port))
+        server = _HTTPServer((host, port), _Handler)
+        server.exporter = self
+        self._server = server
+        self.port = server.server_address[1]
+        self._start(server.serve_forever)
+        log.info('Serving metrics on port {} for process {}'.format(
+            self.port, os.getpid()))
+        return self.port
+
+    def write_textfile(self, path):
+        """ Writes the statistics to `path`, in the Prometheus text format.
+        The file is replaced atomically. "{pid}" in `path` is replaced by
+        the process ID. """
+        path = path.replace('{pid}', str(os.getpid()))
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp, 'w') as f:
+            f.write(self.render(openmetrics=False))
+        os.replace(temp, path)
+
+    def start_textfile(self, path, interval=TEXTFILE_INTERVAL):
+        """ Writes the statistics to `path` every `interval` seconds from a
+        background thread, and once more on `stop` or at exit """
+        if self._stop_textfile is not None:
+            raise RuntimeError(
+                'Already writing to {}'.format(self.textfile))
+        self.textfile = path
+        stop = self._stop_textfile = threading.Event()
+
+        def write_periodically():
+            while not stop.wait(interval):
+                self._write_textfile_safely()
+
+        self._start(write_periodically)
+        atexit.register(self.stop)
+
+    def _write_textfile_safely(self):
+        try:
+            self.write_textfile(self.textfile)
+        except (OSError, IOError) as e:
+            log.error('Failed to write metrics to {}: {}'.format(
+                self.textfile, e))
+
+    def _start(self, target):
+        thread = threading.Thread(
+            target=target, name='MetricsExporter', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self):
+        """ Stops serving and writing, writing the textfile a last time """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            self.port = None
+        if self._stop_textfile is not None:
+            self._stop_textfile.set()
+            self._stop_textfile = None
+            self._write_textfile_safely()
+            self.textfile = None
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+_default_exporter = None
+_default_lock = threading.Lock()
+# the port the default exporter failed to serve on, not tried again
+_failed_port = None
+
+
+def default_exporter():
+    """ Returns the process-wide MetricsExporter, which simulators
+    configured with `--metrics-port` or `--metrics-textfile` are added to
+    """
+    global _default_exporter
+    with _default_lock:
+        if _default_exporter is None:
+            _default_exporter = MetricsExporter()
+        return _default_exporter
+
+
+def register(sim):
+    """ Adds `sim` to the default exporter if its configuration asks for
+    metrics, starting to serve or write them on first use. The first
+    port and textfile configured in a process are used. A port that
+    cannot be bound, such as one already served by another process, is
+    logged and not retried; the simulator runs without serving metrics.
+    """
+    global _failed_port
+    config = sim.brain.config
+    port = config.metrics_port
+    textfile = config.metrics_textfile
+    if port is None and not textfile:
+        return
+    exporter = default_exporter()
+    with _default_lock:
+        if port is not None and exporter.port is None and \
+                port != _failed_port:
+            try:
+                exporter.serve(port)
+            except OSError as e:
+                _failed_port = port
+                log.error(
+                    'Failed to serve metrics on port {}: {}. Use '
+                    '--metrics-port=0 to serve each process on a free '
+                    'port.'.format(port, e))
+        if textfile and exporter.textfile is None:
+            exporter.start_textfile(textfile)
+    exporter.add(sim)
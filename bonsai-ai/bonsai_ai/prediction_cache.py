@@ -0,0 +1,169 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+import time
+from collections import OrderedDict
+from copy import copy
+
+from google.protobuf.descriptor import FieldDescriptor
+
+
+# protobuf types whose values are bucketed by a numeric resolution
+_FLOAT_CPPTYPES = (FieldDescriptor.CPPTYPE_DOUBLE,
+                   FieldDescriptor.CPPTYPE_FLOAT)
+
+
+def _exact(value):
+    return value
+
+
+def _bucket(step):
+    def bucket(value):
+        return round(float(value) / step)
+    return bucket
+
+
+def _embedded(value):
+    """ Key for a Luminance, or a 2-D array standing in for one """
+    pixels = getattr(value, 'pixels', None)
+    if pixels is not None:
+        return (value.width, value.height, pixels)
+    return (value.shape, value.tobytes())
+
+
+class PredictionCache(object):
+    """
+    A local cache of the actions a `Predictor` received for each state.
+
+    States are looked up by a key built from the fields of the output
+    schema. With a `resolution`, the values of float fields are bucketed
+    first, so that states which differ by less than the resolution share
+    an action. Other fields are compared exactly. Only use a cache with
+    BRAIN versions whose predictions are deterministic.
+
+    At most `maxsize` actions are kept, least recently used first out,
+    and actions older than `ttl` seconds are fetched again.
+
+    Arguments:
+        maxsize:    The maximum number of cached actions.
+        ttl:        Seconds for which an action is served from the cache,
+                    or None to keep actions until they are evicted.
+        resolution: None to compare float fields exactly, a number to
+                    bucket every float field by that step, or a dict
+                    mapping field names to a step, or to a function
+                    returning the bucket of a value. Fields missing from
+                    the dict are compared exactly.
+
+    Attributes:
+        hits:        Number of lookups served from the cache.
+        misses:      Number of lookups sent to the server.
+        evictions:   Number of actions evicted because the cache was full.
+        expirations: Number of actions dropped because they were too old.
+
+    Example:
+        cache = bonsai_ai.PredictionCache(
+            maxsize=10000, resolution={'angle': 0.01, 'velocity': 0.1})
+        predictor = bonsai_ai.Predictor(brain, 'my_simulator', cache=cache)
+    """
+    def __init__(self, maxsize=1024, ttl=None, resolution=None):
+        if maxsize < 1:
+            raise ValueError(
+                "maxsize must be at least 1, got {}".format(maxsize))
+        if ttl is not None and ttl <= 0:
+            raise ValueError("ttl must be positive, got {}".format(ttl))
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.resolution = resolution
+        self._entries = OrderedDict()
+        self._fields = None
+        self._schema = None
+        self._keyers = ()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _quantizer(self, field):
+        if field.type == field.TYPE_MESSAGE:
+            return _embedded
+        resolution = self.resolution
+        if isinstance(resolution, dict):
+            step = resolution.get(field.name)
+            if callable(step):
+                return step
+        elif field.cpp_type in _FLOAT_CPPTYPES:
+            step = resolution
+        else:
+            step = None
+        return _bucket(step) if step else _exact
+
+    def compile(self, fields):
+        """ Prepares the cache for states with the given `FieldDescriptor`s.
+        Actions cached for another schema are dropped. """
+        if fields is self._fields:
+            return
+        self._fields = fields
+        schema = tuple((field.name, field.type) for field in fields)
+        if schema == self._schema:
+            return
+        self._schema = schema
+        self._keyers = tuple(
+            (field.name, self._quantizer(field)) for field in fields)
+        self._entries.clear()
+
+    def key(self, state):
+        """ Returns the cache key of `state`, or None if it has no key, for
+        instance because a field is missing """
+        try:
+            return tuple(
+                quantize(state[name]) for name, quantize in self._keyers)
+        except (KeyError, TypeError, AttributeError, ValueError):
+            return None
+
+    def get(self, key):
+        """ Returns the action cached for `key`, or None """
+        entry = self._entries.get(key) if key is not None else None
+        if entry is None:
+            self.misses += 1
+            return None
+        action, expires = entry
+        if expires is not None and time.monotonic() >= expires:
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return copy(action)
+
+    def put(self, key, action):
+        """ Caches `action` for `key`, unless `key` is None """
+        if key is None:
+            return
+        expires = None
+        if self.ttl is not None:
+            expires = time.monotonic() + self.ttl
+        self._entries[key] = (copy(action), expires)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """ Drops every cached action, keeping the statistics """
+        self._entries.clear()
+
+    def stats(self):
+        """ Returns a dictionary of cache statistics """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+        }
@@ -1,6 +1,8 @@
+from bonsai_ai.exceptions import BonsaiClientError, BonsaiServerError, \
+    SimStateError
 from bonsai_ai.simulator import Simulator
+from bonsai_ai.simulator_connection import run_until_complete
 from bonsai_ai.logger import Logger
-from bonsai_ai.proto.generator_simulator_api_pb2 import ServerToSimulator
 
 log = Logger()
 
@@ -20,6 +22,8 @@ class Predictor(Simulator):
         brain:      The BRAIN to connect to.
         name:       The name of this Simulator. Must match simulator
                     in inkling.
+        cache:      The `PredictionCache` serving repeated states, or
+                    None.
 
     Example Inkling:
         simulator my_simulator(Config)
@@ -36,6 +40,7 @@ class Predictor(Simulator):
 
             with predictor:
                 action = predictor.get_action(state)
+                actions = predictor.get_actions([state_a, state_b])
 
         Without context manager:
             config = bonsai_ai.Config(sys.argv)
@@ -44,18 +49,25 @@ class Predictor(Simulator):
 
             action = predictor.get_action(state)
             predictor.close()
+
+        From within a running event loop:
+            async with Predictor(brain, "my_simulator") as predictor:
+                action = await predictor.aget_action(state)
     """
 
-    def __init__(self, brain, name):
+    def __init__(self, brain, name, cache=None):
         """
         Constructs the Simulator class.
 
         Arguments:
             brain: The BRAIN you wish to predict against.
             name:  The Simulator name. Must match the name in Inkling.
+            cache: An optional `PredictionCache`, to serve repeated
+                   states locally.
         """
         super(Predictor, self).__init__(brain, name)
 
+        self.cache = cache
         self._state = {}
 
     def __enter__(self):
@@ -64,6 +76,12 @@ class Predictor(Simulator):
     def __exit__(self, *args):
         self.close()
 
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
     @property
     def predict(self):
         return True
@@ -78,11 +96,105 @@ class Predictor(Simulator):
         """ Returns an action for a given state """
         if state is not None:
             self._state = state
+        actions = self.get_actions([self._state])
+        return actions[0] if actions else None
+
+    async def aget_action(self, state):
+        """ Coroutine version of `get_action`, for use from within a
+        running event loop """
+        if state is not None:
+            self._state = state
+        actions = await self.aget_actions([self._state])
+        return actions[0] if actions else None
 
-        if self._impl._prev_message_type == ServerToSimulator.UNKNOWN:
-            self.run()
+    def get_actions(self, states):
+        """
+        Returns the actions for a batch of states, in the same order.
 
+        All states are sent to the server in a single message, and all
+        actions arrive in its reply, so a batch costs one round trip.
+        With a `cache`, only the states missing from it are sent, and a
+        batch found in the cache entirely is served without a round trip.
 
-        self.run()
+        Arguments:
+            states: A sequence of states, each as accepted by `get_action`.
 
-        return self._impl._predictor_action
+        Returns:
+            A list with one action per state, or None if the connection
+            to the server was lost.
+        """
+        states = list(states)
+        keys, actions = self._lookup(states)
+        if keys is not None and None not in actions:
+            return actions
+        return run_until_complete(
+            self._ioloop, self._predict_async(states, keys, actions))
+
+    async def aget_actions(self, states):
+        """ Coroutine version of `get_actions`, for use from within a
+        running event loop """
+        self._attach_running_loop()
+        states = list(states)
+        keys, actions = self._lookup(states)
+        if keys is not None and None not in actions:
+            return actions
+        return await self._predict_async(states, keys, actions)
+
+    def _lookup(self, states):
+        """ Looks `states` up in the cache. Returns their keys and actions,
+        with None for each miss, or (None, None) without a cache or before
+        the output schema is known. """
+        cache = self.cache
+        codec = self._impl._output_codec
+        if cache is None or codec is None:
+            return None, None
+        cache.compile(codec.fields)
+        keys = [cache.key(state) for state in states]
+        return keys, [cache.get(key) for key in keys]
+
+    async def _predict_async(self, states, keys=None, actions=None):
+        if actions is None:
+            actions = [None] * len(states)
+        missing = [i for i, action in enumerate(actions) if action is None]
+
+        fetched = None
+        try:
+            fetched = await self._impl.predict([states[i] for i in missing])
+        except BonsaiClientError as e:
+            log.error(e)
+            raise e.original_exception
+        except BonsaiServerError as e:
+            log.error(e)
+        except SimStateError as e:
+            log.error(e)
+            raise e
+        finally:
+            if fetched is None:
+                await self._finish_async()
+        if fetched is None:
+            return None
+
+        cache = self.cache
+        if cache is not None and keys is None:
+            # the first batch also registers, and so has no keys yet
+            cache.compile(self._impl._output_codec.fields)
+            keys = [cache.key(state) for state in states]
+            cache.misses += len(states)
+        for i, action in zip(missing, fetched):
+            actions[i] = action
+            if cache is not None:
+                cache.put(keys[i], action)
+        return actions
+
+    def _on_predict(self, states, actions):
+        """ Callback hook for a batch of predictions, called by
+        Simulator_WS.predict """
+        count = len(actions)
+        self._iteration_rate.update(count)
+        self.iteration_count += count
+        self._iteration_total += count
+
+        if self.writer is not None:
+            for state, action in zip(states, actions):
+                self._record_state(state, action)
+                self.flush_record()
@@ -1,15 +1,19 @@
 # Copyright (C) 2018 Bonsai, Inc.
 from datetime import datetime
-from time import time
+from time import perf_counter, time
+from inspect import isawaitable
 from typing import Any, Tuple
 
 import asyncio
 
 from bonsai_ai.exceptions import BonsaiClientError, SimStateError, \
-    BonsaiServerError
+    BonsaiServerError, UsageError
 from bonsai_ai.logger import Logger
+from bonsai_ai import metrics
+from bonsai_ai.simulator_connection import run_until_complete
 from bonsai_ai.simulator_ws import Simulator_WS
-from bonsai_ai.writer import JSONWriter, CSVWriter
+from bonsai_ai.timings import StepTimings
+from bonsai_ai.writer import JSONWriter, CSVWriter, NpzWriter, ParquetWriter
 from bonsai_ai.event import FinishedEvent
 
 log = Logger()
@@ -25,12 +29,12 @@ class _RateCounter(object):
     def __init__(self):
         self.reset()
 
-    def update(self):
+    def update(self, count=1):
         """
         Call this at intervals to update the counter and rate.
         Uses an exponetial moving average.
         """
-        self.count += 1
+        self.count += count
         delta = (time() - self.start)
         if delta != 0:
             average = self.count / delta
@@ -69,6 +73,10 @@ class Simulator(object):
         episode_rate:   Episodes per second. R/O
         iteration_count: Number of iterations for this episode.
         iteration_rate: Iterations per second
+        action_format:  How actions are passed to `simulate`: 'dict' (the
+                        default), 'record' for a named tuple whose items can
+                        also be read by field name, or 'numpy' for a NumPy
+                        structured scalar.
 
     Example Inkling:
         simulator my_simulator(Config)
@@ -106,9 +114,16 @@ class Simulator(object):
 
     WRITERS = {
         '.json': JSONWriter,
-        '.csv': CSVWriter
+        '.csv': CSVWriter,
+        '.npz': NpzWriter,
+        '.parquet': ParquetWriter
     }
 
+    action_format = 'dict'
+
+    # True for simulators that step all pending predictions in one call
+    _batched = False
+
     def __init__(self, brain, name):
         """
         Constructs the Simulator class.
@@ -121,11 +136,13 @@ class Simulator(object):
         self.brain = brain
         self.writer = None
         self._construct_writer()
-        # Every simulator requires its own event loop, so that heartbeat tasks
-        # do not conflict with one another. Loops may be idle for arbitrarily
-        # long periods of time - if sim B awakens the loop while sim A is not
-        # currently being read, sim A's heartbeat disconnect will trip.
+        self._timings = StepTimings()
+        # A standalone simulator owns its event loop. Simulators added to a
+        # SimulatorHost share the host's loop instead; their connections keep
+        # a read posted while callbacks run (see service_until), so that one
+        # simulator waking the loop cannot trip another's heartbeat.
         self._ioloop = asyncio.new_event_loop()
+        self._owns_loop = True
         self._impl = Simulator_WS(brain, self, name, self._ioloop)
 
         # statistics
@@ -133,22 +150,27 @@ class Simulator(object):
         self.episode_count = 0
         self._episode_rate = _RateCounter()
         self.iteration_count = 0
+        self._iteration_total = 0
         # NOTE: _iteration_rate is accumulative, not per episode
         self._iteration_rate = _RateCounter()
         self._reset_rate_counter = True
 
+        # publish statistics if --metrics-port or --metrics-textfile is set
+        metrics.register(self)
+
     def _construct_writer(self):
-        def raise_rte(fname):
+        def raise_rte(fname, **kwargs):
             raise RuntimeError(
                 """
                 Record file name must include a supported extension
-                (.json|.csv): {}
+                (.json|.csv|.npz|.parquet): {}
                 """.format(fname))
 
         if self.brain.config.record_enabled:
             self.writer = self.WRITERS.get(
                 self.brain.config.record_format, raise_rte)(
-                    self.brain.config.record_file)
+                    self.brain.config.record_file,
+                    buffered=self.brain.config.record_buffered)
 
     def __repr__(self):
         """ Return a JSON representation of the Simulator. """
@@ -363,7 +385,33 @@ class Simulator(object):
         integrations to take advantage of structured recording functionality.
         """
         if self.writer is not None:
+            start = perf_counter()
             self.writer.write()
+            self._timings.add('record', perf_counter() - start)
+
+    def timings(self, reset=False):
+        """
+        Returns where the time of steps went so far, as a dictionary of
+        phases: 'network', 'parse', 'decode', 'simulate', 'encode',
+        'record' and 'send'. Each phase maps to a dictionary with the
+        'count' of timings, their 'total', 'mean', 'p50', 'p99' and 'max'
+        in seconds, and 'buckets', a cumulative histogram given as a list
+        of (upper bound, count) pairs. Percentiles are estimated from the
+        histogram.
+
+        Arguments:
+            reset: Clear the histograms after reading them.
+
+        Example:
+            while sim.run():
+                continue
+            for phase, timing in sim.timings().items():
+                print(phase, timing['total'], timing['p99'])
+        """
+        timings = self._timings.as_dict()
+        if reset:
+            self._timings.reset()
+        return timings
 
     def _on_episode_start(self, episode_config):
         """ Callback hook for episode_start, called by event dispatcher """
@@ -377,7 +425,12 @@ class Simulator(object):
             self._reset_rate_counter = False
 
         init_state = self.episode_start(episode_config)
+        if isawaitable(init_state):
+            return self._after_async(
+                init_state, self._after_episode_start, episode_config)
+        return self._after_episode_start(init_state, episode_config)
 
+    def _after_episode_start(self, init_state, episode_config):
         if self.writer is not None:
             self._record_state(init_state, config=episode_config)
 
@@ -388,9 +441,16 @@ class Simulator(object):
         # update counters
         self._iteration_rate.update()
         self.iteration_count += 1
+        self._iteration_total += 1
 
         # step
-        state, reward, terminal = self.simulate(action)
+        result = self.simulate(action)
+        if isawaitable(result):
+            return self._after_async(result, self._after_simulate, action)
+        return self._after_simulate(result, action)
+
+    def _after_simulate(self, result, action):
+        state, reward, terminal = result
         self.episode_reward += reward
 
         if self.writer is not None:
@@ -405,10 +465,15 @@ class Simulator(object):
         self.episode_count += 1
 
         # userland callback
-        self.episode_finish()
+        return self.episode_finish()
+
+    async def _after_async(self, awaitable, after, *args):
+        """ Completes a hook whose user callback is a coroutine """
+        return after(await awaitable, *args)
 
     def _record_state(self, state, action={}, reward=None,
                       terminal=None, config={}):
+        start = perf_counter()
         self.writer.add(config, 'config')
         self.writer.add(action, 'action')
         self.writer.add(state, 'state')
@@ -427,23 +492,56 @@ class Simulator(object):
             'iteration_count': self.iteration_count,
             'iteration_rate': self.iteration_rate
         }, 'statistics')
+        self._timings.add('record', perf_counter() - start)
 
     def _now(self):
         return datetime.fromtimestamp(
             time()).strftime("%Y-%m-%d %H:%M:%S")
 
-    def close(self):
-        """ Closes websocket Connection """
+    def _attach_loop(self, loop, executor=None):
+        """
+        Moves this simulator onto an event loop owned by someone else,
+        such as a `SimulatorHost`, and sets the executor its callbacks run
+        on. Only the executor may change once connected.
+        """
+        if loop is not self._ioloop:
+            if self._impl._sim_connection.client is not None:
+                raise UsageError(
+                    'Cannot move a connected simulator to another event loop')
+            if self._owns_loop:
+                self._ioloop.close()
+            self._ioloop = loop
+            self._owns_loop = False
+        self._impl._attach_loop(loop, executor)
+
+    async def _close_async(self):
+        await self._impl._cancel_pending_recv()
         if self._impl._receive_handle:
             self._impl._receive_handle.cancel()
             try:
                 if not self._impl._receive_handle.done() or \
                         self._impl._receive_handle.cancelled():
-                    self._ioloop.run_until_complete(self._impl._receive_handle)
+                    await self._impl._receive_handle
             except asyncio.CancelledError:
                 pass
 
-        self._ioloop.run_until_complete(self._impl._sim_connection.close())
+        await self._impl._sim_connection.close()
+        if self._impl._capture is not None:
+            self._impl._capture.close()
+
+    async def _finish_async(self):
+        if self.writer is not None:
+            self.writer.close()
+        await self._close_async()
+
+    def close(self):
+        """ Closes websocket Connection """
+        run_until_complete(self._ioloop, self._close_async())
+
+    async def aclose(self):
+        """ Coroutine version of `close`, for use from within a running
+        event loop """
+        await self._close_async()
 
     def get_next_event(self):
         """
@@ -464,14 +562,37 @@ class Simulator(object):
             else:
                 # do nothing
         """
-        event = None
         try:
-            event = self._ioloop.run_until_complete(
-                asyncio.ensure_future(
-                    self._impl.get_next_event(),
-                    loop=self._ioloop))
+            return run_until_complete(self._ioloop, self._next_event_async())
         except KeyboardInterrupt:
-            event = FinishedEvent()
+            self.close()
+            return FinishedEvent()
+
+    async def anext_event(self):
+        """
+        Coroutine version of `get_next_event`, for use from within a
+        running event loop. The simulator moves onto the running loop the
+        first time it is awaited, so it must not be connected on another
+        loop.
+
+        Returns:
+            an instance of `Event`
+
+        Example:
+            async def main(sim):
+                while True:
+                    event = await sim.anext_event()
+                    if isinstance(event, FinishedEvent):
+                        break
+                    ...
+        """
+        self._attach_running_loop()
+        return await self._next_event_async()
+
+    async def _next_event_async(self):
+        event = None
+        try:
+            event = await self._impl.get_next_event()
         except BonsaiClientError as e:
             log.error(e)
             raise e.original_exception
@@ -483,7 +604,7 @@ class Simulator(object):
             raise e
         finally:
             if event is None or isinstance(event, FinishedEvent):
-                self.close()
+                await self._close_async()
 
         return event
 
@@ -510,12 +631,48 @@ class Simulator(object):
         """
         success = False
         try:
-            success = self._ioloop.run_until_complete(
-                asyncio.ensure_future(
-                    self._impl.run(),
+            success = run_until_complete(
+                self._ioloop, asyncio.ensure_future(
+                    self._run_async(),
                     loop=self._ioloop))
         except KeyboardInterrupt:
-            pass
+            run_until_complete(self._ioloop, self._finish_async())
+
+        return success
+
+    async def arun(self):
+        """
+        Coroutine version of `run`, for use from within a running event
+        loop. Returns `False` when the simulation has finished or halted.
+
+        The simulator moves onto the running loop the first time it is
+        awaited, so it must not be connected on another loop. The
+        `episode_start`, `simulate` and `episode_finish` callbacks may be
+        coroutines, in which case they are awaited on that loop.
+
+        Example:
+            class MySimulator(bonsai_ai.Simulator):
+                async def simulate(self, action):
+                    state = await self.plant.step(action)
+                    return (state, reward_for(state), is_terminal(state))
+
+            async def main(sim):
+                while await sim.arun():
+                    continue
+        """
+        self._attach_running_loop()
+        return await self._run_async()
+
+    def _attach_running_loop(self):
+        loop = asyncio.get_event_loop()
+        if loop is not self._ioloop:
+            self._attach_loop(loop, self._impl._executor)
+
+    async def _run_async(self):
+        """ Coroutine behind `run` and `arun`, also used by `SimulatorHost` """
+        success = False
+        try:
+            success = await self._impl.run()
         except BonsaiClientError as e:
             log.error(e)
             raise e.original_exception
@@ -526,8 +683,6 @@ class Simulator(object):
             raise e
         finally:
             if not success:
-                if self.writer is not None:
-                    self.writer.close()
-                self.close()
+                await self._finish_async()
 
         return success
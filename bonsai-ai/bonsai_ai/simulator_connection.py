@@ -1,7 +1,13 @@
+import ssl
+import threading
 import time
+from collections import deque
+from contextlib import contextmanager
+from asyncio import CancelledError, FIRST_COMPLETED, ensure_future, sleep, \
+    wait
 from random import uniform
-from threading import Lock, Thread, Event
 from uuid import uuid4
+from weakref import WeakKeyDictionary, WeakSet
 from bonsai_ai.exceptions import BonsaiServerError, RetryTimeoutError
 from bonsai_ai.logger import Logger
 
@@ -12,6 +18,179 @@ from urllib.parse import urlparse
 log = Logger()
 
 _PING_PONG_INTERVAL = 15.0
+# longest seconds between the pong thread's checks of idle loops
+_PONG_THREAD_TICK = 1.0
+# seconds for which a reused transport caches the server's address
+_DNS_CACHE_TTL = 300
+
+_ssl_context = None
+
+
+class _Heartbeat(object):
+    """
+    Sends an unsolicited pong on every connection of one event loop, every
+    `_PING_PONG_INTERVAL` seconds, from a single timer on that loop. Pongs
+    are sent between other callbacks of the loop, so they need no lock,
+    however many connections share the loop.
+
+    The timer only fires while the loop is free to run it. A loop driven
+    by the synchronous API (`Simulator.run`, `Predictor.get_action`) sits
+    idle between calls, and is blocked while a synchronous callback such
+    as `simulate` runs on its thread. Its connections are then served by
+    the process-wide `_PongThread` instead. `busy` is held for as long as
+    the SDK may write to the connections from the loop's thread, so the
+    two never write at the same time.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._connections = WeakSet()
+        self._connections_lock = threading.Lock()
+        self._handle = None
+        self._last_beat = time.monotonic()
+        self.busy = threading.Lock()
+        # thread running the loop through run_until_complete, if any
+        self.owner = None
+        # whether the synchronous API has run the loop
+        self.synchronous = False
+
+    def add(self, connection):
+        with self._connections_lock:
+            self._connections.add(connection)
+        connection._pong()
+        if self._handle is None:
+            self._schedule()
+
+    def discard(self, connection):
+        with self._connections_lock:
+            self._connections.discard(connection)
+            empty = not self._connections
+        if empty and self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def connections(self):
+        with self._connections_lock:
+            return list(self._connections)
+
+    def _schedule(self):
+        self._handle = self._loop.call_later(_PING_PONG_INTERVAL, self._beat)
+
+    def _beat(self):
+        self._handle = None
+        self._last_beat = time.monotonic()
+        connections = self.connections()
+        for connection in connections:
+            connection._pong()
+        if connections:
+            self._schedule()
+
+    def beat_if_idle(self):
+        """ Pongs every connection from the pong thread, if the loop is
+        idle and the last beat was at least `_PING_PONG_INTERVAL` ago """
+        if not self.synchronous or \
+                time.monotonic() - self._last_beat < _PING_PONG_INTERVAL:
+            return
+        if not self.busy.acquire(blocking=False):
+            return
+        try:
+            if not self._loop.is_closed():
+                self._last_beat = time.monotonic()
+                for connection in self.connections():
+                    connection._pong()
+        finally:
+            self.busy.release()
+
+    @contextmanager
+    def blocking(self):
+        """ Marks a synchronous callback run on the loop's thread, during
+        which the pong thread may serve the connections """
+        if self.owner != threading.get_ident():
+            yield
+            return
+        self.owner = None
+        self.busy.release()
+        try:
+            yield
+        finally:
+            self.busy.acquire()
+            self.owner = threading.get_ident()
+
+
+class _PongThread(object):
+    """
+    A single daemon thread per process that pongs the connections of idle
+    event loops every `_PING_PONG_INTERVAL` seconds, so that a simulator
+    keeps its connection alive while a long `simulate` call holds the
+    loop's thread. It checks the loops at least every `_PONG_THREAD_TICK`
+    seconds.
+    """
+    _thread = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def start(cls):
+        with cls._lock:
+            if cls._thread is None:
+                cls._thread = threading.Thread(
+                    target=cls._run, name='bonsai-heartbeat', daemon=True)
+                cls._thread.start()
+
+    @staticmethod
+    def _run():
+        while True:
+            time.sleep(min(_PING_PONG_INTERVAL, _PONG_THREAD_TICK))
+            for heartbeat in _all_heartbeats():
+                heartbeat.beat_if_idle()
+
+
+# event loop -> _Heartbeat of the connections on it
+_heartbeats = WeakKeyDictionary()
+_heartbeats_lock = threading.Lock()
+
+
+def _heartbeat_for(loop):
+    with _heartbeats_lock:
+        heartbeat = _heartbeats.get(loop)
+        if heartbeat is None:
+            heartbeat = _heartbeats[loop] = _Heartbeat(loop)
+        return heartbeat
+
+
+def _all_heartbeats():
+    with _heartbeats_lock:
+        return list(_heartbeats.values())
+
+
+def run_until_complete(loop, future):
+    """
+    Runs `loop` until `future` is done, as `loop.run_until_complete`, for
+    the synchronous API. While the loop is idle between such calls, or
+    blocked in a synchronous callback, the pong thread keeps the
+    connections on it alive.
+    """
+    heartbeat = _heartbeat_for(loop)
+    if heartbeat.owner == threading.get_ident():
+        # re-entered from a callback; asyncio reports the error
+        return loop.run_until_complete(future)
+    if not heartbeat.synchronous:
+        heartbeat.synchronous = True
+        _PongThread.start()
+    with heartbeat.busy:
+        heartbeat.owner = threading.get_ident()
+        try:
+            return loop.run_until_complete(future)
+        finally:
+            heartbeat.owner = None
+
+
+def _shared_ssl_context():
+    """ Returns the process-wide client SSL context of reused transports,
+    so that certificates are loaded once rather than on every connect """
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
 
 
 class SimulatorConnection(object):
@@ -27,18 +206,26 @@ class SimulatorConnection(object):
         self._brain = brain
         self._predict = predict
         self._session = None
+        self._session_loop = None
+        # keep the session and its connector across reconnects
+        self._reuse_transport = brain.config.reuse_transport
         self._ws = None
+        # reads completed by service_until, not yet consumed by receive
+        self._received = deque()
         self._retry_timeout_seconds = brain.config.retry_timeout
         self._network_timeout_seconds = brain.config.network_timeout
         self._connection_attempts = 0
-        self._base_multiplier_milliseconds = 50
-        self._maximum_backoff_seconds = 60
+        self._base_multiplier_milliseconds = brain.config.retry_backoff_base
+        self._maximum_backoff_seconds = brain.config.retry_backoff_max
         self._timeout = None
         self.read_timeout_seconds = 240
-        self.lock = Lock()
-        self._thread_stop = Event()
+        self._heartbeat = None
         self._ioloop = loop
 
+        # statistics, across reconnects
+        self.connects = 0
+        self.disconnects = 0
+
     @property
     def client(self):
         """
@@ -48,11 +235,52 @@ class SimulatorConnection(object):
         """
         return self._ws
 
+    async def receive(self):
+        """
+        Returns the next message from the websocket, including one that
+        arrived while `service_until` was reading on our behalf.
+        """
+        if self._received:
+            return self._received.popleft().result()
+        return await self._ws.receive()
+
+    async def service_until(self, future):
+        """
+        Waits for `future` while continuing to read from the websocket.
+
+        The heartbeat only processes pongs from within `receive()`, so a
+        connection whose event loop keeps running while a simulator
+        callback executes elsewhere must keep a read posted, otherwise the
+        heartbeat will time out. A read is re-posted every time one
+        completes, for as long as `future` is pending; the messages that
+        arrive in the meantime are queued for `receive`.
+        """
+        receive = None
+        try:
+            while not future.done() and \
+                    self._ws is not None and not self._ws.closed:
+                receive = ensure_future(self._ws.receive(), loop=self._ioloop)
+                await wait([future, receive], return_when=FIRST_COMPLETED)
+                if receive.done():
+                    self._received.append(receive)
+                    receive = None
+        finally:
+            if receive is not None:
+                await self._cancel(receive)
+        return await future
+
+    async def _cancel(self, task):
+        task.cancel()
+        try:
+            await task
+        except CancelledError:
+            pass
+
     async def connect(self):
         self._connection_attempts += 1
 
         if self._connection_attempts > 1:
-            self._handle_reconnect()
+            await self._handle_reconnect()
 
         request_id = str(uuid4())
         try:
@@ -84,10 +312,12 @@ class SimulatorConnection(object):
                 if uri.scheme == "":
                     proxy = "http://" + proxy
 
-            log.network('trying to connect: {}'.format(url))
-            self._session = ClientSession(
-                connector=TCPConnector(force_close=True, loop=self._ioloop)
-            )
+            log.network('trying to connect: %s', url)
+            if self._session_loop is not self._ioloop:
+                await self._close_session()
+            if self._session is None:
+                self._session = self._new_session()
+                self._session_loop = self._ioloop
 
             self._ws = await self._session.ws_connect(
                 url,
@@ -100,7 +330,7 @@ class SimulatorConnection(object):
                 },
                 proxy=proxy
             )
-            log.network('Connected to {}'.format(url))
+            log.network('Connected to %s', url)
         except WSServerHandshakeError as e:
             log.info("Failed to connect: {}, Request ID: {}".format(
                 repr(e), request_id))
@@ -117,33 +347,58 @@ class SimulatorConnection(object):
         else:
             self._timeout = None
             self._connection_attempts = 0
+            self.connects += 1
 
-            self._thread_stop.clear()
-            pong_thread = Thread(target=(self._start_pong_loop))
-            pong_thread.daemon = True
-            pong_thread.start()
+            self._heartbeat = _heartbeat_for(self._ioloop)
+            self._heartbeat.add(self)
             return None
 
-    def _start_pong_loop(self):
-        while not self._thread_stop.is_set():
-            self._pong()
-            self._thread_stop.wait(_PING_PONG_INTERVAL)
+    def _new_session(self):
+        if not self._reuse_transport:
+            return ClientSession(
+                connector=TCPConnector(force_close=True, loop=self._ioloop),
+                loop=self._ioloop)
+
+        # the connector caches DNS lookups, so that reconnecting after a
+        # dropped connection does not resolve the server again
+        return ClientSession(
+            connector=TCPConnector(
+                ttl_dns_cache=_DNS_CACHE_TTL,
+                ssl_context=_shared_ssl_context(),
+                loop=self._ioloop),
+            loop=self._ioloop)
+
+    async def _close_session(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            self._session_loop = None
+
+    def blocking(self):
+        """ Returns a context manager for a synchronous callback that
+        blocks the event loop, see `_Heartbeat.blocking` """
+        return _heartbeat_for(self._ioloop).blocking()
+
+    def _stop_heartbeat(self):
+        if self._heartbeat is not None:
+            self._heartbeat.discard(self)
+            self._heartbeat = None
 
     def _pong(self):
-        with self.lock:
-            if self._ws and self._is_safe_to_send_pong():
-                log.network('Sending Pong.')
-                self._ws.pong()
-                log.network('Pong sent to server.')
+        if self._ws and self._is_safe_to_send_pong():
+            log.network('Sending Pong.')
+            self._ws.pong()
+            log.network('Pong sent to server.')
 
     def _is_safe_to_send_pong(self):
         """
         We check the private attributes of the websocket in order to determine if
         it is safe to send a pong. This is necessary for the scenario where the service
-        becomes unavailable while we are in a long running simulation step. The SDK does
-        not know the websocket is closed until control is returned which results in a
-        "socket.send() raised exception" message being propagated up from deep inside
-        asyncio.
+        becomes unavailable while we are in a long running simulation step, and the
+        pong thread sends pongs while the event loop is idle. The SDK does not know
+        the websocket is closed until control is returned to the loop, which results
+        in a "socket.send() raised exception" message being propagated up from deep
+        inside asyncio.
         """
         if self._ws.closed:
             return False
@@ -163,7 +418,7 @@ class SimulatorConnection(object):
 
         return True
 
-    def _handle_reconnect(self):
+    async def _handle_reconnect(self):
         log.network('Handling reconnect')
 
         if self._timeout and time.time() > self._timeout:
@@ -175,40 +430,45 @@ class SimulatorConnection(object):
                 'Simulator will timeout in {} seconds if it is not able '
                 'to connect to the platform.'.format(
                     self._timeout - time.time()))
-        self._backoff()
+        await self._backoff()
         log.network('Reconnect handled')
 
-    def _backoff(self):
+    async def _backoff(self):
         """
         Implements Exponential backoff algorithm with full jitter
         Check the following url for more information
         https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+
+        The wait does not block the event loop, so other simulators on it
+        keep running, and cancelling the connect cancels the wait.
         """
         power_of_two = 2 ** (self._connection_attempts - 1)
         max_sleep = min(
             power_of_two * self._base_multiplier_milliseconds / 1000.0,
             self._maximum_backoff_seconds
         )
-        sleep = uniform(0, max_sleep)
+        delay = uniform(0, max_sleep)
         log.info('Connection attempt: {}, backing off for {} seconds'.format(
-            self._connection_attempts, sleep))
-        time.sleep(sleep)
+            self._connection_attempts, delay))
+        await sleep(delay, loop=self._ioloop)
 
     async def close(self):
-        """ Close the websocket connection """
-        self._thread_stop.set()
+        """ Close the websocket connection and its session """
+        await self._close_websocket()
+        await self._close_session()
+
+    async def _close_websocket(self):
+        self._stop_heartbeat()
+        self._received.clear()
         if self._ws:
             if not self._ws.closed:
-                with self.lock:
-                    log.network('Closing simulator connection')
-                    await self._ws.close()
-                    log.network('Closed')
+                log.network('Closing simulator connection')
+                await self._ws.close()
+                log.network('Closed')
             self._ws = None
         else:
             log.network('Websocket was not connected.'
                         'Close() resulted in no operation')
-        if self._session:
-            await self._session.close()
 
     def _websocket_should_not_reconnect(self):
         """
@@ -247,7 +507,8 @@ class SimulatorConnection(object):
 
     async def handle_disconnect(self, message=None):
         log.network('Handling disconnect')
-        self._thread_stop.set()
+        self.disconnects += 1
+        self._stop_heartbeat()
         if message:
             self._handle_message(message)
 
@@ -257,17 +518,18 @@ class SimulatorConnection(object):
                     'Websocket connection closed. Code: {}, Reason: {}'.format(
                         self._ws.close_code, message))
             log.network(
-                'ws_close_code: {}, ws_close_reason: {}.'.format(
-                    self._ws.close_code, message))
+                'ws_close_code: %s, ws_close_reason: %s.',
+                self._ws.close_code, message)
 
-        await self.close()
+        await self._close_websocket()
+        if not self._reuse_transport:
+            await self._close_session()
         log.network('Disconnect handled.')
 
     def _handle_message(self, message):
         """ Handles error messages returned from initial connection attempt """
         log.network(
-            'Handling the following message returned from ws:'
-            ' {}'.format(message))
+            'Handling the following message returned from ws: %s', message)
         if isinstance(message, WSServerHandshakeError):
             if message.code == 401:
                 raise BonsaiServerError(
@@ -284,4 +546,4 @@ class SimulatorConnection(object):
         if not self._retry_timeout_seconds:
             raise BonsaiServerError(
                 'Error while connecting to websocket: {}'.format(message))
-        log.network('Error while connecting to websocket: {}'.format(message))
+        log.network('Error while connecting to websocket: %s', message)
@@ -0,0 +1,164 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count
+
+from bonsai_ai.exceptions import UsageError
+from bonsai_ai.logger import Logger
+from bonsai_ai.simulator_connection import run_until_complete
+
+log = Logger()
+
+
+class SimulatorHost(object):
+    """
+    Runs many `Simulator` instances in one process over a single shared
+    event loop.
+
+    Each added simulator keeps its own websocket connection, but all of the
+    connections are multiplexed over the host's loop, and the simulator
+    callbacks (`episode_start`, `simulate` and `episode_finish`) are
+    dispatched to an executor. While a callback runs, its connection keeps
+    servicing heartbeats, so long simulation steps do not trip a
+    disconnect.
+
+    The default executor is a `ThreadPoolExecutor` with one worker per
+    simulator, capped at the number of CPUs. Callbacks of different
+    simulators may run concurrently, but callbacks of a single simulator
+    never overlap. Because the callbacks share the GIL, only simulators
+    whose `simulate` releases it (NumPy, native extensions, external
+    processes) can saturate a machine this way. Process pools are not
+    supported: callbacks are bound methods that mutate simulator state,
+    which would be lost in a worker process.
+
+    Attributes:
+        simulators: The simulators added to this host.
+
+    Example Code:
+        config = bonsai_ai.Config(sys.argv)
+        brain = bonsai_ai.Brain(config)
+
+        host = bonsai_ai.SimulatorHost()
+        for _ in range(64):
+            host.add(MySimulator(brain, "my_simulator"))
+
+        host.run()
+        host.close()
+    """
+
+    def __init__(self, executor=None, loop=None):
+        """
+        Constructs the SimulatorHost class.
+
+        Arguments:
+            executor: A `concurrent.futures.ThreadPoolExecutor` used to run
+                      simulator callbacks. One is created for each call
+                      to `run` if none is given.
+            loop:     The event loop to run on. A new loop is created if
+                      none is given, and closed by `close`.
+        """
+        if executor is not None and \
+                not isinstance(executor, ThreadPoolExecutor):
+            raise UsageError(
+                'SimulatorHost only supports a ThreadPoolExecutor, '
+                'got {}'.format(type(executor).__name__))
+
+        self.simulators = []
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._owns_loop = loop is None
+        self._ioloop = loop if loop is not None else asyncio.new_event_loop()
+        self._stopping = False
+
+    def add(self, sim):
+        """
+        Adds a simulator to this host. The simulator must not have been
+        connected yet.
+
+        Arguments:
+            sim: The `Simulator` to add.
+        """
+        sim._attach_loop(self._ioloop)
+        self.simulators.append(sim)
+        return sim
+
+    def stop(self):
+        """
+        Asks every simulator to disconnect after its current step. Safe to
+        call from simulator callbacks.
+        """
+        self._ioloop.call_soon_threadsafe(self._set_stopping)
+
+    def _set_stopping(self):
+        self._stopping = True
+
+    def run(self):
+        """
+        Runs all simulators until each of them has finished, or until
+        `stop` is called. Exceptions raised by a simulator stop the host and
+        are re-raised here, as they would be by `Simulator.run`.
+        """
+        if not self.simulators:
+            raise UsageError('SimulatorHost has no simulators to run')
+
+        # the default executor is sized once the simulators are known
+        if self._owns_executor:
+            self._executor = ThreadPoolExecutor(
+                max_workers=min(len(self.simulators), cpu_count() or 1))
+
+        for sim in self.simulators:
+            sim._attach_loop(self._ioloop, self._executor)
+
+        self._stopping = False
+        task = asyncio.ensure_future(self._run_all(), loop=self._ioloop)
+        try:
+            run_until_complete(self._ioloop, task)
+        except KeyboardInterrupt:
+            # unwinding each simulator's run closes its own connection
+            task.cancel()
+            try:
+                run_until_complete(self._ioloop, task)
+            except (asyncio.CancelledError, KeyboardInterrupt):
+                pass
+        finally:
+            # leave the simulators usable on their own after the host ran
+            for sim in self.simulators:
+                sim._attach_loop(self._ioloop)
+            if self._owns_executor:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def close(self):
+        """
+        Closes the event loop if it was created by this host. The host and
+        its simulators cannot be run afterwards.
+        """
+        if self._owns_loop and not self._ioloop.is_closed():
+            self._ioloop.close()
+
+    async def _run_all(self):
+        tasks = [self._ioloop.create_task(self._drive(sim))
+                 for sim in self.simulators]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            # cancel each remaining simulator exactly once, so that the
+            # unwinding of its run gets to close its connection
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+        for task in tasks:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+
+    async def _drive(self, sim):
+        success = True
+        while success and not self._stopping:
+            success = await sim._run_async()
+        if success:
+            await sim._finish_async()
+        log.simulator_host('Simulator %s finished', sim.sim_id)
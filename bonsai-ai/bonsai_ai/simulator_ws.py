@@ -1,6 +1,10 @@
 # Copyright (C) 2018 Bonsai, Inc.
 
+from collections import OrderedDict, deque
+from functools import partial
+from inspect import isawaitable
 from asyncio import ensure_future
+from time import perf_counter
 from aiohttp import WSMsgType, ClientError, EofStream
 
 # protobuf
@@ -11,18 +15,41 @@ from bonsai_ai.proto.generator_simulator_api_pb2 import ServerToSimulator
 from bonsai_ai.proto.generator_simulator_api_pb2 import SimulatorToServer
 
 # bonsai
-from bonsai_ai.common.proto_to_state import dict_for_message
+from bonsai_ai.capture import CaptureWriter, DISCONNECT, INBOUND, \
+    OUTBOUND, capture_path
 from bonsai_ai.event import (EpisodeStartEvent, SimulateEvent,
     EpisodeFinishEvent, FinishedEvent, UnknownEvent)
 from bonsai_ai.exceptions import (SimulateError, EpisodeStartError,
     BonsaiServerError, EpisodeFinishError)
-from bonsai_ai.inkling_factory import InklingMessageFactory
+from bonsai_ai.inkling_factory import shared_factory
 from bonsai_ai.logger import Logger
 from bonsai_ai.simulator_connection import SimulatorConnection
+from bonsai_ai.timings import Histogram
 
 
 log = Logger()
 
+# upper bounds, in bytes, of the buckets of the message size histograms
+MESSAGE_SIZE_BOUNDS = tuple(4 ** n for n in range(3, 13))
+
+# the keys Simulator records besides state, action and config, with the
+# NumPy dtypes of their columns
+_RECORD_DTYPES = OrderedDict([
+    ('reward', 'f8'),
+    ('terminal', '?'),
+    ('time', 'U'),
+    ('simulator', 'U'),
+    ('predict', '?'),
+    ('sim_id', 'u8'),
+])
+_STATISTICS_DTYPES = OrderedDict([
+    ('episode_reward', 'f8'),
+    ('episode_count', 'i8'),
+    ('episode_rate', 'f8'),
+    ('iteration_count', 'i8'),
+    ('iteration_rate', 'f8'),
+])
+
 
 class Simulator_WS(object):
     class SimStep(object):
@@ -34,6 +61,8 @@ class Simulator_WS(object):
         """
         def __init__(self):
             self.prediction = None
+            # the prediction, decoded once in the simulator's action_format
+            self.action = None
             self.state = None
             self.reward = 0.0
             self.terminal = False
@@ -44,10 +73,34 @@ class Simulator_WS(object):
         self._sim = sim
         self._reset_simulator_ws()
         self._ioloop = loop
+        self._executor = None
         self._sim_connection = SimulatorConnection(brain, sim.predict, loop)
 
-        # protobuf discriptor cache
-        self._inkling = InklingMessageFactory()
+        # In pipelined mode run() sends each state as soon as the simulator
+        # produced it, and receives the reply in this task, which the next
+        # get_next_event awaits. The task only makes progress while the
+        # loop runs: with the synchronous run(), the loop is stopped between
+        # calls, so the reply is received and decoded when the next run()
+        # starts and only the send happens earlier
+        self._pipelined = brain.config.pipeline
+        self._pending_recv = None
+
+        # time spent in each phase of a step, owned by the simulator
+        self._timings = sim._timings
+        self._arrived = 0.0
+
+        # sizes of the messages sent and received, across reconnects
+        self._sent_sizes = Histogram(MESSAGE_SIZE_BOUNDS)
+        self._received_sizes = Histogram(MESSAGE_SIZE_BOUNDS)
+
+        # every message exchanged with the server, with --capture
+        self._capture = None
+        if brain.config.capture_file:
+            self._capture = CaptureWriter(
+                capture_path(brain.config.capture_file))
+
+        # protobuf descriptor cache, shared by all simulators
+        self._inkling = shared_factory()
 
         self._dispatch_send = {
             ServerToSimulator.UNKNOWN:
@@ -83,6 +136,31 @@ class Simulator_WS(object):
                 '_on_finished'
         }
 
+    def _attach_loop(self, loop, executor=None):
+        """
+        Moves this simulator onto `loop`. When an `executor` is given,
+        simulator callbacks are run on it instead of on the loop.
+        """
+        self._ioloop = loop
+        self._executor = executor
+        self._sim_connection._ioloop = loop
+
+    async def _call(self, fn, *args):
+        """
+        Invokes a simulator callback, awaiting its result if the callback
+        is a coroutine
+        """
+        if self._executor is None:
+            # the loop is blocked; the pong thread keeps the connection up
+            with self._sim_connection.blocking():
+                result = fn(*args)
+        else:
+            future = self._ioloop.run_in_executor(self._executor, fn, *args)
+            result = await self._sim_connection.service_until(future)
+        if isawaitable(result):
+            result = await result
+        return result
+
     def _reset_simulator_ws(self):
         """ Reset state of simulator_ws"""
         log.simulator_ws('Resetting simulator_ws')
@@ -96,13 +174,18 @@ class Simulator_WS(object):
         self._prediction_schema = None
         self._sim_id = 0
 
+        # compiled codecs for the schemas above
+        self._properties_codec = None
+        self._output_codec = None
+        self._prediction_codec = None
+
         # set_properties
         self._init_properties = {}
         self._initial_state = None
 
         # current batch of simulation steps
         self._sim_steps = []
-        self._step_iter = None
+        self._pending_steps = deque()
         self._prev_step_terminal = [False]
         self._prev_step_finish = False
 
@@ -113,12 +196,15 @@ class Simulator_WS(object):
         # Handle on WS receive for cleanup
         self._receive_handle = None
 
+        # when the last message was sent; a step spans two sends
+        self._last_sent = None
+
     def _new_state_message(self):
         """
         Generate an InklingMessage for holding simulator state
         :return: state message
         """
-        return self._inkling.new_message_from_proto(self._output_schema)
+        return self._output_codec.new_message()
 
     def _send_registration(self, to_server):
         log.simulator_ws('Sending Registration')
@@ -146,19 +232,28 @@ class Simulator_WS(object):
         log.simulator_ws('Sending State')
         to_server.message_type = SimulatorToServer.STATE
         to_server.sim_id = self._sim_id
+        log_action = log.is_enabled('action')
         for step in self._sim_steps:
             if step.state:
                 state = to_server.state_data.add()
                 state.state = step.state.SerializeToString()
                 state.reward = step.reward
                 state.terminal = step.terminal
-                log.action(self._inkling.message_for_dynamic_message(
-                    step.prediction, self._prediction_schema))
+                if log_action:
+                    log.action(step.action)
                 state.action_taken = step.prediction
             else:
                 log.simulator("WARNING: Missing step in send_state")
         self._sim_steps = []
-        self._step_iter = None
+        self._pending_steps = deque()
+
+    def _send_states(self, states, to_server):
+        log.simulator_ws('Sending States')
+        to_server.message_type = SimulatorToServer.STATE
+        to_server.sim_id = self._sim_id
+        for state in states:
+            message = self._output_codec.from_dict(state)
+            to_server.state_data.add().state = message.SerializeToString()
 
     def _unsupported(self, to_server):
         descriptor = ServerToSimulator.MessageType.DESCRIPTOR
@@ -173,6 +268,12 @@ class Simulator_WS(object):
         self._properties_schema = data.properties_schema
         self._output_schema = data.output_schema
         self._prediction_schema = data.prediction_schema
+        self._properties_codec = self._inkling.codec_for_proto(
+            self._properties_schema)
+        self._output_codec = self._inkling.codec_for_proto(
+            self._output_schema)
+        self._prediction_codec = self._inkling.codec_for_proto(
+            self._prediction_schema)
         if self._sim.writer is not None:
             self._configure_writer()
         self._sim_id = data.sim_id
@@ -184,25 +285,32 @@ class Simulator_WS(object):
         log.simulator_ws('Setting properties')
         data = from_server.set_properties_data
         self._prediction_schema = data.prediction_schema
+        self._prediction_codec = self._inkling.codec_for_proto(
+            self._prediction_schema)
         self.objective_name = data.reward_name
-        dynamic_properties = data.dynamic_properties
-        properties_message = self._inkling.message_for_dynamic_message(
-            dynamic_properties, self._properties_schema)
-        self._init_properties = dict_for_message(properties_message)
+        properties_message = self._properties_codec.parse(
+            data.dynamic_properties)
+        self._init_properties = self._properties_codec.to_dict(
+            properties_message)
 
     def _on_start(self, from_server):
         log.simulator_ws('On Start')
 
     def _on_prediction(self, from_server):
         log.simulator_ws('On Prediction')
+        codec = self._prediction_codec
+        action_format = self._sim.action_format
+        start = perf_counter()
         for p_data in from_server.prediction_data:
             step = self.SimStep()
             step.prediction = p_data.dynamic_prediction
+            step.action = codec.decode(step.prediction, action_format)
             self._sim_steps.append(step)
 
-            # Convert server msg to action dict and save it for predictor
-            self._cache_action_for_predictor(step.prediction)
-        self._step_iter = iter(self._sim_steps)
+            # save the action for the predictor
+            self._predictor_action = step.action
+        self._pending_steps = deque(self._sim_steps)
+        self._timings.add('decode', perf_counter() - start)
 
     def _on_reset(self, from_server):
         log.simulator_ws('On Reset')
@@ -217,11 +325,6 @@ class Simulator_WS(object):
     def _on_finished(self, from_server):
         log.simulator_ws('On Finished')
 
-    def _dump_message(self, message, fname):
-        '''Helper function for dumping protobuf message contents'''
-        with open(fname, 'wb') as f:
-            f.write(message.SerializeToString())
-
     def _on_send(self, to_server):
         ''' message handler for sending messages to the server '''
         method_name = self._dispatch_send.get(
@@ -243,107 +346,181 @@ class Simulator_WS(object):
         method(from_server)
         self._prev_message_type = from_server.message_type
 
-    def _cache_action_for_predictor(self, prediction):
-        """ Converts a server prediction into an action dictionary and saves it
-            for the predictor class """
-        action_message = self._inkling.message_for_dynamic_message(
-            prediction, self._prediction_schema)
-        self._predictor_action = dict_for_message(action_message)
-
     def _configure_writer(self):
+        self._sim.writer.enable_fields(self._properties_codec.fields, 'config')
+        self._sim.writer.enable_fields(self._prediction_codec.fields, 'action')
+        self._sim.writer.enable_fields(self._output_codec.fields, 'state')
         self._sim.writer.enable_keys(
-            self._fields_for_schema(self._properties_schema), 'config')
-        self._sim.writer.enable_keys(
-            self._fields_for_schema(self._prediction_schema), 'action')
+            list(_RECORD_DTYPES), dtypes=_RECORD_DTYPES)
         self._sim.writer.enable_keys(
-            self._fields_for_schema(self._output_schema), 'state')
-        self._sim.writer.enable_keys([
-            'reward',
-            'terminal',
-            'time',
-            'simulator',
-            'predict',
-            'sim_id'
-        ])
-        self._sim.writer.enable_keys([
-            'episode_reward',
-            'episode_count',
-            'episode_rate',
-            'iteration_count',
-            'iteration_rate'
-        ], 'statistics')
-
-    def _fields_for_schema(self, schema):
-        msg = self._inkling.new_message_from_proto(schema)
-        return [f.name for f in msg.DESCRIPTOR.fields]
+            list(_STATISTICS_DTYPES), 'statistics', _STATISTICS_DTYPES)
 
     async def _ws_send_recv(self):
+        """ Sends the next message to the server and processes its reply.
+        Returns False if the connection was lost instead. """
+        return await self._ws_send() and await self._ws_recv()
+
+    async def _ws_send(self, build=None):
+        """ Sends the next message, or the message filled in by `build`,
+        to the server. Returns False if the connection was lost. """
         to_server = SimulatorToServer()
-        self._on_send(to_server)
-        log.pb("to_server: {}".format(MessageToJson(to_server)))
+        start = perf_counter()
+        (build or self._on_send)(to_server)
+        self._timings.add('encode', perf_counter() - start)
+        log.pb(lambda: "to_server: {}".format(MessageToJson(to_server)))
 
         if to_server.message_type:
+            start = perf_counter()
             out_bytes = to_server.SerializeToString()
             try:
-                with self._sim_connection.lock:
-                    if self._sim_connection.client.closed:
-                        await self._handle_disconnect(
-                            "Attempted write to closed web socket"
-                        )
-                        return
-                    log.network('Attempting to send message to server.')
-                    await self._sim_connection.client.send_bytes(out_bytes)
-                    log.network('Message sent to server.')
+                if self._sim_connection.client.closed:
+                    await self._handle_disconnect(
+                        "Attempted write to closed web socket"
+                    )
+                    return False
+                log.network('Attempting to send message to server.')
+                await self._sim_connection.client.send_bytes(out_bytes)
+                log.network('Message sent to server.')
+                self._sent_sizes.add(len(out_bytes))
+                if self._capture is not None:
+                    self._capture.write(OUTBOUND, out_bytes)
+                sent = perf_counter()
+                self._timings.add('send', sent - start)
+                if self._last_sent is not None:
+                    self._timings.add_step(sent - self._last_sent)
+                self._last_sent = sent
 
             except ClientError as e:
                 await self._handle_disconnect(e)
-                return
+                return False
+        return True
 
-        with self._sim_connection.lock:
-            log.network('Waiting for message from server.')
-            self._receive_handle = ensure_future(
-                self._sim_connection.client.receive(),
-                loop=self._ioloop)
-            msg = await self._receive_handle
-            log.network('Received message from server.')
+    async def _ws_recv(self, background=False):
+        """ Receives and processes the next message from the server.
+        Returns False if the connection was lost instead. A `background`
+        receive leaves timing the wait to whoever awaits it. """
+        log.network('Waiting for message from server.')
+        start = perf_counter()
+        self._receive_handle = ensure_future(
+            self._sim_connection.receive(),
+            loop=self._ioloop)
+        msg = await self._receive_handle
+        self._arrived = perf_counter()
+        if not background:
+            self._timings.add('network', self._arrived - start)
+        log.network('Received message from server.')
 
         if msg.type == WSMsgType.CLOSE or msg.type == WSMsgType.CLOSED \
               or msg.type == WSMsgType.ERROR or isinstance(msg.data, EofStream):
             await self._handle_disconnect(msg.extra)
-            return
+            return False
 
+        self._received_sizes.add(len(msg.data))
+        if self._capture is not None:
+            self._capture.write(INBOUND, msg.data)
         from_server = ServerToSimulator()
         from_server.ParseFromString(msg.data)
+        self._timings.add('parse', perf_counter() - self._arrived)
 
-        log.pb("from_server: {}".format(MessageToJson(from_server)))
+        log.pb(lambda: "from_server: {}".format(MessageToJson(from_server)))
         self._on_recv(from_server)
+        return True
+
+    def _round_trip_is_next(self):
+        """ True if the next event can only come from the server, rather
+        than from the pending steps of the current prediction """
+        if self._sim_connection.client is None:
+            return False
+        pmt = self._prev_message_type
+        if pmt == ServerToSimulator.FINISHED:
+            return False
+        if pmt == ServerToSimulator.PREDICTION:
+            return not self._prev_step_terminal[0] and \
+                not self._pending_steps
+        return True
+
+    async def _cancel_pending_recv(self):
+        """ Cancels a pipelined receive, for instance when closing """
+        if self._pending_recv is not None:
+            pending, self._pending_recv = self._pending_recv, None
+            pending.cancel()
+            try:
+                await pending
+            except Exception:
+                pass
 
     async def _handle_disconnect(self, message=None):
+        if self._capture is not None:
+            self._capture.write(DISCONNECT)
         await self._sim_connection.handle_disconnect(message)
         self._reset_simulator_ws()
 
     def _process_sim_step(self):
         try:
-            if not self._step_iter:
-                return None
             event = None
-            step = next(self._step_iter)
+            step = self._pending_steps.popleft()
             step.state = self._new_state_message()
             if self._prev_step_finish:
-                event = EpisodeStartEvent(self._init_properties, step.state)
+                event = EpisodeStartEvent(
+                    self._init_properties, step.state, self._output_codec)
                 self._prev_step_finish = False
             else:
-                action_message = self._inkling.message_for_dynamic_message(
-                    step.prediction, self._prediction_schema)
-                action = dict_for_message(action_message)
-                event = SimulateEvent(action, step, self._prev_step_terminal)
+                event = SimulateEvent(
+                    step.action, step, self._prev_step_terminal,
+                    self._output_codec)
             return event
-        except StopIteration:
+        except IndexError:
+            return None
+
+    async def predict(self, states):
+        """
+        Sends `states` to the server in a single STATE message and returns
+        the actions of its reply, one per state, or None if the connection
+        was lost. Registers with the server first, if needed.
+        """
+        if self._sim_connection.client is None:
+            message = await self._sim_connection.connect()
+            if message is not None:
+                await self._handle_disconnect(message)
+                return None
+        if self._prev_message_type == ServerToSimulator.UNKNOWN:
+            if not await self._ws_send_recv():
+                return None
+        if self._prev_message_type not in (
+                ServerToSimulator.ACKNOWLEDGE_REGISTER,
+                ServerToSimulator.PREDICTION):
+            self._unsupported(None)
+
+        sent = await self._ws_send(partial(self._send_states, states))
+        if not sent or not await self._ws_recv():
             return None
+        if self._prev_message_type != ServerToSimulator.PREDICTION:
+            self._unsupported(None)
+
+        steps, self._sim_steps = self._sim_steps, []
+        self._pending_steps = deque()
+        if len(steps) != len(states):
+            raise BonsaiServerError(
+                "Received {} predictions for {} states".format(
+                    len(steps), len(states)))
+
+        actions = [step.action for step in steps]
+        self._sim._on_predict(states, actions)
+        self._timings.maybe_log()
+        return actions
 
     async def get_next_event(self):
         """ Update the internal event machine and return the next
         event for processing"""
+        # the reply to a state sent by a pipelined run()
+        received = False
+        if self._pending_recv is not None:
+            pending, self._pending_recv = self._pending_recv, None
+            waited = perf_counter()
+            received = await pending
+            # only the part of the wait before the reply arrived
+            self._timings.add('network', max(self._arrived - waited, 0.0))
+
         # Grab a web socket connection if needed
         if self._sim_connection.client is None:
             message = await self._sim_connection.connect()
@@ -352,24 +529,26 @@ class Simulator_WS(object):
                 await self._handle_disconnect(message)
                 return UnknownEvent()
 
-        if self._prev_message_type == ServerToSimulator.PREDICTION:
-            if self._prev_step_terminal[0]:
-                self._prev_step_terminal[0] = False
-                self._prev_step_finish = True
-                event = EpisodeFinishEvent()
-            else:
-                event = self._process_sim_step()
-            if event is not None:
-                return event
+        if not received:
+            if self._prev_message_type == ServerToSimulator.PREDICTION:
+                if self._prev_step_terminal[0]:
+                    self._prev_step_terminal[0] = False
+                    self._prev_step_finish = True
+                    event = EpisodeFinishEvent()
+                else:
+                    event = self._process_sim_step()
+                if event is not None:
+                    return event
 
-        await self._ws_send_recv()
+            await self._ws_send_recv()
 
         pmt = self._prev_message_type
         if pmt == ServerToSimulator.ACKNOWLEDGE_REGISTER:
             if self._sim.predict:
                 self._initial_state = self._new_state_message()
                 event = EpisodeStartEvent(
-                    self._init_properties, self._initial_state)
+                    self._init_properties, self._initial_state,
+                    self._output_codec)
                 self._prev_step_finish = False
             else:
                 event = UnknownEvent()
@@ -385,7 +564,8 @@ class Simulator_WS(object):
         elif pmt == ServerToSimulator.START:
             self._initial_state = self._new_state_message()
             event = EpisodeStartEvent(
-                self._init_properties, self._initial_state)
+                self._init_properties, self._initial_state,
+                self._output_codec)
             self._prev_step_finish = False
         elif pmt == ServerToSimulator.PREDICTION:
             event = self._process_sim_step()
@@ -396,6 +576,41 @@ class Simulator_WS(object):
 
         return event
 
+    async def _simulate_batch(self, event):
+        """
+        Steps `event` and every other pending step of the current
+        prediction in one call to the simulator
+        """
+        events = [event]
+        pending = self._process_sim_step()
+        while pending is not None:
+            events.append(pending)
+            pending = self._process_sim_step()
+
+        log.simulator(
+            lambda: "actions: {}".format([e.action for e in events]))
+        timings = self._timings
+        try:
+            start = perf_counter()
+            recorded = timings.total('record')
+            states, rewards, terminals = await self._call(
+                self._sim._on_simulate_batch, [e.action for e in events])
+        except Exception as e:
+            raise SimulateError(e)
+        encoding = perf_counter()
+        timings.add('simulate', encoding - start -
+                    (timings.total('record') - recorded))
+
+        # instances reset themselves, so a terminal step does not end the
+        # episode of the batch
+        for e, state, reward, terminal in zip(
+                events, states, rewards, terminals):
+            e.state = state
+            e.reward = reward
+            e._sim_step.terminal = terminal
+        timings.add('encode', perf_counter() - encoding)
+        log.simulator_ws(lambda: '\tB{}'.format(len(events)))
+
     async def run(self):
         """ Run loop called from Simulator. Encapsulates one round trip
         to the backend, which might include a simulation loop.
@@ -405,28 +620,43 @@ class Simulator_WS(object):
         if isinstance(event, EpisodeStartEvent):
             log.event("Episode Start")
             try:
-                state = self._sim._on_episode_start(event.initial_properties)
+                state = await self._call(
+                    self._sim._on_episode_start, event.initial_properties)
             except Exception as e:
                 raise EpisodeStartError(e)
 
+            start = perf_counter()
             event.initial_state = state
-            log.simulator("initial state: {}".format(event.initial_state))
+            self._timings.add('encode', perf_counter() - start)
+            log.simulator(lambda: "initial state: {}".format(
+                event.initial_state))
             log.simulator_ws('\tES')
+        elif isinstance(event, SimulateEvent) and self._sim._batched:
+            log.event("Simulate batch")
+            await self._simulate_batch(event)
         elif isinstance(event, SimulateEvent):
             log.event("Simulate")
+            timings = self._timings
             try:
-                log.simulator("action: {}".format(event.action))
-                event.state, event.reward, event.terminal = \
-                    self._sim._on_simulate(event.action)
+                log.simulator("action: %s", event.action)
+                start = perf_counter()
+                recorded = timings.total('record')
+                result = await self._call(self._sim._on_simulate, event.action)
+                encoding = perf_counter()
+                event.state, event.reward, event.terminal = result
             except Exception as e:
                 raise SimulateError(e)
+            timings.add('encode', perf_counter() - encoding)
+            # recording is timed separately, by the simulator
+            timings.add('simulate', encoding - start -
+                        (timings.total('record') - recorded))
 
             log.simulator_ws('\tT' if event.terminal else '\tS')
-            log.simulator("state: {}".format(event.state))
+            log.simulator(lambda: "state: {}".format(event.state))
         elif isinstance(event, EpisodeFinishEvent):
             log.event("Episode Finish")
             try:
-                self._sim._on_episode_finish()
+                await self._call(self._sim._on_episode_finish)
             except Exception as e:
                 raise EpisodeFinishError(e)
             log.simulator_ws('\tF')
@@ -441,4 +671,13 @@ class Simulator_WS(object):
             isinstance(event, SimulateEvent):
             self._sim.flush_record()
 
+        if self._pipelined and self._round_trip_is_next():
+            # send now, so that the server works on the reply while the
+            # caller runs, and receive in the background while the loop
+            # runs
+            if await self._ws_send():
+                self._pending_recv = ensure_future(
+                    self._ws_recv(background=True), loop=self._ioloop)
+
+        self._timings.maybe_log()
         return True
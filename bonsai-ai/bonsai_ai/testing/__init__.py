@@ -0,0 +1,19 @@
+# Copyright (C) 2018 Bonsai, Inc.
+"""
+Local stand-in for the BRAIN service, for testing simulators offline.
+
+BrainServer:     Serves the simulator protocol for training and prediction.
+Policy:          Base class of the policies choosing the served actions.
+ConstantPolicy:  Serves the same action every step.
+RandomPolicy:    Serves uniformly random actions.
+ScriptedPolicy:  Serves a list of actions, or the actions of a function.
+
+Run `python -m bonsai_ai.testing --help` to serve from the command line.
+"""
+
+from bonsai_ai.testing.policies import Policy, ConstantPolicy, \
+    RandomPolicy, ScriptedPolicy
+from bonsai_ai.testing.server import BrainServer, schema, FIELD_TYPES
+
+__all__ = ['BrainServer', 'schema', 'FIELD_TYPES', 'Policy',
+           'ConstantPolicy', 'RandomPolicy', 'ScriptedPolicy']
@@ -0,0 +1,122 @@
+# Copyright (C) 2018 Bonsai, Inc.
+"""
+Serves a stand-in BRAIN until interrupted.
+
+Usage:
+    python -m bonsai_ai.testing --port 9000 --policy random --seed 1
+    python -m bonsai_ai.testing --policy constant --action '{"command": 1}'
+    python -m bonsai_ai.testing --policy scripted --script actions.json \\
+        --state 'x:double,y:double' --action-schema 'move:int32'
+
+Point simulators at it with `--url http://localhost:9000`.
+"""
+
+import argparse
+import json
+import sys
+from collections import OrderedDict
+
+from bonsai_ai.testing.policies import POLICIES
+from bonsai_ai.testing.server import BrainServer, CARTPOLE_ACTION, \
+    CARTPOLE_CONFIG, CARTPOLE_STATE
+
+
+def _fields(text):
+    """ Parses 'name:type,name:type' into (name, type) pairs """
+    fields = []
+    for item in text.split(','):
+        name, sep, type_name = item.strip().partition(':')
+        if not sep or not name:
+            raise argparse.ArgumentTypeError(
+                "Expected 'name:type', got '{}'".format(item))
+        fields.append((name, type_name))
+    return tuple(fields)
+
+
+def _format(fields):
+    return ','.join('{}:{}'.format(name, type_name)
+                    for name, type_name in fields)
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m bonsai_ai.testing',
+        description='Serves a stand-in BRAIN for offline simulator tests.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--policy', choices=sorted(POLICIES),
+                        default='constant')
+    parser.add_argument('--action', type=json.loads, default=None,
+                        help='JSON action of the constant policy')
+    parser.add_argument('--script', default=None,
+                        help='JSON file with the list of actions of the '
+                             'scripted policy')
+    parser.add_argument('--low', type=float, default=-1.0,
+                        help='lowest value of the random policy')
+    parser.add_argument('--high', type=float, default=1.0,
+                        help='highest value of the random policy')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed of the random policy')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='actions per prediction message')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds to wait before each reply')
+    parser.add_argument('--episode-length', type=int, default=100,
+                        help='actions per episode, 0 for no limit')
+    parser.add_argument('--episodes', type=int, default=None,
+                        help='episodes per connection before finishing')
+    parser.add_argument('--state', type=_fields, default=CARTPOLE_STATE,
+                        help="state schema, as 'name:type,...' (default: "
+                             "{})".format(_format(CARTPOLE_STATE)))
+    parser.add_argument('--action-schema', type=_fields,
+                        default=CARTPOLE_ACTION,
+                        help="action schema (default: {})".format(
+                            _format(CARTPOLE_ACTION)))
+    parser.add_argument('--config', type=_fields, default=CARTPOLE_CONFIG,
+                        help="configuration schema (default: {})".format(
+                            _format(CARTPOLE_CONFIG)))
+    parser.add_argument('--properties', type=json.loads, default=None,
+                        help='JSON configuration sent to simulators')
+    parser.add_argument('--simulator', default=None,
+                        help='the only simulator name to accept')
+    return parser
+
+
+def server_for_args(argv=None):
+    """ Returns the BrainServer configured by the command line `argv` """
+    parser = _parser()
+    args = parser.parse_args(argv)
+
+    if args.policy == 'constant':
+        policy = POLICIES['constant'](args.action)
+    elif args.policy == 'random':
+        policy = POLICIES['random'](args.low, args.high, args.seed)
+    else:
+        if args.script is None:
+            parser.error('--policy scripted requires --script')
+        with open(args.script) as f:
+            script = json.load(f, object_pairs_hook=OrderedDict)
+        if not isinstance(script, list) or not script:
+            parser.error('--script must hold a non-empty list of actions')
+        policy = POLICIES['scripted'](script)
+
+    try:
+        server = BrainServer(
+            policy=policy, state_schema=args.state,
+            action_schema=args.action_schema, config_schema=args.config,
+            properties=args.properties, batch_size=args.batch_size,
+            latency=args.latency,
+            episode_length=args.episode_length or None,
+            episodes=args.episodes, simulator_name=args.simulator)
+    except ValueError as e:
+        parser.error(str(e))
+    return server, args
+
+
+def main(argv=None):
+    server, args = server_for_args(argv)
+    server.run(args.host, args.port)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+import random
+from itertools import cycle
+
+from google.protobuf.descriptor import FieldDescriptor
+
+
+_FLOAT_CPPTYPES = (FieldDescriptor.CPPTYPE_DOUBLE,
+                   FieldDescriptor.CPPTYPE_FLOAT)
+_INTEGER_CPPTYPES = (FieldDescriptor.CPPTYPE_INT32,
+                     FieldDescriptor.CPPTYPE_INT64,
+                     FieldDescriptor.CPPTYPE_UINT32,
+                     FieldDescriptor.CPPTYPE_UINT64)
+
+
+class Policy(object):
+    """
+    Chooses the actions a `BrainServer` sends to its simulators.
+
+    Attributes:
+        needs_state: Whether `action` uses the state. When False, the
+                     server passes None instead of decoding each state.
+    """
+    needs_state = False
+
+    def reset(self, fields):
+        """ Called once by the server, with the `FieldDescriptor`s of the
+        action schema """
+        pass
+
+    def action(self, state):
+        """ Returns the action for `state`, as a dictionary """
+        raise NotImplementedError(
+            'Abstract method action() has not been implemented')
+
+
+class ConstantPolicy(Policy):
+    """ Sends the same action every step. Fields missing from `action`
+    are zero. """
+    def __init__(self, action=None):
+        self._action = dict(action or {})
+        self._value = self._action
+
+    def reset(self, fields):
+        self._value = {f.name: f.default_value for f in fields}
+        self._value.update(self._action)
+
+    def action(self, state):
+        return self._value
+
+
+class RandomPolicy(Policy):
+    """ Sends uniformly random actions. Numeric fields are drawn from
+    [low, high], booleans are fair coin flips and strings are empty. """
+    def __init__(self, low=-1.0, high=1.0, seed=None):
+        self.low = low
+        self.high = high
+        self._random = random.Random(seed)
+        self._draws = ()
+
+    def reset(self, fields):
+        draws = []
+        for field in fields:
+            if field.cpp_type in _FLOAT_CPPTYPES:
+                draw = self._uniform
+            elif field.cpp_type in _INTEGER_CPPTYPES:
+                draw = self._integer
+            elif field.cpp_type == FieldDescriptor.CPPTYPE_BOOL:
+                draw = self._bool
+            else:
+                draw = self._empty
+            draws.append((field.name, draw))
+        self._draws = tuple(draws)
+
+    def _uniform(self):
+        return self._random.uniform(self.low, self.high)
+
+    def _integer(self):
+        return self._random.randint(int(self.low), int(self.high))
+
+    def _bool(self):
+        return self._random.random() < 0.5
+
+    def _empty(self):
+        return ''
+
+    def action(self, state):
+        return {name: draw() for name, draw in self._draws}
+
+
+class ScriptedPolicy(Policy):
+    """ Sends the actions of a script, which is either a sequence of
+    actions, repeated once exhausted, or a function from state to action.
+    """
+    def __init__(self, script):
+        self.needs_state = callable(script)
+        self._script = script
+        self._actions = None
+
+    def reset(self, fields):
+        if not self.needs_state:
+            self._actions = cycle(self._script)
+
+    def action(self, state):
+        if self.needs_state:
+            return self._script(state)
+        return next(self._actions)
+
+
+# policies by CLI name
+POLICIES = {
+    'constant': ConstantPolicy,
+    'random': RandomPolicy,
+    'scripted': ScriptedPolicy,
+}
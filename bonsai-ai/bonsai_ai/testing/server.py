@@ -0,0 +1,425 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+import asyncio
+import threading
+import weakref
+from collections import OrderedDict
+
+from aiohttp import web, WSMsgType, WSCloseCode
+from google.protobuf.descriptor_pb2 import DescriptorProto, \
+    FieldDescriptorProto
+
+from bonsai_ai.inkling_factory import shared_factory
+from bonsai_ai.logger import Logger
+from bonsai_ai.proto.generator_simulator_api_pb2 import ServerToSimulator
+from bonsai_ai.proto.generator_simulator_api_pb2 import SimulatorToServer
+from bonsai_ai.testing.policies import ConstantPolicy
+
+log = Logger()
+
+
+# field types of the schemas a BrainServer accepts, by name
+FIELD_TYPES = {
+    'double': FieldDescriptorProto.TYPE_DOUBLE,
+    'float': FieldDescriptorProto.TYPE_FLOAT,
+    'int32': FieldDescriptorProto.TYPE_INT32,
+    'int64': FieldDescriptorProto.TYPE_INT64,
+    'uint32': FieldDescriptorProto.TYPE_UINT32,
+    'uint64': FieldDescriptorProto.TYPE_UINT64,
+    'bool': FieldDescriptorProto.TYPE_BOOL,
+    'string': FieldDescriptorProto.TYPE_STRING,
+    'luminance': FieldDescriptorProto.TYPE_MESSAGE,
+}
+_LUMINANCE_TYPE_NAME = 'bonsai.inkling_types.proto.Luminance'
+
+# the schemas of the cartpole example, used by default
+CARTPOLE_STATE = (('position', 'double'), ('velocity', 'double'),
+                  ('angle', 'double'), ('rotation', 'double'))
+CARTPOLE_ACTION = (('command', 'int32'),)
+CARTPOLE_CONFIG = (('episode_length', 'int32'), ('deque_size', 'uint32'))
+
+# close code of the service for simulators missing from the Inkling
+_CLOSE_UNKNOWN_SIMULATOR = 4043
+
+
+def schema(name, fields):
+    """
+    Returns a `DescriptorProto` named `name`, with `fields` given as a
+    sequence of (name, type) pairs or as an ordered dictionary. The types
+    are the keys of `FIELD_TYPES`.
+    """
+    if isinstance(fields, dict):
+        fields = fields.items()
+    desc_proto = DescriptorProto()
+    desc_proto.name = name
+    for number, (field_name, type_name) in enumerate(fields):
+        if type_name not in FIELD_TYPES:
+            raise ValueError(
+                "Unknown type '{}' for field '{}', expected one of "
+                "{}".format(type_name, field_name,
+                            ', '.join(sorted(FIELD_TYPES))))
+        field = desc_proto.field.add()
+        field.name = field_name
+        field.number = number + 1
+        field.type = FIELD_TYPES[type_name]
+        field.label = FieldDescriptorProto.LABEL_OPTIONAL
+        if type_name == 'luminance':
+            field.type_name = _LUMINANCE_TYPE_NAME
+    return desc_proto
+
+
+class _Reject(Exception):
+    """ Closes a connection with the given websocket close code """
+    def __init__(self, code, reason):
+        super(_Reject, self).__init__(reason)
+        self.code = code
+
+
+class _Connection(object):
+    """ Protocol state of a single simulator connection """
+    def __init__(self, server, sim_id, predict):
+        self.server = server
+        self.sim_id = sim_id
+        self.predict = predict
+        self.prev = ServerToSimulator.UNKNOWN
+        self.episode_steps = 0
+        self.episodes = 0
+
+    def _message(self, message_type):
+        message = ServerToSimulator()
+        message.message_type = message_type
+        message.sim_id = self.sim_id
+        self.prev = message_type
+        return message
+
+    def reply(self, from_sim):
+        """ Returns the message answering `from_sim` """
+        mtype = from_sim.message_type
+        server = self.server
+        if mtype == SimulatorToServer.REGISTER:
+            name = from_sim.register_data.simulator_name
+            if server.simulator_name is not None and \
+                    name != server.simulator_name:
+                raise _Reject(_CLOSE_UNKNOWN_SIMULATOR,
+                              "Simulator {} does not exist.".format(name))
+            message = self._message(ServerToSimulator.ACKNOWLEDGE_REGISTER)
+            data = message.acknowledge_register_data
+            data.properties_schema.CopyFrom(server.config_schema)
+            data.output_schema.CopyFrom(server.state_schema)
+            data.prediction_schema.CopyFrom(server.action_schema)
+            data.sim_id = self.sim_id
+            return message
+
+        if mtype == SimulatorToServer.STATE:
+            if self.predict:
+                return self._predictions(from_sim.state_data,
+                                         len(from_sim.state_data))
+            return self._step(from_sim.state_data)
+
+        if mtype == SimulatorToServer.READY and not self.predict:
+            if self.prev in (ServerToSimulator.ACKNOWLEDGE_REGISTER,
+                             ServerToSimulator.RESET):
+                message = self._message(ServerToSimulator.SET_PROPERTIES)
+                data = message.set_properties_data
+                data.dynamic_properties = server.properties
+                data.reward_name = server.reward_name
+                data.prediction_schema.CopyFrom(server.action_schema)
+                return message
+            if self.prev == ServerToSimulator.SET_PROPERTIES:
+                return self._message(ServerToSimulator.START)
+            if self.prev == ServerToSimulator.STOP:
+                return self._message(ServerToSimulator.RESET)
+
+        raise _Reject(WSCloseCode.POLICY_VIOLATION,
+                      "Unexpected message {} after {}".format(
+                          SimulatorToServer.MessageType.Name(mtype),
+                          ServerToSimulator.MessageType.Name(self.prev)))
+
+    def _step(self, state_data):
+        """ Ends the episode or sends the next batch of predictions """
+        server = self.server
+        for data in state_data:
+            if data.terminal:
+                # the simulator starts the next episode by itself
+                self._end_episode()
+
+        if server.episodes is not None and self.episodes >= server.episodes:
+            return self._message(ServerToSimulator.FINISHED)
+        if server.episode_length is not None and \
+                self.episode_steps >= server.episode_length:
+            self._end_episode()
+            return self._message(ServerToSimulator.STOP)
+
+        self.episode_steps += server.batch_size
+        return self._predictions(state_data, server.batch_size)
+
+    def _end_episode(self):
+        self.episodes += 1
+        self.episode_steps = 0
+        self.server.counters['episodes'] += 1
+
+    def _predictions(self, state_data, count):
+        server = self.server
+        message = self._message(ServerToSimulator.PREDICTION)
+        states = [None]
+        if server.policy.needs_state and state_data:
+            codec = server.state_codec
+            states = [codec.to_dict(codec.parse(data.state))
+                      for data in state_data]
+        for i in range(count):
+            message.prediction_data.add().dynamic_prediction = \
+                server.encode_action(states[i % len(states)])
+        server.counters['predictions'] += count
+        return message
+
+
+class BrainServer(object):
+    """
+    A local stand-in for the BRAIN service, for offline and load testing.
+
+    The server speaks the simulator websocket protocol for training and
+    prediction, and serves the BRAIN information requested by `Brain`. It
+    accepts any user, BRAIN name and version, so simulators connect to it
+    with `--url` pointing at the server and any other settings. Actions
+    are chosen by a `Policy` instead of a model.
+
+    In training, each prediction message carries `batch_size` actions.
+    After `episode_length` actions the server stops the episode, and
+    after `episodes` episodes, terminal states included, it finishes the
+    connection. In prediction, each state is answered with one action.
+
+    Arguments:
+        policy:          The `Policy` choosing actions. Defaults to a
+                         `ConstantPolicy` of zeros.
+        state_schema:    The fields of states, as (name, type) pairs; see
+                         `FIELD_TYPES`.
+        action_schema:   The fields of actions.
+        config_schema:   The fields of the episode configuration.
+        properties:      The episode configuration sent to simulators, as
+                         a dictionary. Missing fields are zero.
+        batch_size:      The number of actions per prediction message.
+        latency:         Seconds to wait before each reply.
+        episode_length:  Actions per episode, or None for no limit.
+        episodes:        Episodes per connection, or None for no limit.
+        simulator_name:  The only simulator name accepted, or None to
+                         accept any.
+
+    Attributes:
+        counters: Totals of 'connections', 'messages', 'states',
+                  'predictions' and 'episodes', across connections.
+
+    Example:
+        server = BrainServer(policy=RandomPolicy(seed=1), batch_size=8)
+        with server:
+            config = bonsai_ai.Config([
+                __name__, '--url', server.url, '--brain', 'stand_in',
+                '--username', 'test', '--accesskey', 'test'])
+            ...
+    """
+    def __init__(self, policy=None, state_schema=CARTPOLE_STATE,
+                 action_schema=CARTPOLE_ACTION,
+                 config_schema=CARTPOLE_CONFIG, properties=None,
+                 batch_size=1, latency=0.0, episode_length=100,
+                 episodes=None, simulator_name=None,
+                 reward_name='stand_in_objective'):
+        if batch_size < 1:
+            raise ValueError(
+                "batch_size must be at least 1, got {}".format(batch_size))
+        if latency < 0:
+            raise ValueError(
+                "latency must not be negative, got {}".format(latency))
+        if episode_length is not None and episode_length < 1:
+            raise ValueError(
+                "episode_length must be at least 1, got {}".format(
+                    episode_length))
+
+        self.policy = policy if policy is not None else ConstantPolicy()
+        self.state_schema = schema('State', state_schema)
+        self.action_schema = schema('Action', action_schema)
+        self.config_schema = schema('Config', config_schema)
+        self.batch_size = batch_size
+        self.latency = latency
+        self.episode_length = episode_length
+        self.episodes = episodes
+        self.simulator_name = simulator_name
+        self.reward_name = reward_name
+
+        factory = shared_factory()
+        self.state_codec = factory.codec_for_proto(self.state_schema)
+        self.action_codec = factory.codec_for_proto(self.action_schema)
+        config_codec = factory.codec_for_proto(self.config_schema)
+        config = {f.name: f.default_value for f in config_codec.fields}
+        config.update(properties or {})
+        self.properties = config_codec.from_dict(config).SerializeToString()
+        self.policy.reset(self.action_codec.fields)
+
+        self.counters = OrderedDict((name, 0) for name in (
+            'connections', 'messages', 'states', 'predictions', 'episodes'))
+        self.host = None
+        self.port = None
+        self._sim_ids = 0
+        self._last_action = None
+        self._last_action_bytes = None
+        self._loop = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """ The URL to pass to `--url`, once the server is started """
+        return 'http://{}:{}'.format(self.host, self.port)
+
+    def encode_action(self, state):
+        """ Returns the serialized action of the policy for `state` """
+        action = self.policy.action(state)
+        # constant policies return the same object every time
+        if action is not self._last_action:
+            self._last_action_bytes = \
+                self.action_codec.from_dict(action).SerializeToString()
+            self._last_action = action
+        return self._last_action_bytes
+
+    def app(self):
+        """ Returns the aiohttp application serving this BRAIN """
+        app = web.Application()
+        app['websockets'] = weakref.WeakSet()
+        app.on_shutdown.append(self._on_shutdown)
+        app.router.add_get('/v1/{user}/{brain}', self._info)
+        app.router.add_get('/v1/{user}/{brain}/status', self._status)
+        app.router.add_get('/v1/{user}/{brain}/sims', self._sims)
+        app.router.add_get('/v1/{user}/{brain}/sims/ws', self._train)
+        app.router.add_get('/v1/{user}/{brain}/{version}/predictions/ws',
+                           self._predict)
+        return app
+
+    def run(self, host='127.0.0.1', port=9000):
+        """ Serves until interrupted """
+        self.host, self.port = host, port
+        web.run_app(self.app(), host=host, port=port)
+
+    def start(self, host='127.0.0.1', port=0):
+        """ Starts serving from a background thread. With the default port
+        of 0, a free port is chosen; see `port` and `url`. """
+        started = threading.Event()
+        errors = []
+
+        def serve():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            app = self.app()
+            handler = app.make_handler(loop=loop, access_log=None)
+            try:
+                server = loop.run_until_complete(
+                    loop.create_server(handler, host, port))
+            except Exception as e:
+                errors.append(e)
+                started.set()
+                loop.close()
+                return
+            self.host = host
+            self.port = server.sockets[0].getsockname()[1]
+            self._loop = loop
+            started.set()
+
+            loop.run_forever()
+
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.run_until_complete(app.shutdown())
+            loop.run_until_complete(handler.shutdown(1.0))
+            loop.run_until_complete(app.cleanup())
+            loop.close()
+
+        self._thread = threading.Thread(
+            target=serve, name='BrainServer', daemon=True)
+        self._thread.start()
+        started.wait()
+        if errors:
+            self._thread.join()
+            raise errors[0]
+        return self
+
+    def stop(self):
+        """ Stops a server started with `start` """
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+        self._loop = None
+
+    def __enter__(self):
+        return self.start() if self._thread is None else self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def stats(self):
+        """ Returns a copy of `counters` """
+        return dict(self.counters)
+
+    async def _info(self, request):
+        info = request.match_info
+        return web.json_response({
+            'name': info['brain'],
+            'user': info['user'],
+            'description': 'bonsai_ai.testing stand-in',
+            'versions': [{'version': 1, 'url': '/v1/{}/{}/1'.format(
+                info['user'], info['brain'])}],
+        })
+
+    async def _status(self, request):
+        return web.json_response({
+            'name': request.match_info['brain'],
+            'user': request.match_info['user'],
+            'state': 'In Progress',
+            'episode': self.counters['episodes'],
+            'objective_name': self.reward_name,
+        })
+
+    async def _sims(self, request):
+        name = self.simulator_name
+        sims = {name: {'active': [], 'inactive': []}} if name else {}
+        return web.json_response(sims)
+
+    async def _train(self, request):
+        return await self._serve(request, predict=False)
+
+    async def _predict(self, request):
+        return await self._serve(request, predict=True)
+
+    async def _serve(self, request, predict):
+        ws = web.WebSocketResponse(protocols=('', 'bonsaiauth'))
+        await ws.prepare(request)
+        request.app['websockets'].add(ws)
+
+        self._sim_ids += 1
+        self.counters['connections'] += 1
+        connection = _Connection(self, self._sim_ids, predict)
+        counters = self.counters
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.BINARY:
+                    continue
+                from_sim = SimulatorToServer()
+                from_sim.ParseFromString(msg.data)
+                counters['messages'] += 1
+                counters['states'] += len(from_sim.state_data)
+                try:
+                    reply = connection.reply(from_sim)
+                except _Reject as e:
+                    log.info(str(e))
+                    await ws.close(code=e.code, message=str(e).encode())
+                    break
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                await ws.send_bytes(reply.SerializeToString())
+        finally:
+            request.app['websockets'].discard(ws)
+
+        await ws.close()
+        return ws
+
+    async def _on_shutdown(self, app):
+        for ws in set(app['websockets']):
+            await ws.close(code=WSCloseCode.GOING_AWAY,
+                           message=b'Server shutdown')
@@ -0,0 +1,163 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+from bisect import bisect_left
+from collections import OrderedDict
+from time import perf_counter
+
+from bonsai_ai.logger import Logger
+
+log = Logger()
+
+# the phases of a step, in the order a step goes through them
+PHASES = ('network', 'parse', 'decode', 'simulate', 'encode', 'record',
+          'send')
+
+# upper bounds of the histogram buckets, in seconds, from 1us to 10s;
+# a last bucket holds everything slower
+BUCKET_BOUNDS = tuple(
+    float('{}e{}'.format(mantissa, exponent))
+    for exponent in range(-6, 1) for mantissa in ('1', '2.5', '5')) + (10.0,)
+
+# seconds between the summaries logged to the 'perf' domain
+SUMMARY_INTERVAL = 10.0
+
+
+class Histogram(object):
+    """ Counts values by bucket, with the upper bounds of the buckets given
+    by `bounds`; a last bucket holds values above every bound """
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """ Estimates the `q` quantile by interpolating within the bucket
+        that holds it """
+        if not self.count:
+            return 0.0
+        bounds = self.bounds
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = bounds[i - 1] if i else 0.0
+                high = bounds[i] if i < len(bounds) else self.max
+                return min(low + (high - low) * (rank - seen) / count,
+                           self.max)
+            seen += count
+        return self.max
+
+    def buckets(self):
+        """ Returns the cumulative histogram, as a list of (upper bound,
+        count) pairs ending with infinity """
+        cumulative = []
+        seen = 0
+        for bound, count in zip(self.bounds + (float('inf'),),
+                                list(self.counts)):
+            seen += count
+            cumulative.append((bound, seen))
+        return cumulative
+
+    def as_dict(self):
+        return OrderedDict((
+            ('count', self.count),
+            ('total', self.total),
+            ('mean', self.total / self.count if self.count else 0.0),
+            ('p50', self.quantile(0.5)),
+            ('p99', self.quantile(0.99)),
+            ('max', self.max),
+            ('buckets', self.buckets()),
+        ))
+
+
+class StepTimings(object):
+    """
+    Cumulative histograms of the time a simulator spends in each phase of
+    a step:
+
+    network:  Waiting for the server's reply.
+    parse:    Parsing the reply.
+    decode:   Decoding its predictions into actions.
+    simulate: The `simulate` callback, not counting recording.
+    encode:   Converting states into messages and building the message
+              sent to the server.
+    record:   Recording steps with `--record`.
+    send:     Serializing and sending the message.
+
+    A separate histogram times whole steps, from one message sent to the
+    server to the next, which also counts the time spent between calls to
+    `run` and in the server.
+
+    While the 'perf' log domain is enabled (see `--performance`), a
+    summary is logged every `summary_interval` seconds.
+    """
+    def __init__(self, summary_interval=SUMMARY_INTERVAL):
+        self.summary_interval = summary_interval
+        self.reset()
+
+    def reset(self):
+        """ Clears every histogram """
+        self._phases = OrderedDict(
+            (phase, Histogram()) for phase in PHASES)
+        self._step = Histogram()
+        self._last_summary = perf_counter()
+
+    def add(self, phase, seconds):
+        """ Adds a duration, in seconds, to the histogram of `phase` """
+        self._phases[phase].add(seconds)
+
+    def add_step(self, seconds):
+        """ Adds the duration of a whole step, in seconds """
+        self._step.add(seconds)
+
+    def step(self):
+        """ Returns the `Histogram` of whole steps """
+        return self._step
+
+    def total(self, phase):
+        """ Returns the seconds spent in `phase` so far """
+        return self._phases[phase].total
+
+    def histograms(self):
+        """ Returns the `Histogram` of each phase, by phase """
+        return self._phases
+
+    def as_dict(self):
+        """ Returns the histogram of each phase as a dictionary """
+        return OrderedDict(
+            (phase, histogram.as_dict())
+            for phase, histogram in self._phases.items())
+
+    def summary(self):
+        """ Returns a one-line summary of the share of time, p50 and p99
+        of each phase """
+        elapsed = sum(h.total for h in self._phases.values())
+        parts = []
+        for phase, histogram in self._phases.items():
+            if not histogram.count:
+                continue
+            parts.append('{} {:.1%} p50={:.0f}us p99={:.0f}us'.format(
+                phase, histogram.total / elapsed if elapsed else 0.0,
+                histogram.quantile(0.5) * 1e6,
+                histogram.quantile(0.99) * 1e6))
+        return ' | '.join(parts) or 'no steps timed'
+
+    def maybe_log(self):
+        """ Logs the summary if the 'perf' domain is enabled and the
+        summary interval has passed """
+        if log.is_enabled('perf'):
+            now = perf_counter()
+            if now - self._last_summary >= self.summary_interval:
+                self._last_summary = now
+                log.perf(self.summary())
@@ -0,0 +1,148 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+from inspect import isawaitable
+from typing import Any, Sequence, Tuple
+
+from bonsai_ai.exceptions import UsageError
+from bonsai_ai.simulator import Simulator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class VectorSimulator(Simulator):
+    """
+    A `Simulator` that steps a batch of environment instances per call.
+
+    The server may send several predictions in a single message. A
+    `Simulator` handles them with one `simulate` call each, while a
+    `VectorSimulator` receives all of them at once in `simulate_batch`.
+    Action `i` of a batch belongs to environment instance `i`, so
+    vectorized models (NumPy physics, gym vector environments) can step
+    every instance in a single call.
+
+    Each instance is responsible for resetting itself when it reports a
+    terminal step, as gym vector environments do: the SDK passes the
+    terminal flags on to the server, but does not call `episode_finish`
+    or `episode_start` between batches. Both are still called when the
+    server starts or stops an episode. `episode_count` counts terminal
+    steps across all instances, and `episode_reward` sums their rewards.
+
+    Attributes:
+        batch_format: Either 'list' (the default), in which case actions
+                      are passed as a list of dicts, or 'numpy', in which
+                      case they are passed as a NumPy structured array
+                      with one field per action field.
+
+    Example Code:
+        class MyVectorSimulator(bonsai_ai.VectorSimulator):
+            batch_format = 'numpy'
+
+            def simulate_batch(self, actions):
+                self.envs.step(actions['delta'])
+                return (self.envs.states(), self.envs.rewards(),
+                        self.envs.terminals())
+    """
+
+    batch_format = 'list'
+    _batched = True
+
+    def simulate_batch(
+            self, actions) -> Tuple[Sequence[Any], Sequence[float],
+                                    Sequence[bool]]:
+        """
+        Steps every environment instance of the batch forward by a single
+        step.
+
+        Arguments:
+            actions: The actions to take, one per instance, as a list of
+                     dicts or a NumPy structured array (see
+                     `batch_format`).
+
+        Returns:
+            A tuple of (states, rewards, terminals), each with one entry
+            per action. `states` may be a list of dicts or a NumPy
+            structured array.
+        """
+        raise NotImplementedError(
+            'Abstract method simulate_batch() has not been implemented')
+
+    def simulate(self, action):
+        """ Steps a single instance by calling `simulate_batch` """
+        result = self.simulate_batch(self._actions_for_batch([action]))
+        if isawaitable(result):
+            return self._after_async(result, self._first_of_batch)
+        return self._first_of_batch(result)
+
+    def _first_of_batch(self, result):
+        states, rewards, terminals = result
+        return (self._state_at(states, 0), rewards[0], terminals[0])
+
+    def _on_simulate_batch(self, actions):
+        """ Callback hook for simulate_batch, called by event dispatcher """
+        count = len(actions)
+        self._iteration_rate.update(count)
+        self.iteration_count += count
+        self._iteration_total += count
+
+        result = self.simulate_batch(self._actions_for_batch(actions))
+        if isawaitable(result):
+            return self._after_async(
+                result, self._after_simulate_batch, actions)
+        return self._after_simulate_batch(result, actions)
+
+    def _after_simulate_batch(self, result, actions):
+        count = len(actions)
+        states, rewards, terminals = result
+        if len(states) != count or len(rewards) != count or \
+                len(terminals) != count:
+            raise ValueError(
+                'simulate_batch() returned {} states, {} rewards and {} '
+                'terminals for {} actions'.format(
+                    len(states), len(rewards), len(terminals), count))
+
+        states = [self._state_at(states, i) for i in range(count)]
+        rewards = [float(reward) for reward in rewards]
+        terminals = [bool(terminal) for terminal in terminals]
+        self.episode_reward += sum(rewards)
+
+        for terminal in terminals:
+            if terminal:
+                self._episode_rate.update()
+                self.episode_count += 1
+
+        if self.writer is not None:
+            for i in range(count):
+                # the last record is written by the run loop
+                if i:
+                    self.flush_record()
+                self._record_state(
+                    states[i], actions[i], rewards[i], terminals[i])
+
+        return states, rewards, terminals
+
+    def _actions_for_batch(self, actions):
+        if self.batch_format == 'list':
+            return actions
+        if self.batch_format != 'numpy':
+            raise UsageError(
+                "Unknown batch_format '{}', expected 'list' or "
+                "'numpy'".format(self.batch_format))
+        if numpy is None:
+            raise UsageError("batch_format 'numpy' requires numpy")
+
+        decoder = self._impl._prediction_codec.decoder
+        return numpy.array(
+            [tuple(action[name] for name in decoder.field_names)
+             for action in actions],
+            dtype=decoder.dtype)
+
+    @staticmethod
+    def _state_at(states, i):
+        state = states[i]
+        names = getattr(getattr(state, 'dtype', None), 'names', None)
+        if names:
+            return {name: state[name] for name in names}
+        return state
@@ -1,7 +1,43 @@
 import csv
+import glob
 import json
+import numbers
 import os
 import sys
+import time
+from queue import Empty, Queue
+from threading import Thread
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from google.protobuf.descriptor import FieldDescriptor
+
+from bonsai_ai.common.proto_to_state import CPPTYPE_DTYPES
+from bonsai_ai.logger import Logger
+
+log = Logger()
+
+# marks the end of the records queued for the writer thread
+_CLOSE = object()
+
+# NumPy dtype of the column of each protobuf field type; message-typed
+# fields, such as Luminance, have none
+FIELD_DTYPES = dict(CPPTYPE_DTYPES)
+FIELD_DTYPES[FieldDescriptor.CPPTYPE_ENUM] = 'i4'
+FIELD_DTYPES[FieldDescriptor.CPPTYPE_STRING] = 'U'
+
+# suffix of the npz array that marks the missing values of a column
+_MISSING_SUFFIX = ':missing'
 
 
 class Writer(object):
@@ -12,13 +48,21 @@ class Writer(object):
 
     """
     An abstract base class for streaming simulation data to a file.
-    Two supported specializations (CSVWriter and JSONWriter) are
-    provided below.
+    Two text specializations (CSVWriter and JSONWriter) and two columnar
+    ones (NpzWriter and ParquetWriter) are provided below.
 
     When recording is enabled (see `--record` flag), `Simulator`
     automatically creates and instance of `Writer` in its constructor.
     Format specialization is chosen based on the configured log filename.
 
+    By default every record is flushed to disk as soon as it is written. A
+    buffered writer (see `--record-buffered`) instead hands records to a
+    background thread through a bounded queue of `queue_size` records. The
+    thread formats them and flushes the file once `flush_records` records
+    are pending or `flush_interval` seconds have passed since the first of
+    them, and `close` waits for every queued record to reach the disk. When
+    the queue is full, `write` blocks until the thread catches up.
+
     Example Code:
 
     ```python
@@ -41,11 +85,21 @@ class Writer(object):
     ```
     """
 
-    def __init__(self, record_file):
+    def __init__(self, record_file, buffered=False, queue_size=1024,
+                 flush_records=256, flush_interval=1.0):
         self._schema = []
+        # key -> NumPy dtype of its column, for the keys whose type is known
+        self._dtypes = {}
         self._current_record = {}
         self._record_file = record_file
         self._logfile = None
+        self._logfile_name = None
+        self._buffered = buffered
+        self._queue = Queue(queue_size)
+        self._flush_records = flush_records
+        self._flush_interval = flush_interval
+        self._thread = None
+        self._error = None
 
     def _add_prefix(self, key, prefix):
         if prefix is not None:
@@ -59,11 +113,25 @@ class Writer(object):
         else:
             pass
 
-    def _open_logfile(self):
+    def _open_logfile(self, record_file):
+        # line buffered, unless the writer thread decides when to flush
+        buffering = -1 if self._buffered else 1
         if sys.version_info[0] < 3:
-            self._logfile = open(self._record_file, 'ab', 1)
+            self._logfile = open(record_file, 'ab', buffering)
         else:
-            self._logfile = open(self._record_file, 'a', 1, newline='')
+            self._logfile = open(record_file, 'a', buffering, newline='')
+        self._logfile_name = record_file
+
+    def _close_logfile(self):
+        if self._logfile is not None:
+            self._logfile.close()
+            self._logfile = None
+            self._logfile_name = None
+
+    @property
+    def buffered(self):
+        """ True if records are written by a background thread """
+        return self._buffered
 
     @property
     def record_file(self):
@@ -76,30 +144,48 @@ class Writer(object):
     @record_file.setter
     def record_file(self, new_file):
         self._record_file = new_file
-        if self._logfile is not None:
-            self._logfile.close()
-            self._logfile = None
+        # the writer thread switches files with the first record queued
+        # for the new one
+        if not self._buffered:
+            self._close_logfile()
 
     def add(self, obj, prefix=None):
-        """ Adds the given dictionary to the current log line.
+        """ Adds the given dictionary, record or NumPy structured scalar
+        to the current log line.
 
         Un-enabled keys are silently ignored
         """
+        if not hasattr(obj, 'keys'):
+            # a NumPy structured scalar, read as Python values
+            obj = dict(zip(obj.dtype.names, obj.item()))
         for key in obj.keys():
             self._insert_kvp(key, obj[key], prefix)
 
-    def enable_keys(self, keys, prefix=None):
+    def enable_keys(self, keys, prefix=None, dtypes=None):
         """ Enable the given keys, prepended by prefix, for all subsequent
         log events for this writer.
+
+        `dtypes` optionally maps keys, without the prefix, to the NumPy
+        dtype of their column in columnar recordings. The columns of other
+        keys are typed by their values in the first shard written.
         """
+        for key, dtype in (dtypes or {}).items():
+            self._dtypes[self._add_prefix(key, prefix)] = dtype
         keys = [self._add_prefix(k, prefix) for k in keys]
         keys = [k for k in keys if k not in self._schema]
         for key in keys:
             self._schema.append(key)
             self._current_record[key] = None
 
+    def enable_fields(self, fields, prefix=None):
+        """ Enable a key for each protobuf FieldDescriptor in `fields`,
+        typed by the field's type """
+        self.enable_keys(
+            [field.name for field in fields], prefix,
+            dict((field.name, FIELD_DTYPES.get(field.cpp_type))
+                 for field in fields))
+
     def _reset(self):
-        self._logfile.flush()
         self._current_record = dict((k, None) for k in self._schema)
 
     def write(self):
@@ -111,17 +197,92 @@ class Writer(object):
         However, should your particular use case require calling `write`
         manually, here it is.
         """
+        if not self._buffered:
+            self._write_to(self._record_file, self._current_record)
+            self._logfile.flush()
+        else:
+            self._raise_thread_error()
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='bonsai-writer')
+                self._thread.daemon = True
+                self._thread.start()
+            # _reset replaces the current record, so the queued one is
+            # never modified again
+            self._queue.put((self._record_file, self._current_record))
+        self._reset()
+
+    def _write_to(self, record_file, record):
+        if self._logfile is None or record_file != self._logfile_name:
+            self._close_logfile()
+            self._open_logfile(record_file)
+        self._write_record(record)
+
+    def _write_record(self, record):
+        """ Formats a single record to the open log file """
         raise NotImplementedError(
             "Invalid log file: {}".format(self._logfile))
 
+    def _run(self):
+        """ Writer thread: drains the queue until `close` """
+        pending = 0
+        deadline = None
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except Empty:
+                item = None
+            if item is _CLOSE:
+                break
+            if self._error is not None:
+                # keep draining, so that write() never blocks on a full
+                # queue; the error is raised by the next write or close
+                continue
+
+            try:
+                if item is not None:
+                    self._write_to(*item)
+                    pending += 1
+                    if deadline is None:
+                        deadline = time.monotonic() + self._flush_interval
+                if pending >= self._flush_records or (
+                        deadline is not None and
+                        time.monotonic() >= deadline):
+                    self._logfile.flush()
+                    pending = 0
+                    deadline = None
+            except Exception as e:
+                self._error = e
+
+        try:
+            self._close_logfile()
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+
+    def _raise_thread_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
     def close(self):
         """
         Close the log file.
         As with `write`, this method is called automatically by
         `Simulator`. You generally shouldn't need to call it by hand.
+
+        A buffered writer first waits for its queued records to be written.
+        Writing again afterwards reopens the file.
         """
-        if self._logfile:
-            self._logfile.close()
+        if self._thread is not None:
+            self._queue.put(_CLOSE)
+            self._thread.join()
+            self._thread = None
+            self._raise_thread_error()
+        else:
+            self._close_logfile()
 
 
 class CSVWriter(Writer):
@@ -129,25 +290,24 @@ class CSVWriter(Writer):
     A class to export simulation data in CSV form, line by line.
     """
 
-    def __init__(self, record_file, delimiter=','):
+    def __init__(self, record_file, delimiter=',', **kwargs):
         self._needs_header = True
         if os.path.exists(record_file):
             self._needs_header = False
-        super(CSVWriter, self).__init__(record_file)
+        super(CSVWriter, self).__init__(record_file, **kwargs)
         self._delimiter = delimiter
 
-    def write(self):
-        if self._logfile is None:
-            needs_header = not os.path.exists(self._record_file)
-            self._open_logfile()
-            self._writer = csv.DictWriter(
-                self._logfile, self._schema, delimiter=self._delimiter)
+    def _open_logfile(self, record_file):
+        needs_header = not os.path.exists(record_file)
+        super(CSVWriter, self)._open_logfile(record_file)
+        self._writer = csv.DictWriter(
+            self._logfile, self._schema, delimiter=self._delimiter)
 
-            if needs_header:
-                self._writer.writeheader()
+        if needs_header:
+            self._writer.writeheader()
 
-        self._writer.writerow(self._current_record)
-        self._reset()
+    def _write_record(self, record):
+        self._writer.writerow(record)
 
 
 class JSONWriter(Writer):
@@ -157,13 +317,258 @@ class JSONWriter(Writer):
     constructing large arrays in memory.
     """
 
-    def __init__(self, record_file):
-        super(JSONWriter, self).__init__(record_file)
+    def __init__(self, record_file, **kwargs):
+        super(JSONWriter, self).__init__(record_file, **kwargs)
 
-    def write(self):
-        if self._logfile is None:
-            self._open_logfile()
+    def _write_record(self, record):
+        self._logfile.write("{}\n".format(json.dumps(record)))
 
-        self._logfile.write("{}\n".format(
-            json.dumps(self._current_record)))
-        self._reset()
+
+class _Shards(object):
+    """
+    The open "log file" of a ColumnarWriter: buffers rows and writes them
+    out a shard at a time.
+    """
+
+    def __init__(self, writer, record_file):
+        self._writer = writer
+        self._rows = []
+        self._stem, self._extension = os.path.splitext(record_file)
+        # continue after the last shard of an existing recording
+        existing = writer.shard_files(record_file)
+        self._index = 0
+        if existing:
+            last, _ = os.path.splitext(existing[-1])
+            self._index = int(last[-5:]) + 1
+
+    def append(self, record):
+        self._rows.append(record)
+        if len(self._rows) >= self._writer.rows_per_shard:
+            self._write_shard()
+
+    def flush(self):
+        # a shard is written whenever rows_per_shard rows are buffered, and
+        # once more on close; flushing earlier would only fragment the
+        # recording into small shards
+        pass
+
+    def close(self):
+        if self._rows:
+            self._write_shard()
+
+    def _write_shard(self):
+        rows, self._rows = self._rows, []
+        names = []
+        columns = []
+        missing = []
+        for name in self._writer._schema:
+            values = [row.get(name) for row in rows]
+            dtype = self._writer._column_dtype(name, values)
+            if dtype is None:
+                continue
+            names.append(name)
+            column, mask = _column(values, dtype)
+            columns.append(column)
+            missing.append(mask)
+        path = '{}-{:05d}{}'.format(self._stem, self._index, self._extension)
+        self._writer._write_shard(path, names, columns, missing)
+        self._index += 1
+
+
+# the value stored in place of a missing value, by dtype kind
+_FILLS = {'b': False, 'i': 0, 'u': 0, 'f': float('nan'), 'U': ''}
+
+
+def _infer_dtype(values):
+    """ Returns the dtype of a column of values whose type is not known,
+    or None if every value is missing """
+    present = [v for v in values if v is not None]
+    if not present:
+        return None
+    if all(isinstance(v, (bool, numpy.bool_)) for v in present):
+        return '?'
+    if all(isinstance(v, numbers.Integral) for v in present):
+        return 'i8'
+    if all(isinstance(v, numbers.Real) for v in present):
+        return 'f8'
+    return 'U'
+
+
+def _column(values, dtype):
+    """ Returns a NumPy array of `dtype` for a column of record values,
+    and a boolean array marking the missing values, or None if none is
+    missing. Missing values are stored as 0, False, NaN or ''. """
+    dtype = numpy.dtype(dtype)
+    fill = _FILLS[dtype.kind]
+    mask = [v is None for v in values]
+    if dtype.kind == 'U':
+        values = ['' if v is None else str(v) for v in values]
+    else:
+        values = [fill if v is None else v for v in values]
+    column = numpy.array(values, dtype=dtype)
+    return column, (numpy.array(mask, dtype='?') if any(mask) else None)
+
+
+class ColumnarWriter(Writer):
+    """
+    An abstract base class for writers that store simulation data by
+    column rather than by record.
+
+    Records are buffered into typed column arrays, one per enabled key, and
+    written out as a compressed shard every `rows_per_shard` records, and
+    once more when the writer is closed. Shards are numbered files next to
+    the record file: recording to `run.npz` produces `run-00000.npz`,
+    `run-00001.npz` and so on. Recording to an existing recording adds
+    shards after its last one. Use `load` to read a recording back.
+
+    Columns are typed by the schema of the simulator: state, action and
+    config fields by their protobuf types, and the other keys recorded by
+    `Simulator` by their Python types. Keys enabled without a type are
+    typed by their values in the first shard, and keep that type in later
+    shards. Missing values, such as the action of an episode's first
+    record, are marked as such: `load` returns a NumPy masked array for a
+    column with missing values. Message-typed fields, such as Luminance,
+    are not recorded.
+
+    Requires NumPy.
+    """
+
+    def __init__(self, record_file, rows_per_shard=10000, **kwargs):
+        if numpy is None:
+            raise ImportError(
+                "{} requires numpy".format(type(self).__name__))
+        super(ColumnarWriter, self).__init__(record_file, **kwargs)
+        self.rows_per_shard = rows_per_shard
+
+    def enable_fields(self, fields, prefix=None):
+        skipped = [f.name for f in fields
+                   if FIELD_DTYPES.get(f.cpp_type) is None]
+        if skipped:
+            log.info('Not recording the message-typed fields {} to {}'.format(
+                ', '.join(self._add_prefix(name, prefix)
+                          for name in skipped), self._record_file))
+        super(ColumnarWriter, self).enable_fields(
+            [f for f in fields if FIELD_DTYPES.get(f.cpp_type) is not None],
+            prefix)
+
+    def _column_dtype(self, name, values):
+        """ Returns the dtype of the column of `name`, typing it by
+        `values` if its type is not known yet """
+        dtype = self._dtypes.get(name)
+        if dtype is None:
+            dtype = _infer_dtype(values)
+            if dtype is not None:
+                self._dtypes[name] = dtype
+            else:
+                dtype = 'f8'
+        return dtype
+
+    def _open_logfile(self, record_file):
+        self._logfile = _Shards(self, record_file)
+        self._logfile_name = record_file
+
+    def _write_record(self, record):
+        self._logfile.append(record)
+
+    def _write_shard(self, path, names, columns, missing):
+        """ Writes one shard, given its column names and arrays, and for
+        each column the mask of its missing values, or None """
+        raise NotImplementedError(
+            "Invalid log file: {}".format(path))
+
+    @classmethod
+    def _read_shard(cls, path):
+        """ Returns a dict of the column arrays of one shard, masked
+        arrays for the columns with missing values """
+        raise NotImplementedError(
+            "Invalid log file: {}".format(path))
+
+    @staticmethod
+    def shard_files(record_file):
+        """ Returns the shards of a recording, in the order written """
+        stem, extension = os.path.splitext(record_file)
+        return sorted(glob.glob(
+            glob.escape(stem) + '-' + '[0-9]' * 5 + glob.escape(extension)))
+
+    @classmethod
+    def load(cls, record_file):
+        """
+        Reads a recording back, returning a dict that maps each key to a
+        NumPy array with one entry per record, across all shards. Columns
+        with missing values are NumPy masked arrays.
+        """
+        shards = [cls._read_shard(path)
+                  for path in cls.shard_files(record_file)]
+        names = []
+        for shard in shards:
+            names.extend(name for name in shard if name not in names)
+        columns = {}
+        for name in names:
+            parts = [shard[name] for shard in shards if name in shard]
+            if any(isinstance(part, numpy.ma.MaskedArray) for part in parts):
+                columns[name] = numpy.ma.concatenate(parts)
+            else:
+                columns[name] = numpy.concatenate(parts)
+        return columns
+
+
+class NpzWriter(ColumnarWriter):
+    """
+    A class to store simulation data in compressed NumPy `.npz` shards,
+    one array per key.
+    """
+
+    def _write_shard(self, path, names, columns, missing):
+        arrays = dict(zip(names, columns))
+        for name, mask in zip(names, missing):
+            if mask is not None:
+                arrays[name + _MISSING_SUFFIX] = mask
+        numpy.savez_compressed(path, **arrays)
+
+    @classmethod
+    def _read_shard(cls, path):
+        with numpy.load(path) as shard:
+            columns = {}
+            for name in shard.files:
+                if name.endswith(_MISSING_SUFFIX):
+                    continue
+                column = shard[name]
+                mask_name = name + _MISSING_SUFFIX
+                if mask_name in shard.files:
+                    column = numpy.ma.masked_array(column, shard[mask_name])
+                columns[name] = column
+            return columns
+
+
+class ParquetWriter(ColumnarWriter):
+    """
+    A class to store simulation data in Parquet shards, each holding a
+    single row group. Requires pyarrow.
+    """
+
+    def __init__(self, record_file, **kwargs):
+        if pyarrow is None:
+            raise ImportError("ParquetWriter requires pyarrow")
+        super(ParquetWriter, self).__init__(record_file, **kwargs)
+
+    def _write_shard(self, path, names, columns, missing):
+        # missing values are stored as Parquet nulls
+        table = pyarrow.Table.from_arrays(
+            [pyarrow.array(column, mask=mask)
+             for column, mask in zip(columns, missing)], names=names)
+        pyarrow.parquet.write_table(table, path)
+
+    @classmethod
+    def _read_shard(cls, path):
+        table = pyarrow.parquet.read_table(path)
+        columns = {}
+        for name in table.column_names:
+            column = table.column(name)
+            if not column.null_count:
+                columns[name] = column.to_numpy()
+                continue
+            mask = pyarrow.compute.is_null(column).to_numpy()
+            kind = numpy.dtype(column.type.to_pandas_dtype()).kind
+            filled = pyarrow.compute.fill_null(column, _FILLS.get(kind, ''))
+            columns[name] = numpy.ma.masked_array(filled.to_numpy(), mask)
+        return columns
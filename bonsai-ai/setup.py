@@ -40,4 +40,9 @@ setup(
     ],
     python_requires='>=3.5',
     packages=find_packages(),
+    entry_points={
+        'console_scripts': [
+            'bonsai-testing-server=bonsai_ai.testing.__main__:main',
+        ],
+    },
 )
@@ -363,6 +363,31 @@ def record_csv_config():
     ])
 
 
+@pytest.fixture
+def record_buffered_config():
+    return Config([
+        __name__,
+        '--accesskey=VALUE',
+        '--username=alice',
+        '--url=http://127.0.0.1:9000',
+        '--brain=cartpole',
+        '--record=foobar.json',
+        '--record-buffered',
+    ])
+
+
+@pytest.fixture
+def record_npz_config():
+    return Config([
+        __name__,
+        '--accesskey=VALUE',
+        '--username=alice',
+        '--url=http://127.0.0.1:9000',
+        '--brain=cartpole',
+        '--record=foobar.npz',
+    ])
+
+
 @pytest.fixture
 def record_csv_config_predict():
     return Config([
@@ -523,6 +548,24 @@ def record_csv_sim(record_csv_config):
     return sim
 
 
+@pytest.fixture
+def record_buffered_sim(record_buffered_config):
+    requests.patch("http://127.0.0.1:9000/cartpole")
+    brain = Brain(record_buffered_config)
+    sim = CartSim(brain, 'cartpole_simulator')
+    sim.enable_keys(['foo'], 'bar')
+    return sim
+
+
+@pytest.fixture
+def record_npz_sim(record_npz_config):
+    requests.patch("http://127.0.0.1:9000/cartpole")
+    brain = Brain(record_npz_config)
+    sim = CartSim(brain, 'cartpole_simulator')
+    sim.enable_keys(['foo'], 'bar')
+    return sim
+
+
 @pytest.fixture
 def record_csv_predict(record_csv_config_predict):
     requests.patch("http://127.0.0.1:9000/cartpole")
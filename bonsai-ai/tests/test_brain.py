@@ -34,6 +34,31 @@ def test_brain_update(blank_brain, v2_get):
     assert blank_brain.latest_version == 4
 
 
+def test_brain_cache_ttl(train_config, monkeypatch):
+    """ Tests that properties are served from a fresh snapshot """
+    train_config.brain_cache_ttl = 60
+    brain = Brain(train_config, 'cartpole')
+
+    calls = []
+
+    def _status(brain_name):
+        calls.append(brain_name)
+        return {'state': STOPPED}
+    monkeypatch.setattr(brain._api, 'get_brain_status', _status)
+
+    assert brain.state == IN_PROGRESS
+    assert brain.ready is True
+    assert calls == []
+
+    brain.refresh()
+    assert brain.state == STOPPED
+    assert calls == ['cartpole']
+
+    brain.cache_ttl = 0
+    assert brain.state == STOPPED
+    assert calls == ['cartpole', 'cartpole']
+
+
 def test_brain_predict_version():
     """ Tests brain version property """
     config = Config([__name__, '--predict=4', '--disable-telemetry'])
@@ -2,9 +2,14 @@
 Copyright (C) 2019 Microsoft
 Tests for BrainAPI
 """
+import asyncio
+import threading
+import time
+
 import pytest
 from ws_aiohttp import START_STOP_RESUME, METRICS, BRAIN_STATUS, BRAIN_INFO, \
      SIMS, CREATE_PUSH
+from bonsai_ai.brain_api import AsyncBrainAPI
 from bonsai_ai.exceptions import BonsaiServerError, UsageError
 
 def test_brain_info(brain_api):
@@ -13,6 +18,28 @@ def test_brain_info(brain_api):
 def test_status(brain_api):
     assert brain_api.get_brain_status('cartpole') == BRAIN_STATUS
 
+def test_status_not_modified(brain_api, monkeypatch):
+    status_codes = []
+    get = brain_api._session.get
+
+    def _get(*args, **kwargs):
+        response = get(*args, **kwargs)
+        status_codes.append(response.status_code)
+        return response
+    monkeypatch.setattr(brain_api._session, 'get', _get)
+
+    assert brain_api.get_brain_status('cartpole') == BRAIN_STATUS
+    assert brain_api.get_brain_status('cartpole') == BRAIN_STATUS
+    assert status_codes == [200, 304]
+
+def test_status_not_modified_copies(brain_api):
+    # changing a returned body does not change later 304 responses
+    brain_api.get_brain_status('cartpole').clear()
+    status = brain_api.get_brain_status('cartpole')
+    assert status == BRAIN_STATUS
+    status['changed'] = True
+    assert brain_api.get_brain_status('cartpole') == BRAIN_STATUS
+
 def test_start_training(brain_api):
     assert brain_api.start_training('cartpole') == START_STOP_RESUME
 
@@ -182,3 +209,91 @@ def test_delete_http_error(request_errors, brain_api):
         assert str(e).find('Span ID') >= 0
     else:
         assert False
+
+
+def _run_async(train_config, use_api):
+    loop = asyncio.new_event_loop()
+
+    async def run():
+        async with AsyncBrainAPI(train_config, loop=loop) as api:
+            return await use_api(api)
+    try:
+        return loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+def test_async_get_brain(train_config):
+    async def get_brain(api):
+        return await api.get_brain('cartpole')
+
+    assert _run_async(train_config, get_brain) == \
+        {'info': BRAIN_INFO, 'status': BRAIN_STATUS, 'sims': SIMS}
+
+def test_async_get_brains(train_config):
+    async def get_brains(api):
+        return await api.get_brains(
+            ['cartpole', 'missing'], return_exceptions=True)
+
+    brains = _run_async(train_config, get_brains)
+    assert brains['cartpole']['status'] == BRAIN_STATUS
+    assert isinstance(brains['missing'], BonsaiServerError)
+
+def test_async_status_not_modified(train_config):
+    async def get_status_twice(api):
+        first = await api.get_brain_status('cartpole')
+        # a 304 response returns the remembered body
+        url, (etag, body) = next(iter(api._etags.items()))
+        api._etags[url] = (etag, {'remembered': True})
+        return first, await api.get_brain_status('cartpole')
+
+    first, second = _run_async(train_config, get_status_twice)
+    assert first == BRAIN_STATUS
+    assert second == {'remembered': True}
+
+def test_async_status_not_modified_copies(train_config):
+    async def get_status(api):
+        (await api.get_brain_status('cartpole')).clear()
+        status = await api.get_brain_status('cartpole')
+        status['changed'] = True
+        return await api.get_brain_status('cartpole')
+
+    assert _run_async(train_config, get_status) == BRAIN_STATUS
+
+def test_async_token_refresh(train_config, monkeypatch):
+    threads = []
+
+    def refresh_access_token():
+        threads.append(threading.current_thread())
+        time.sleep(0.05)
+        train_config.accesskey = 'REFRESHED'
+    monkeypatch.setattr(
+        train_config, 'refresh_access_token', refresh_access_token)
+
+    async def expire_once(api):
+        try_http_request = api._try_http_request
+        expired = set()
+
+        async def _try_http_request(http_method, url, data=None):
+            if url not in expired:
+                expired.add(url)
+                raise BonsaiServerError('Token has expired')
+            return await try_http_request(http_method, url, data)
+        api._try_http_request = _try_http_request
+        brain = await api.get_brain('cartpole')
+        return brain, api._access_key
+
+    brain, access_key = _run_async(train_config, expire_once)
+    assert brain['status'] == BRAIN_STATUS
+    assert access_key == 'REFRESHED'
+    # the three concurrent requests shared one refresh, off the loop
+    assert len(threads) == 1
+    assert threads[0] is not threading.main_thread()
+
+def test_async_training_control(train_config):
+    async def start_stop(api):
+        return (await api.start_training('cartpole'),
+                await api.stop_training('cartpole'),
+                await api.iteration_metrics('cartpole', 'latest'))
+
+    assert _run_async(train_config, start_stop) == \
+        (START_STOP_RESUME, START_STOP_RESUME, METRICS)
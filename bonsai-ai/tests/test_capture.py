@@ -0,0 +1,177 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+import os
+
+import pytest
+
+from bonsai_ai import Brain, Config, Simulator
+from bonsai_ai import capture
+from bonsai_ai.capture import CaptureWriter, DISCONNECT, INBOUND, \
+    OUTBOUND, Frame, capture_path, read_capture, replay
+from bonsai_ai.testing import BrainServer, ScriptedPolicy
+
+
+def _state():
+    return {'position': 0.0, 'velocity': 0.0, 'angle': 0.0, 'rotation': 0.0}
+
+
+class CountingSim(Simulator):
+    def __init__(self, brain, name):
+        super(CountingSim, self).__init__(brain, name)
+        self.actions = []
+        self.episodes = 0
+
+    def episode_start(self, parameters):
+        self.episodes += 1
+        return _state()
+
+    def simulate(self, action):
+        self.actions.append(action)
+        return _state(), 1.0, False
+
+
+def _config(url, *args):
+    return Config(['test', '--accesskey=VALUE', '--username=alice',
+                   '--url={}'.format(url), '--brain=stand_in'] + list(args))
+
+
+def _run(sim, limit=10000):
+    for _ in range(limit):
+        if not sim.run():
+            return
+    pytest.fail('the simulator did not finish')
+
+
+def _capture(path):
+    """ Trains a CountingSim against a BrainServer, capturing to `path` """
+    policy = ScriptedPolicy([{'command': i} for i in range(3)])
+    with BrainServer(policy=policy, episode_length=4, episodes=2) as server:
+        config = _config(server.url, '--capture={}'.format(path))
+        assert config.capture_file == path
+        sim = CountingSim(Brain(config), 'cartpole_simulator')
+        _run(sim)
+        url = server.url
+    return sim, url
+
+
+def test_write_and_read(tmpdir):
+    path = str(tmpdir.join('session.cap'))
+    with CaptureWriter(path) as writer:
+        writer.write(OUTBOUND, b'hello', 1.5)
+        writer.write(INBOUND, b'\x00' * 300, 2.5)
+        writer.write(DISCONNECT, timestamp=3.5)
+    assert list(read_capture(path)) == [
+        Frame(OUTBOUND, 1.5, b'hello'),
+        Frame(INBOUND, 2.5, b'\x00' * 300),
+        Frame(DISCONNECT, 3.5, b''),
+    ]
+
+
+def test_read_bad_files(tmpdir):
+    path = str(tmpdir.join('other.cap'))
+    with open(path, 'wb') as f:
+        f.write(b'not a capture')
+    with pytest.raises(ValueError):
+        list(read_capture(path))
+
+    with CaptureWriter(path) as writer:
+        writer.write(INBOUND, b'hello')
+    with open(path, 'rb+') as f:
+        f.truncate(len(open(path, 'rb').read()) - 1)
+    with pytest.raises(ValueError):
+        list(read_capture(path))
+
+
+def test_reopen_after_close(tmpdir):
+    path = str(tmpdir.join('session.cap'))
+    writer = CaptureWriter(path)
+    writer.write(OUTBOUND, b'hello', 1.5)
+    writer.close()
+    writer.flush()
+    writer.write(INBOUND, b'again', 2.5)
+    writer.close()
+    assert list(read_capture(path)) == [
+        Frame(OUTBOUND, 1.5, b'hello'),
+        Frame(INBOUND, 2.5, b'again'),
+    ]
+
+
+def test_capture_path(monkeypatch, tmpdir):
+    monkeypatch.setattr(capture, '_used_paths', set())
+    template = str(tmpdir.join('session-{pid}-{sim}.cap'))
+    pid = str(os.getpid())
+    assert capture_path(template) == str(tmpdir.join(
+        'session-{}-0.cap'.format(pid)))
+    assert capture_path(template) == str(tmpdir.join(
+        'session-{}-1.cap'.format(pid)))
+
+    path = str(tmpdir.join('session.cap'))
+    assert capture_path(path) == path
+    assert capture_path(path) == str(tmpdir.join('session-1.cap'))
+    assert capture_path(path) == str(tmpdir.join('session-2.cap'))
+
+
+def test_capture_and_replay(tmpdir):
+    path = str(tmpdir.join('session.cap'))
+    captured, url = _capture(path)
+    frames = list(read_capture(path))
+    inbound = [f for f in frames if f.direction == INBOUND]
+    outbound = [f for f in frames if f.direction == OUTBOUND]
+    assert inbound and outbound
+    assert all(f.data for f in frames)
+    assert [f.timestamp for f in frames] == \
+        sorted(f.timestamp for f in frames)
+
+    # the server is gone; replay needs no connection
+    sim = CountingSim(Brain(_config(url)), 'cartpole_simulator')
+    connection = replay(sim, path)
+    assert sim.actions == captured.actions
+    assert len(sim.actions) == 8
+    assert sim.episodes == captured.episodes
+    assert connection.received == len(inbound)
+    assert connection.sent == len(outbound)
+    assert connection.connects == 1
+    assert sim.timings()['decode']['count'] == len(sim.actions)
+    assert connection.closed
+
+
+def test_replay_disconnect(tmpdir):
+    path = str(tmpdir.join('session.cap'))
+    _capture(path)
+    frames = list(read_capture(path))
+
+    # lose the connection after the first episode starts, and reconnect
+    spliced = str(tmpdir.join('spliced.cap'))
+    cut = [i for i, f in enumerate(frames) if f.direction == INBOUND][3]
+    with CaptureWriter(spliced) as writer:
+        for frame in frames[:cut + 1] + [Frame(DISCONNECT, 0.0, b'')] + \
+                frames:
+            writer.write(frame.direction, frame.data, frame.timestamp)
+
+    sim = CountingSim(Brain(_config('http://127.0.0.1:1')),
+                      'cartpole_simulator')
+    connection = replay(sim, spliced)
+    assert connection.disconnects == 1
+    assert connection.connects == 2
+    assert len(sim.actions) >= 8
+
+
+def test_simulators_share_capture_flag(tmpdir):
+    path = str(tmpdir.join('session.cap'))
+    policy = ScriptedPolicy([{'command': 0}])
+    with BrainServer(policy=policy, episode_length=4, episodes=1) as server:
+        config = _config(server.url, '--capture={}'.format(path))
+        first = CountingSim(Brain(config), 'cartpole_simulator')
+        second = CountingSim(Brain(config), 'cartpole_simulator')
+        _run(first)
+        first.close()
+        assert first._impl._capture._file.closed
+    assert second._impl._capture.path == str(tmpdir.join('session-1.cap'))
+    second.close()
+
+    # the second simulator did not truncate the capture of the first
+    sim = CountingSim(Brain(_config('http://127.0.0.1:1')),
+                      'cartpole_simulator')
+    replay(sim, path)
+    assert sim.actions == first.actions
+    assert list(read_capture(second._impl._capture.path)) == []
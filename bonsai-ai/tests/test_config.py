@@ -255,6 +255,46 @@ def test_invalid_retry_timeout_throws_error():
     assert False, "XFAIL"
 
 
+def test_argv_brain_cache_ttl():
+    assert Config().brain_cache_ttl == 0
+    config = Config([
+        __name__,
+        '--brain-cache-ttl', '2.5'
+    ])
+    assert config.brain_cache_ttl == 2.5
+
+    with pytest.raises(ValueError):
+        config.brain_cache_ttl = -1
+
+
+def test_argv_retry_backoff():
+    config = Config()
+    assert config.retry_backoff_base == 50
+    assert config.retry_backoff_max == 60
+    config = Config([
+        __name__,
+        '--retry-backoff-base', '10',
+        '--retry-backoff-max', '2.5'
+    ])
+    assert config.retry_backoff_base == 10
+    assert config.retry_backoff_max == 2.5
+
+    with pytest.raises(ValueError):
+        config.retry_backoff_max = -1
+
+
+def test_argv_reuse_transport():
+    assert Config().reuse_transport is False
+    config = Config([__name__, '--reuse-transport'])
+    assert config.reuse_transport is True
+
+
+def test_argv_pipeline():
+    assert Config().pipeline is False
+    config = Config([__name__, '--pipeline'])
+    assert config.pipeline is True
+
+
 def test_argv_accesskey():
     config = Config([
         __name__,
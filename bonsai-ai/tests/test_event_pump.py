@@ -2,6 +2,8 @@
 
 # pylint: disable=missing-docstring
 # pylint: disable=too-many-function-args
+import asyncio
+
 from bonsai_ai.event import SimulateEvent, EpisodeStartEvent, \
     EpisodeFinishEvent, FinishedEvent, UnknownEvent
 
@@ -21,6 +23,24 @@ def test_event_pump(train_sim):
     train_sim.close()
 
 
+def test_anext_event(train_sim):
+    expected = [UnknownEvent, UnknownEvent, EpisodeStartEvent,
+                SimulateEvent, SimulateEvent, SimulateEvent,
+                EpisodeFinishEvent]
+
+    async def pump():
+        events = [await train_sim.anext_event() for _ in expected]
+        await train_sim.aclose()
+        return events
+
+    loop = asyncio.new_event_loop()
+    events = loop.run_until_complete(pump())
+    loop.close()
+
+    for event, event_type in zip(events, expected):
+        assert isinstance(event, event_type)
+
+
 def test_server_error(flaky_train_sim):
     flaky_train_sim._impl._sim_connection._retry_timeout_seconds = 0
     assert isinstance(flaky_train_sim.get_next_event(), UnknownEvent)
@@ -0,0 +1,151 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+# pylint: disable=missing-docstring
+
+import gc
+import json
+import os
+import weakref
+from threading import Thread
+
+from google.protobuf.json_format import Parse
+
+from bonsai_ai.inkling_factory import InklingMessageFactory, shared_factory
+from bonsai_ai.proto.generator_simulator_api_pb2 import ServerToSimulator
+
+
+def _acknowledge_register_data():
+    p_file = "{}/proto_bin/cartpole_wire.json".format(
+        os.path.dirname(__file__))
+    with open(p_file, 'r') as f:
+        messages = json.loads(f.read())
+    msg = ServerToSimulator()
+    Parse(json.dumps(messages[1]), msg)
+    return msg.acknowledge_register_data
+
+
+def test_codec_is_compiled_once():
+    factory = InklingMessageFactory()
+    data = _acknowledge_register_data()
+
+    codec = factory.codec_for_proto(data.output_schema)
+    assert factory.codec_for_proto(data.output_schema) is codec
+
+    # an identical schema from a different message maps to the same codec
+    schema_copy = type(data.output_schema)()
+    schema_copy.CopyFrom(data.output_schema)
+    assert factory.codec_for_proto(schema_copy) is codec
+
+    assert factory.codec_for_proto(data.prediction_schema) is not codec
+    assert factory.codec_for_proto(None) is None
+
+
+def test_codec_fields():
+    factory = InklingMessageFactory()
+    data = _acknowledge_register_data()
+
+    codec = factory.codec_for_proto(data.output_schema)
+    assert codec.field_names == ('position', 'velocity', 'angle', 'rotation')
+    assert isinstance(codec.new_message(), codec.message_cls)
+
+
+def test_codec_round_trip():
+    factory = InklingMessageFactory()
+    data = _acknowledge_register_data()
+    codec = factory.codec_for_proto(data.prediction_schema)
+
+    message = codec.new_message()
+    message.command = 1
+    parsed = codec.parse(message.SerializeToString())
+    assert codec.to_dict(parsed) == {'command': 1}
+
+    # the legacy entry points go through the same codec
+    legacy = factory.message_for_dynamic_message(
+        message.SerializeToString(), data.prediction_schema)
+    assert isinstance(legacy, codec.message_cls)
+    assert legacy == parsed
+
+
+def test_codec_anonymous_schema():
+    factory = InklingMessageFactory()
+    data = _acknowledge_register_data()
+    schema = type(data.output_schema)()
+    schema.CopyFrom(data.output_schema)
+    schema.ClearField('name')
+
+    codec = factory.codec_for_proto(schema)
+    assert codec.field_names == ('position', 'velocity', 'angle', 'rotation')
+    # the caller's schema is left untouched
+    assert schema.name == ''
+    assert factory.codec_for_proto(schema) is codec
+
+
+def _numbered_schema(data, i):
+    schema = type(data.output_schema)()
+    schema.CopyFrom(data.output_schema)
+    schema.name = 'State{}'.format(i)
+    return schema
+
+
+def test_codec_cache_is_bounded():
+    factory = InklingMessageFactory(max_size=2)
+    data = _acknowledge_register_data()
+
+    first = factory.codec_for_proto(_numbered_schema(data, 0))
+    for i in range(1, 5):
+        factory.codec_for_proto(_numbered_schema(data, i))
+    assert len(factory) == 2
+    assert len(factory._codecs_by_id) == 2
+
+    # an evicted schema is compiled again, into a fresh descriptor pool
+    assert factory.codec_for_proto(_numbered_schema(data, 0)) is not first
+    assert factory._pool_schemas <= 2
+
+
+def test_evicted_codec_is_released():
+    factory = InklingMessageFactory(max_size=1)
+    data = _acknowledge_register_data()
+    codec = factory.codec_for_proto(_numbered_schema(data, 0))
+    # nothing outside the codec keeps its descriptor or converters
+    refs = [weakref.ref(codec.message_cls), weakref.ref(codec.converter),
+            weakref.ref(codec.decoder)]
+    del codec
+    for i in range(1, 3):
+        factory.codec_for_proto(_numbered_schema(data, i))
+    gc.collect()
+    assert [ref() for ref in refs] == [None, None, None]
+
+
+def test_codec_cache_no_pool_growth_for_equal_schemas():
+    factory = InklingMessageFactory()
+    data = _acknowledge_register_data()
+    codec = factory.codec_for_proto(data.output_schema)
+    for _ in range(10):
+        schema = type(data.output_schema)()
+        schema.CopyFrom(data.output_schema)
+        assert factory.codec_for_proto(schema) is codec
+    assert factory._pool_schemas == 1
+
+
+def test_codec_cache_thread_safe():
+    factory = InklingMessageFactory()
+    data = _acknowledge_register_data()
+    codecs = []
+
+    def compile_schemas():
+        for i in range(20):
+            codecs.append(factory.codec_for_proto(_numbered_schema(data, i)))
+
+    threads = [Thread(target=compile_schemas) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(factory) == 20
+    assert len(set(map(id, codecs))) == 20
+
+
+def test_shared_factory():
+    assert shared_factory() is shared_factory()
+    assert isinstance(shared_factory(), InklingMessageFactory)
@@ -38,3 +38,34 @@ def test_disable_domain(capsys, logging_config):
     out, err = capsys.readouterr()
     assert out == ''
     assert err == ''
+
+
+def test_is_enabled(logging_config):
+    log = Logger()
+    log._enable_all = False
+    assert log.is_enabled('foo')
+    assert not log.is_enabled('spam')
+    log.set_enable_all(True)
+    assert log.is_enabled('spam')
+    log.set_enable_all(False)
+
+
+def test_deferred_args(capsys, logging_config):
+    log = Logger()
+    log.foo('%s-%d', 'bar', 1)
+    log.foo(lambda: 'baz')
+    out, err = capsys.readouterr()
+    assert err.find('[foo] bar-1\n') >= 0
+    assert err.find('[foo] baz\n') >= 0
+
+
+def test_deferred_args_disabled(capsys, logging_config):
+    def _expensive():
+        raise AssertionError('message built for a disabled domain')
+
+    log = Logger()
+    log._enable_all = False
+    log.spam(_expensive)
+    log.spam('%s', 'eggs')
+    out, err = capsys.readouterr()
+    assert err == ''
@@ -4,6 +4,12 @@
 # pylint: disable=too-many-function-args
 
 import os
+from array import array
+
+import pytest
+
+from bonsai_ai import Luminance
+from bonsai_ai.common.state_to_proto import build_luminance_from_state
 from bonsai_ai.proto.generator_simulator_api_pb2 import ServerToSimulator
 from bonsai_ai.proto.generator_simulator_api_pb2 import SimulatorToServer
 
@@ -12,7 +18,12 @@ try:
 except ImportError:
     from conftest import isclose
 
-from struct import unpack
+from struct import pack, unpack
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 protocol_file = "{}/proto_bin/luminance_wire.json".format(
@@ -87,3 +98,68 @@ def test_luminance_pack(luminance_sim):
         assert isclose(p1, p2)
 
     luminance_sim.close()
+
+
+def _floats(luminance):
+    return list(unpack('<%sf' % (luminance.width * luminance.height),
+                       luminance.pixels))
+
+
+def test_luminance_buffers():
+    pixels = [0.0, 1.0, 2.0, 3.0, 4.0, 5.0]
+    expected = Luminance(3, 2, pixels).pixels
+    assert expected == pack('<6f', *pixels)
+
+    assert Luminance(3, 2, array('f', pixels)).pixels == expected
+    assert Luminance(3, 2, array('d', pixels)).pixels == expected
+    assert Luminance(3, 2, memoryview(array('i', range(6)))).pixels == \
+        expected
+    # the items of a bytearray are pixel values, only bytes are packed
+    assert Luminance(3, 2, bytearray(range(6))).pixels == expected
+    assert Luminance(3, 2, expected).pixels == expected
+
+    with pytest.raises(ValueError):
+        Luminance(2, 2, array('f', pixels))
+
+
+@pytest.mark.skipif(numpy is None, reason='numpy is not installed')
+def test_luminance_numpy():
+    pixels = numpy.arange(6, dtype='f8').reshape(2, 3)
+    luminance = Luminance.from_array(pixels)
+    assert (luminance.width, luminance.height) == (3, 2)
+    assert _floats(luminance) == [0.0, 1.0, 2.0, 3.0, 4.0, 5.0]
+    assert Luminance(3, 2, pixels.astype('f4')).pixels == luminance.pixels
+
+    with pytest.raises(ValueError):
+        Luminance(2, 2, pixels)
+
+
+@pytest.mark.skipif(numpy is None, reason='numpy is not installed')
+def test_luminance_from_rgb_array():
+    rgb = numpy.zeros((2, 3, 4), dtype=numpy.uint8)
+    rgb[0, :, 0] = 255
+    rgb[1, :, 1] = 255
+    luminance = Luminance.from_rgb_array(rgb)
+    assert (luminance.width, luminance.height) == (3, 2)
+    for value, weight in zip(_floats(luminance), [0.2126] * 3 + [0.7152] * 3):
+        assert isclose(value, weight, rel_tol=1e-6)
+
+    with pytest.raises(ValueError):
+        Luminance.from_rgb_array(rgb[:, :, 0])
+
+
+@pytest.mark.skipif(numpy is None, reason='numpy is not installed')
+def test_luminance_state_accepts_array(luminance_sim):
+    while luminance_sim._impl._prev_message_type != \
+          ServerToSimulator.ACKNOWLEDGE_REGISTER:
+        assert luminance_sim.run() is True
+
+    state = luminance_sim._impl._new_state_message()
+    pixels = numpy.array(luminance_sim.STATE_PIXELS, dtype='f4').reshape(
+        luminance_sim.height, luminance_sim.width)
+    build_luminance_from_state('pixels', state, pixels)
+
+    assert state.pixels.width == luminance_sim.width
+    assert state.pixels.height == luminance_sim.height
+    assert state.pixels.pixels == pixels.tobytes()
+    luminance_sim.close()
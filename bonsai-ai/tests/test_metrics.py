@@ -0,0 +1,195 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+import os
+import re
+
+import requests
+
+from bonsai_ai import Brain, Config, MetricsExporter
+from bonsai_ai import metrics
+from bonsai_ai.metrics import OPENMETRICS_CONTENT_TYPE, TEXT_CONTENT_TYPE
+from conftest import CartSim
+
+
+def _samples(text):
+    """ Parses exposition text into a {sample with labels: value} dict """
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+def _train(sim, steps=12):
+    for i in range(0, steps):
+        assert sim.run() is True
+
+
+def test_render_openmetrics(train_sim):
+    _train(train_sim)
+    exporter = MetricsExporter(labels={'rack': 'r7'})
+    exporter.add(train_sim)
+    text = exporter.render()
+    train_sim.close()
+
+    assert text.endswith('# EOF\n')
+    assert '# TYPE bonsai_sim_episodes counter' in text
+    assert '# UNIT bonsai_sim_step_phase_seconds seconds' in text
+    labels = '{{rack="r7",brain="cartpole",simulator="cartpole_simulator",' \
+        'sim_id="{}",mode="train"}}'.format(train_sim._impl._sim_id)
+    samples = _samples(text)
+    assert samples['bonsai_sim_episodes_total' + labels] == \
+        train_sim.episode_count
+    assert samples['bonsai_sim_iterations_total' + labels] == \
+        train_sim._iteration_total > 0
+    assert samples['bonsai_sim_reconnects_total' + labels] == 0
+    assert samples['bonsai_sim_sent_bytes_total' + labels] > 0
+    assert samples['bonsai_sim_received_bytes_total' + labels] > 0
+
+    phase = labels[:-1] + ',phase="simulate"'
+    count = samples['bonsai_sim_step_phase_seconds_count' + phase + '}']
+    assert count == train_sim.timings()['simulate']['count']
+    assert samples['bonsai_sim_step_phase_seconds_bucket' + phase +
+                   ',le="+Inf"}'] == count
+    assert samples['bonsai_sim_step_phase_seconds_bucket' + phase +
+                   ',le="1e-06"}'] <= count
+    assert samples['bonsai_sim_sent_message_size_bytes_count' + labels] == \
+        train_sim._impl._sent_sizes.count
+    # a step spans two messages sent
+    assert samples['bonsai_sim_step_seconds_count' + labels] == \
+        train_sim._impl._sent_sizes.count - 1 > 0
+
+
+def test_render_prometheus(train_sim):
+    _train(train_sim, 3)
+    exporter = MetricsExporter()
+    exporter.add(train_sim)
+    text = exporter.render(openmetrics=False)
+    train_sim.close()
+
+    assert '# EOF' not in text
+    assert '# UNIT' not in text
+    assert '# TYPE bonsai_sim_episodes_total counter' in text
+    assert '# TYPE bonsai_sim_episode_rate gauge' in text
+    assert re.search(r'^bonsai_sim_episode_rate\{.*\} \d', text, re.M)
+
+
+def test_render_without_simulators():
+    text = MetricsExporter().render()
+    assert '# TYPE bonsai_sim_iterations counter' in text
+    assert not _samples(text)
+
+
+def test_label_escaping():
+    assert metrics._labels([('a', 'x"y\\z\n')]) == '{a="x\\"y\\\\z\\n"}'
+
+
+def test_serve(train_sim):
+    _train(train_sim, 3)
+    exporter = MetricsExporter()
+    exporter.add(train_sim)
+    port = exporter.serve(0, '127.0.0.1')
+    try:
+        url = 'http://127.0.0.1:{}/metrics'.format(port)
+        response = requests.get(url, headers={
+            'Accept': 'application/openmetrics-text; version=1.0.0'})
+        assert response.headers['Content-Type'] == OPENMETRICS_CONTENT_TYPE
+        assert response.text.endswith('# EOF\n')
+        assert 'cartpole_simulator' in response.text
+
+        response = requests.get(url)
+        assert response.headers['Content-Type'] == TEXT_CONTENT_TYPE
+        assert '# EOF' not in response.text
+
+        assert requests.get('http://127.0.0.1:{}/other'.format(
+            port)).status_code == 404
+    finally:
+        exporter.stop()
+        train_sim.close()
+    assert exporter.port is None
+
+
+def test_textfile(train_sim, tmpdir):
+    _train(train_sim, 3)
+    exporter = MetricsExporter()
+    exporter.add(train_sim)
+    path = str(tmpdir.join('sim_{pid}.prom'))
+    written = path.replace('{pid}', str(os.getpid()))
+
+    exporter.write_textfile(path)
+    with open(written) as f:
+        assert 'bonsai_sim_iterations_total{' in f.read()
+    os.remove(written)
+
+    exporter.start_textfile(path, interval=60)
+    exporter.stop()
+    train_sim.close()
+    with open(written) as f:
+        assert 'bonsai_sim_iterations_total{' in f.read()
+    assert os.listdir(str(tmpdir)) == [os.path.basename(written)]
+
+
+def test_config_registers(monkeypatch, tmpdir):
+    monkeypatch.setattr(metrics, '_default_exporter', None)
+    path = str(tmpdir.join('sims.prom'))
+    config = Config([
+        __name__,
+        '--accesskey=VALUE',
+        '--username=alice',
+        '--url=http://127.0.0.1:9000',
+        '--brain=cartpole',
+        '--metrics-textfile={}'.format(path),
+    ])
+    assert config.metrics_textfile == path
+    assert config.metrics_port is None
+    requests.patch("http://127.0.0.1:9000/cartpole")
+    sim = CartSim(Brain(config), 'cartpole_simulator')
+    _train(sim, 3)
+
+    exporter = metrics.default_exporter()
+    assert exporter.textfile == path
+    exporter.stop()
+    sim.close()
+    with open(path) as f:
+        assert 'simulator="cartpole_simulator"' in f.read()
+
+    # simulators without metrics options are not published
+    config.metrics_textfile = None
+    other = CartSim(Brain(config), 'cartpole_simulator')
+    assert other not in exporter._sims
+    other.close()
+
+
+def test_config_port_in_use(monkeypatch):
+    monkeypatch.setattr(metrics, '_default_exporter', None)
+    monkeypatch.setattr(metrics, '_failed_port', None)
+    # another process serving on the port
+    other = MetricsExporter()
+    port = other.serve(0)
+    config = Config([
+        __name__,
+        '--accesskey=VALUE',
+        '--username=alice',
+        '--url=http://127.0.0.1:9000',
+        '--brain=cartpole',
+        '--metrics-port={}'.format(port),
+    ])
+    requests.patch("http://127.0.0.1:9000/cartpole")
+    try:
+        sim = CartSim(Brain(config), 'cartpole_simulator')
+        _train(sim, 3)
+        exporter = metrics.default_exporter()
+        assert exporter.port is None
+        assert metrics._failed_port == port
+        assert sim in exporter._sims
+        sim.close()
+
+        # a port of 0 serves each process on a free port
+        config.metrics_port = 0
+        sim = CartSim(Brain(config), 'cartpole_simulator')
+        assert exporter.port not in (None, 0, port)
+        sim.close()
+    finally:
+        metrics.default_exporter().stop()
+        other.stop()
@@ -1,7 +1,15 @@
+import asyncio
+import threading
 import time
 import os
 import json
 
+import requests
+
+from bonsai_ai import Brain, simulator_connection
+from bonsai_ai.simulator_connection import _heartbeat_for
+from conftest import CartSim
+
 def test_pong_sim(pong_sim):
     """
     Tests that pongs are received by our mock server.
@@ -12,6 +20,9 @@ def test_pong_sim(pong_sim):
     pong_sim._impl._sim_connection._PING_PONG_INTERVAL = 1.0
     counter = 0
     while pong_sim.run():
+        # every connection shares one heartbeat thread
+        assert [t.name for t in threading.enumerate()].count(
+            'bonsai-heartbeat') == 1
         time.sleep(.1)
         if counter == 20:
             break
@@ -24,3 +35,71 @@ def test_pong_sim(pong_sim):
         os.remove('pong.json')
     else:
         assert False
+
+
+class _FakeConnection(object):
+    def __init__(self, pongs):
+        self._pongs = pongs
+
+    def _pong(self):
+        self._pongs.append(self)
+
+
+def test_heartbeat_shared_by_loop(monkeypatch):
+    monkeypatch.setattr(simulator_connection, '_PING_PONG_INTERVAL', 0.01)
+    loop = asyncio.new_event_loop()
+    pongs = []
+    first, second = _FakeConnection(pongs), _FakeConnection(pongs)
+
+    heartbeat = _heartbeat_for(loop)
+    assert _heartbeat_for(loop) is heartbeat
+    heartbeat.add(first)
+    heartbeat.add(second)
+    assert pongs == [first, second]
+
+    loop.run_until_complete(asyncio.sleep(0.1, loop=loop))
+    assert pongs.count(first) > 2
+    assert pongs.count(first) == pongs.count(second)
+
+    heartbeat.discard(first)
+    heartbeat.discard(second)
+    assert heartbeat._handle is None
+    loop.close()
+
+
+class SlowSim(CartSim):
+    """ Records the pongs sent while `simulate` holds the loop's thread """
+    def __init__(self, brain, name):
+        super(SlowSim, self).__init__(brain, name)
+        self.pongs = []
+        self.pongs_during_steps = 0
+
+    def simulate(self, action):
+        before = len(self.pongs)
+        time.sleep(0.5)
+        self.pongs_during_steps += len(self.pongs) - before
+        return super(SlowSim, self).simulate(action)
+
+
+def test_sync_sim_pongs_during_long_steps(train_config, monkeypatch):
+    monkeypatch.setattr(simulator_connection, '_PING_PONG_INTERVAL', 0.1)
+    requests.patch("http://127.0.0.1:9000/cartpole")
+    sim = SlowSim(Brain(train_config), 'cartpole_simulator')
+    connection = sim._impl._sim_connection
+    pong = connection._pong
+
+    def _pong():
+        sim.pongs.append(threading.current_thread())
+        pong()
+    connection._pong = _pong
+
+    steps = 0
+    while sim.run() and steps < 6:
+        steps += 1
+    clients = connection.client
+    sim.close()
+
+    # the loop is idle during a step, so the heartbeat thread pongs
+    assert sim.pongs_during_steps > 0
+    assert any(t.name == 'bonsai-heartbeat' for t in sim.pongs)
+    assert clients is not None
@@ -0,0 +1,124 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+# pylint: disable=missing-docstring
+
+import pytest
+
+from google.protobuf.descriptor_pb2 import DescriptorProto, \
+    FieldDescriptorProto
+
+from bonsai_ai import PredictionCache
+from bonsai_ai.inkling_factory import InklingMessageFactory
+
+
+def _fields():
+    schema = DescriptorProto()
+    schema.name = 'CacheState'
+    for number, (name, field_type) in enumerate([
+            ('angle', FieldDescriptorProto.TYPE_DOUBLE),
+            ('velocity', FieldDescriptorProto.TYPE_FLOAT),
+            ('count', FieldDescriptorProto.TYPE_INT64)]):
+        field = schema.field.add()
+        field.name = name
+        field.number = number + 1
+        field.type = field_type
+        field.label = FieldDescriptorProto.LABEL_OPTIONAL
+    return InklingMessageFactory().codec_for_proto(schema).fields
+
+
+def _cache(**kwargs):
+    cache = PredictionCache(**kwargs)
+    cache.compile(_fields())
+    return cache
+
+
+def _state(angle=0.0, velocity=0.0, count=0):
+    return {'angle': angle, 'velocity': velocity, 'count': count}
+
+
+def test_cache_exact():
+    cache = _cache()
+    key = cache.key(_state(0.5))
+    assert cache.get(key) is None
+    cache.put(key, {'command': 1})
+    assert cache.get(cache.key(_state(0.5))) == {'command': 1}
+    assert cache.get(cache.key(_state(0.5000001))) is None
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 2
+
+
+def test_cache_returns_copies():
+    cache = _cache()
+    key = cache.key(_state())
+    action = {'command': 1}
+    cache.put(key, action)
+    action['command'] = 2
+    cached = cache.get(key)
+    cached['command'] = 3
+    assert cache.get(key) == {'command': 1}
+
+
+def test_cache_resolution():
+    cache = _cache(resolution=0.1)
+    cache.put(cache.key(_state(0.51, 1.0)), {'command': 1})
+    # float fields are bucketed, other fields compared exactly
+    assert cache.get(cache.key(_state(0.52, 0.99))) == {'command': 1}
+    assert cache.get(cache.key(_state(0.52, 0.99, count=1))) is None
+
+    cache = _cache(resolution={'angle': 1.0, 'count': lambda c: c // 10})
+    cache.put(cache.key(_state(2.1, 0.5, 11)), {'command': 1})
+    assert cache.get(cache.key(_state(1.9, 0.5, 19))) == {'command': 1}
+    # velocity is not in the dict, so it is compared exactly
+    assert cache.get(cache.key(_state(1.9, 0.6, 19))) is None
+
+
+def test_cache_lru_eviction():
+    cache = _cache(maxsize=2)
+    for i in range(3):
+        cache.put(cache.key(_state(count=i)), {'command': i})
+        if i == 1:
+            # touch the first entry, so that the second is evicted
+            assert cache.get(cache.key(_state(count=0))) is not None
+    assert len(cache) == 2
+    assert cache.get(cache.key(_state(count=1))) is None
+    assert cache.get(cache.key(_state(count=0))) == {'command': 0}
+    assert cache.stats()['evictions'] == 1
+
+
+def test_cache_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+    cache = _cache(ttl=5)
+    key = cache.key(_state())
+    cache.put(key, {'command': 1})
+    now[0] += 4
+    assert cache.get(key) == {'command': 1}
+    now[0] += 1
+    assert cache.get(key) is None
+    assert cache.stats()['expirations'] == 1
+    assert len(cache) == 0
+
+
+def test_cache_uncacheable_state():
+    cache = _cache()
+    key = cache.key({'angle': 0.0})
+    assert key is None
+    cache.put(key, {'command': 1})
+    assert len(cache) == 0
+    assert cache.get(key) is None
+
+
+def test_cache_schema_change():
+    cache = _cache()
+    cache.put(cache.key(_state()), {'command': 1})
+    cache.compile(_fields())
+    assert len(cache) == 1
+    cache.compile(_fields()[:2])
+    assert len(cache) == 0
+
+
+def test_cache_arguments():
+    with pytest.raises(ValueError):
+        PredictionCache(maxsize=0)
+    with pytest.raises(ValueError):
+        PredictionCache(ttl=0)
@@ -3,8 +3,35 @@
 # pylint: disable=missing-docstring
 # pylint: disable=too-many-function-args
 
-from bonsai_ai.proto.generator_simulator_api_pb2 import ServerToSimulator
+import asyncio
+
+from bonsai_ai.proto.generator_simulator_api_pb2 import ServerToSimulator, \
+    SimulatorToServer
 from bonsai_ai.common.state_to_proto import SimStateError
+from bonsai_ai import Predictor, PredictionCache
+from bonsai_ai.simulator_ws import Simulator_WS
+
+
+def _state(position=0):
+    return {'position': position,
+            'velocity': 0,
+            'angle':    0,
+            'rotation': 0}
+
+
+def _count_sends(monkeypatch):
+    """ Records the type of every message the predictor sends """
+    sent = []
+    ws_send = Simulator_WS._ws_send
+
+    async def _counting_send(impl, build=None):
+        def _build(to_server):
+            (build or impl._on_send)(to_server)
+            sent.append((to_server.message_type, len(to_server.state_data)))
+        return await ws_send(impl, _build)
+
+    monkeypatch.setattr(Simulator_WS, '_ws_send', _counting_send)
+    return sent
 
 
 def test_predictor(predictor, bonsai_ws):
@@ -23,6 +50,85 @@ def test_predictor(predictor, bonsai_ws):
             ServerToSimulator.PREDICTION
 
 
+def test_predictor_async(predictor, bonsai_ws):
+    state = {'position': 0,
+             'velocity': 0,
+             'angle':    0,
+             'rotation': 0}
+
+    async def predict():
+        async with predictor:
+            return await predictor.aget_action(state)
+
+    loop = asyncio.new_event_loop()
+    action = loop.run_until_complete(predict())
+    loop.close()
+
+    assert action is not None
+    assert predictor._impl._prev_message_type == \
+        ServerToSimulator.PREDICTION
+    assert predictor._impl._sim_connection.client is None
+
+
+def test_predictor_get_actions(predictor, bonsai_ws, monkeypatch):
+    sent = _count_sends(monkeypatch)
+    with predictor:
+        actions = predictor.get_actions([_state(i) for i in range(5)])
+        assert actions == [
+            {'command': 0}, {'command': 0}, {'command': 1},
+            {'command': 0}, {'command': 0}]
+
+        # every batch after registration is a single round trip
+        assert predictor.get_actions([_state(), _state()]) == [
+            {'command': 0}, {'command': 0}]
+        assert predictor.get_action(_state()) == {'command': 0}
+
+    assert sent == [(SimulatorToServer.REGISTER, 0),
+                    (SimulatorToServer.STATE, 5),
+                    (SimulatorToServer.STATE, 2),
+                    (SimulatorToServer.STATE, 1)]
+    assert predictor.iteration_count == 8
+
+
+def test_predictor_aget_actions(predictor, bonsai_ws):
+    async def predict():
+        async with predictor:
+            return await predictor.aget_actions([_state(), _state(1)])
+
+    loop = asyncio.new_event_loop()
+    actions = loop.run_until_complete(predict())
+    loop.close()
+
+    assert actions == [{'command': 0}, {'command': 0}]
+
+
+def test_predictor_record_actions(predictor, bonsai_ws):
+    predictor.action_format = 'record'
+    with predictor:
+        actions = predictor.get_actions([_state(), _state()])
+    assert [a.command for a in actions] == [0, 0]
+
+
+def test_predictor_cache(predictor, bonsai_ws, monkeypatch):
+    sent = _count_sends(monkeypatch)
+    predictor = Predictor(predictor.brain, predictor.name,
+                          cache=PredictionCache(resolution=0.5))
+    with predictor:
+        first = predictor.get_actions([_state(0), _state(1)])
+        # nearby states are served from the cache without a round trip
+        assert predictor.get_actions([_state(0.1), _state(0.9)]) == first
+        assert predictor.get_action(_state(1.1)) == first[1]
+        # only the misses of a batch are sent
+        predictor.get_actions([_state(0), _state(5), _state(6)])
+
+    assert sent == [(SimulatorToServer.REGISTER, 0),
+                    (SimulatorToServer.STATE, 2),
+                    (SimulatorToServer.STATE, 2)]
+    stats = predictor.cache.stats()
+    assert (stats['hits'], stats['misses']) == (4, 4)
+    assert stats['size'] == 4
+
+
 def test_predictor_null_state(predictor, bonsai_ws):
     state = {'position': 0,
              'velocity': 0,
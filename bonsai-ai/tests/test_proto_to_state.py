@@ -0,0 +1,109 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+# pylint: disable=missing-docstring
+
+import pytest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from google.protobuf.descriptor_pb2 import DescriptorProto, \
+    FieldDescriptorProto
+
+from bonsai_ai.common.proto_to_state import dict_for_message
+from bonsai_ai.exceptions import UsageError
+from bonsai_ai.inkling_factory import InklingMessageFactory
+
+
+def _schema():
+    schema = DescriptorProto()
+    schema.name = 'Action'
+    for number, (name, field_type) in enumerate([
+            ('delta', FieldDescriptorProto.TYPE_DOUBLE),
+            ('count', FieldDescriptorProto.TYPE_INT64),
+            ('active', FieldDescriptorProto.TYPE_BOOL)]):
+        field = schema.field.add()
+        field.name = name
+        field.number = number + 1
+        field.type = field_type
+        field.label = FieldDescriptorProto.LABEL_OPTIONAL
+    return schema
+
+
+def _codec():
+    return InklingMessageFactory().codec_for_proto(_schema())
+
+
+def _message(codec):
+    return codec.from_dict({'delta': 0.5, 'count': 3, 'active': True})
+
+
+def test_decode_dict():
+    codec = _codec()
+    message = _message(codec)
+    expected = {'delta': 0.5, 'count': 3, 'active': True}
+    assert codec.decoder.decode(message) == expected
+    assert dict_for_message(message) == expected
+    assert dict_for_message(None) == {}
+    assert codec.decode(message.SerializeToString()) == expected
+
+
+def test_decode_record():
+    codec = _codec()
+    record = codec.decoder.decode(_message(codec), 'record')
+    assert isinstance(record, codec.decoder.record_type)
+    assert record == (0.5, 3, True)
+    assert record.delta == 0.5
+    assert record['count'] == 3
+    assert record[2] is True
+    assert record.keys() == ('delta', 'count', 'active')
+    assert dict(zip(record.keys(), record)) == dict_for_message(
+        _message(codec))
+    with pytest.raises(KeyError):
+        record['missing']
+
+
+@pytest.mark.skipif(numpy is None, reason='requires numpy')
+def test_decode_numpy():
+    codec = _codec()
+    row = codec.decoder.decode(_message(codec), 'numpy')
+    assert row.dtype.names == ('delta', 'count', 'active')
+    assert row['delta'] == 0.5
+    assert row['count'] == 3
+    assert row.dtype['count'] == numpy.dtype('i8')
+    assert row['active']
+
+
+def test_decode_unknown_format():
+    codec = _codec()
+    with pytest.raises(UsageError):
+        codec.decoder.decode(_message(codec), 'xml')
+
+
+def test_decoder_is_built_once():
+    factory = InklingMessageFactory()
+    codec = factory.codec_for_proto(_schema())
+    assert factory.codec_for_proto(_schema()).decoder is codec.decoder
+
+
+def test_decode_single_and_empty_schema():
+    factory = InklingMessageFactory()
+    schema = DescriptorProto()
+    schema.name = 'Empty'
+    empty = factory.codec_for_proto(schema)
+    assert empty.decoder.to_dict(empty.new_message()) == {}
+
+    # schemas must not change once compiled, so use a new one
+    schema = DescriptorProto()
+    schema.name = 'Command'
+    field = schema.field.add()
+    field.name = 'command'
+    field.number = 1
+    field.type = FieldDescriptorProto.TYPE_INT64
+    field.label = FieldDescriptorProto.LABEL_OPTIONAL
+    single = factory.codec_for_proto(schema)
+    message = single.from_dict({'command': 2})
+    assert single.decoder.to_dict(message) == {'command': 2}
+    assert single.decoder.to_record(message).command == 2
@@ -1,12 +1,49 @@
+import asyncio
 import time
+
+import pytest
+
+from bonsai_ai import simulator_connection
 from bonsai_ai.exceptions import RetryTimeoutError
 from bonsai_ai.proto.generator_simulator_api_pb2 import ServerToSimulator
 
 
+async def _patched_sleep(backoff, loop=None):
+    return backoff
+
+
 def test_reconnect(flaky_train_sim, monkeypatch):
-    def _patched_sleep(backoff):
-        return backoff
-    monkeypatch.setattr(time, 'sleep', _patched_sleep)
+    monkeypatch.setattr(simulator_connection, 'sleep', _patched_sleep)
+
+    counter = 0
+    while flaky_train_sim.run():
+        if counter == 100:
+            break
+        counter += 1
+
+    flaky_train_sim.close()
+
+
+def test_reconnect_reuses_transport(flaky_train_sim, monkeypatch):
+    monkeypatch.setattr(simulator_connection, 'sleep', _patched_sleep)
+    connection = flaky_train_sim._impl._sim_connection
+    connection._reuse_transport = True
+
+    sessions = []
+    new_session = connection._new_session
+
+    def _new_session():
+        sessions.append(new_session())
+        return sessions[-1]
+    monkeypatch.setattr(connection, '_new_session', _new_session)
+
+    reconnects = []
+    handle_reconnect = connection._handle_reconnect
+
+    def _handle_reconnect():
+        reconnects.append(connection._session)
+        return handle_reconnect()
+    monkeypatch.setattr(connection, '_handle_reconnect', _handle_reconnect)
 
     counter = 0
     while flaky_train_sim.run():
@@ -14,7 +51,12 @@ def test_reconnect(flaky_train_sim, monkeypatch):
             break
         counter += 1
 
+    assert reconnects
+    assert len(sessions) == 1
+    assert all(session is sessions[0] for session in reconnects)
+
     flaky_train_sim.close()
+    assert connection._session is None
 
 
 def test_reconnect_timeout(flaky_train_sim):
@@ -105,13 +147,48 @@ def test_sim_connection_constructor(train_sim):
     assert sim_connection._connection_attempts == 0
     assert sim_connection._retry_timeout_seconds == 300
     assert sim_connection._maximum_backoff_seconds == 60
+    assert sim_connection._base_multiplier_milliseconds == 50
     assert sim_connection._timeout is None
 
 
+def test_backoff_does_not_block_loop(train_sim, monkeypatch):
+    monkeypatch.setattr(simulator_connection, 'uniform',
+                        lambda low, high: high)
+    connection = train_sim._impl._sim_connection
+    connection._connection_attempts = 20
+    connection._base_multiplier_milliseconds = 200
+    connection._maximum_backoff_seconds = 0.2
+    loop = train_sim._ioloop
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(loop.time())
+            await asyncio.sleep(0.01, loop=loop)
+
+    async def backoff():
+        ticker = asyncio.ensure_future(tick(), loop=loop)
+        await connection._backoff()
+        ticker.cancel()
+
+    # the loop keeps running other tasks during the 0.2s backoff
+    loop.run_until_complete(backoff())
+    assert len(ticks) >= 5
+
+    # cancelling the connect cancels the backoff
+    connection._maximum_backoff_seconds = 60
+    connection._base_multiplier_milliseconds = 60000
+    task = asyncio.ensure_future(connection._backoff(), loop=loop)
+    loop.call_later(0.05, task.cancel)
+    start = time.time()
+    with pytest.raises(asyncio.CancelledError):
+        loop.run_until_complete(task)
+    assert time.time() - start < 5
+    train_sim.close()
+
+
 def test_reconnect_reset_rate_counter(flaky_train_sim, monkeypatch):
-    def _patched_sleep(backoff):
-        return backoff
-    monkeypatch.setattr(time, 'sleep', _patched_sleep)
+    monkeypatch.setattr(simulator_connection, 'sleep', _patched_sleep)
 
     while flaky_train_sim.run():
         if flaky_train_sim._impl._prev_message_type == \
@@ -129,9 +206,7 @@ def test_reconnect_reset_rate_counter(flaky_train_sim, monkeypatch):
 
 
 def test_eofstream_reconnect(eofstream_sim, monkeypatch):
-    def _patched_sleep(backoff):
-        return backoff
-    monkeypatch.setattr(time, 'sleep', _patched_sleep)
+    monkeypatch.setattr(simulator_connection, 'sleep', _patched_sleep)
 
     counter = 0
     while eofstream_sim.run():
@@ -143,9 +218,7 @@ def test_eofstream_reconnect(eofstream_sim, monkeypatch):
 
 
 def test_ws_error_msg_reconnect(error_msg_sim, monkeypatch):
-    def _patched_sleep(backoff):
-        return backoff
-    monkeypatch.setattr(time, 'sleep', _patched_sleep)
+    monkeypatch.setattr(simulator_connection, 'sleep', _patched_sleep)
 
     counter = 0
     while error_msg_sim.run():
@@ -2,14 +2,25 @@
 
 # pylint: disable=missing-docstring
 # pylint: disable=too-many-function-args
+import asyncio
+import json
 import os
 import pytest
+import requests
 import sys
 import time
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from aiohttp.client_exceptions import ClientProxyConnectionError
 from bonsai_ai.proto.generator_simulator_api_pb2 import ServerToSimulator
 from bonsai_ai import Config, Brain, Simulator
+from bonsai_ai.inkling_factory import InklingMessageCodec
+from bonsai_ai.logger import Logger
+from bonsai_ai.simulator_ws import Simulator_WS
 from conftest import CartSim
 from typing import Any, cast
 
@@ -43,6 +54,214 @@ def test_train(train_sim):
     train_sim.close()
 
 
+class AsyncCartSim(CartSim):
+    async def episode_start(self, parameters):
+        await asyncio.sleep(0)
+        return CartSim.episode_start(self, parameters)
+
+    async def simulate(self, action):
+        await asyncio.sleep(0)
+        return CartSim.simulate(self, action)
+
+    async def episode_finish(self):
+        await asyncio.sleep(0)
+
+
+def test_arun(train_config):
+    requests.patch("http://127.0.0.1:9000/cartpole")
+    sim = AsyncCartSim(Brain(train_config), 'cartpole_simulator')
+    loop = asyncio.new_event_loop()
+
+    async def drive():
+        message_types = []
+        for i in range(0, 10):
+            assert await sim.arun() is True
+            message_types.append(sim._impl._prev_message_type)
+        await sim.aclose()
+        return message_types
+
+    message_types = loop.run_until_complete(drive())
+    loop.close()
+
+    assert sim._ioloop is loop
+    assert message_types[:3] == [ServerToSimulator.ACKNOWLEDGE_REGISTER,
+                                 ServerToSimulator.SET_PROPERTIES,
+                                 ServerToSimulator.START]
+    assert ServerToSimulator.PREDICTION in message_types
+    assert sim.episode_count > 0
+    assert sim.episode_reward == 1.0
+
+
+class RecordingCartSim(CartSim):
+    def __init__(self, brain, name):
+        super(RecordingCartSim, self).__init__(brain, name)
+        self.calls = []
+
+    def episode_start(self, parameters):
+        self.calls.append('start')
+        return CartSim.episode_start(self, parameters)
+
+    def simulate(self, action):
+        self.calls.append(action)
+        return CartSim.simulate(self, action)
+
+    def episode_finish(self):
+        self.calls.append('finish')
+
+
+def test_pipelined_train(train_config):
+    def train(config):
+        requests.patch("http://127.0.0.1:9000/cartpole")
+        sim = RecordingCartSim(Brain(config), 'cartpole_simulator')
+        pending = 0
+        for i in range(0, 12):
+            assert sim.run() is True
+            if sim._impl._pending_recv is not None:
+                pending += 1
+        sim.close()
+        return pending, sim.calls
+
+    pending, calls = train(train_config)
+    assert pending == 0
+    assert {'command': 1} in calls
+
+    # the same callbacks, but each state is sent before run() returns
+    train_config.pipeline = True
+    pipelined, pipelined_calls = train(train_config)
+    assert pipelined > 0
+    assert pipelined_calls == calls
+
+
+def test_prediction_decoded_once(train_config, monkeypatch):
+    parses = []
+    predictions = []
+    parse = InklingMessageCodec.parse
+    on_prediction = Simulator_WS._on_prediction
+
+    def _counting_parse(codec, data):
+        parses.append(codec)
+        return parse(codec, data)
+
+    def _counting_on_prediction(impl, from_server):
+        predictions.extend(from_server.prediction_data)
+        return on_prediction(impl, from_server)
+
+    monkeypatch.setattr(InklingMessageCodec, 'parse', _counting_parse)
+    monkeypatch.setattr(
+        Simulator_WS, '_on_prediction', _counting_on_prediction)
+    Logger().set_enabled('action')
+    try:
+        requests.patch("http://127.0.0.1:9000/cartpole")
+        sim = RecordingCartSim(Brain(train_config), 'cartpole_simulator')
+        for i in range(0, 12):
+            assert sim.run() is True
+        sim.close()
+    finally:
+        Logger().set_enabled('action', False)
+
+    # one parse per prediction, shared by the event, the log and the
+    # predictor cache
+    prediction_parses = [
+        c for c in parses if c is sim._impl._prediction_codec]
+    assert {'command': 1} in sim.calls
+    assert len(prediction_parses) == len(predictions)
+
+
+class RecordCartSim(RecordingCartSim):
+    action_format = 'record'
+
+
+def test_action_format_record(record_json_config, temp_directory):
+    requests.patch("http://127.0.0.1:9000/cartpole")
+    sim = RecordCartSim(Brain(record_json_config), 'cartpole_simulator')
+    for i in range(0, 12):
+        assert sim.run() is True
+    sim.writer.close()
+    sim.close()
+
+    actions = [c for c in sim.calls if not isinstance(c, str)]
+    assert actions
+    assert all(isinstance(a, tuple) for a in actions)
+    assert (1,) in actions
+    assert actions[-1]['command'] == actions[-1].command
+
+    with open(sim.brain.config.record_file, 'r') as f:
+        records = [json.loads(line) for line in f.readlines()]
+    os.remove(sim.brain.config.record_file)
+    assert 1 in [r['action.command'] for r in records]
+
+
+@pytest.mark.skipif(numpy is None, reason='requires numpy')
+def test_action_format_numpy(record_json_config, temp_directory):
+    class NumpyCartSim(RecordingCartSim):
+        action_format = 'numpy'
+
+    requests.patch("http://127.0.0.1:9000/cartpole")
+    sim = NumpyCartSim(Brain(record_json_config), 'cartpole_simulator')
+    for i in range(0, 12):
+        assert sim.run() is True
+    sim.writer.close()
+    sim.close()
+
+    actions = [c for c in sim.calls if not isinstance(c, str)]
+    assert actions
+    assert actions[-1].dtype.names == ('command',)
+
+    with open(sim.brain.config.record_file, 'r') as f:
+        records = [json.loads(line) for line in f.readlines()]
+    os.remove(sim.brain.config.record_file)
+    assert 1 in [r['action.command'] for r in records]
+
+
+class SlowCartSim(RecordingCartSim):
+    def simulate(self, action):
+        time.sleep(0.01)
+        return RecordingCartSim.simulate(self, action)
+
+
+def test_timings(record_json_config, temp_directory):
+    requests.patch("http://127.0.0.1:9000/cartpole")
+    sim = SlowCartSim(Brain(record_json_config), 'cartpole_simulator')
+    for i in range(0, 12):
+        assert sim.run() is True
+    sim.writer.close()
+    sim.close()
+    os.remove(sim.brain.config.record_file)
+
+    simulated = len([c for c in sim.calls if not isinstance(c, str)])
+    timings = sim.timings(reset=True)
+    assert list(timings) == ['network', 'parse', 'decode', 'simulate',
+                             'encode', 'record', 'send']
+    for phase, timing in timings.items():
+        assert timing['count'] > 0, phase
+        assert timing['buckets'][-1] == (float('inf'), timing['count'])
+        assert timing['p50'] <= timing['p99'] <= timing['max']
+    assert timings['simulate']['count'] == simulated
+    assert timings['simulate']['total'] >= 0.01 * simulated
+    assert timings['simulate']['p50'] >= 0.01
+    # recording is not counted as simulating
+    assert timings['record']['total'] < timings['simulate']['total']
+
+    assert sim.timings()['simulate']['count'] == 0
+
+
+def test_timings_summary(train_config, capsys):
+    requests.patch("http://127.0.0.1:9000/cartpole")
+    sim = CartSim(Brain(train_config), 'cartpole_simulator')
+    sim._timings.summary_interval = 0
+    log = Logger()
+    log.set_enabled('perf')
+    try:
+        for i in range(0, 6):
+            sim.run()
+    finally:
+        log.set_enabled('perf', False)
+        sim.close()
+    err = capsys.readouterr().err
+    assert '[perf] network' in err
+    assert 'simulate' in err
+
+
 def test_rate_counter(train_sim):
     assert train_sim._reset_rate_counter is True
     assert train_sim.episode_rate == 0
@@ -0,0 +1,137 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+# pylint: disable=missing-docstring
+
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+import requests
+
+from bonsai_ai import Brain, SimulatorHost
+from bonsai_ai import simulator_connection
+from bonsai_ai.exceptions import UsageError
+from bonsai_ai.proto.generator_simulator_api_pb2 import ServerToSimulator
+from conftest import CartSim
+
+
+class HostedSim(CartSim):
+    def __init__(self, brain, name, host, steps):
+        super(HostedSim, self).__init__(brain, name)
+        self.host = host
+        self.steps = steps
+        self.threads = set()
+        self.clients = set()
+        self.step_count = 0
+        self.step_delay = 0
+
+    def simulate(self, action):
+        self.threads.add(threading.current_thread().name)
+        self.clients.add(id(self._impl._sim_connection.client))
+        time.sleep(self.step_delay)
+        self.step_count += 1
+        if self.step_count >= self.steps:
+            self.host.stop()
+        return super(HostedSim, self).simulate(action)
+
+
+class InterruptingSim(HostedSim):
+    """ Raises KeyboardInterrupt on the event loop instead of stopping """
+    def simulate(self, action):
+        if self.step_count + 1 == self.steps:
+            self.host._ioloop.call_soon_threadsafe(self._interrupt)
+        self.step_count += 1
+        return CartSim.simulate(self, action)
+
+    def _interrupt(self):
+        raise KeyboardInterrupt()
+
+
+def test_host_runs_many_sims(train_config):
+    requests.patch("http://127.0.0.1:9000/cartpole")
+    brain = Brain(train_config)
+    host = SimulatorHost()
+    sims = [host.add(HostedSim(brain, 'cartpole_simulator', host, 10))
+            for _ in range(4)]
+
+    host.run()
+
+    for sim in sims:
+        assert sim._ioloop is host._ioloop
+        assert sim.sim_id == '270022238'
+        assert sim.episode_count > 0
+        assert sim._impl._sim_connection.client is None
+        # callbacks ran off the event loop thread
+        assert threading.current_thread().name not in sim.threads
+
+
+def test_host_rejects_connected_sim(train_sim):
+    assert train_sim.run() is True
+    assert train_sim._impl._prev_message_type == \
+        ServerToSimulator.ACKNOWLEDGE_REGISTER
+    host = SimulatorHost()
+    try:
+        host.add(train_sim)
+    except Exception as e:
+        assert 'connected' in str(e)
+    else:
+        assert False, "XFAIL"
+    finally:
+        train_sim.close()
+
+
+def test_host_survives_long_steps(train_config, monkeypatch):
+    # a step that outlasts the heartbeat and its pong timeout
+    monkeypatch.setattr(simulator_connection, '_PING_PONG_INTERVAL', 0.2)
+    requests.patch("http://127.0.0.1:9000/cartpole")
+    brain = Brain(train_config)
+    host = SimulatorHost()
+    sims = [host.add(HostedSim(brain, 'cartpole_simulator', host, 3))
+            for _ in range(2)]
+    for sim in sims:
+        sim.step_delay = 0.5
+
+    host.run()
+
+    for sim in sims:
+        assert sim.step_count >= 3
+        # every step ran over the same, never reconnected, websocket
+        assert len(sim.clients) == 1
+    host.close()
+
+
+def test_host_releases_sims(train_config):
+    requests.patch("http://127.0.0.1:9000/cartpole")
+    brain = Brain(train_config)
+    host = SimulatorHost()
+    sim = host.add(HostedSim(brain, 'cartpole_simulator', host, 2))
+
+    host.run()
+
+    assert sim._impl._executor is None
+    assert sim.run() is True
+    sim.close()
+
+    host.close()
+    assert host._ioloop.is_closed()
+
+
+def test_host_rejects_process_pool():
+    with pytest.raises(UsageError):
+        SimulatorHost(executor=ProcessPoolExecutor(max_workers=1))
+
+
+def test_host_interrupt_closes_sims(train_config):
+    requests.patch("http://127.0.0.1:9000/cartpole")
+    brain = Brain(train_config)
+    host = SimulatorHost()
+    sims = [host.add(InterruptingSim(brain, 'cartpole_simulator', host, 5)),
+            host.add(HostedSim(brain, 'cartpole_simulator', host, 1000))]
+
+    host.run()
+
+    for sim in sims:
+        assert 0 < sim.step_count < 1000
+        assert sim._impl._sim_connection.client is None
+    host.close()
@@ -0,0 +1,74 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+# pylint: disable=missing-docstring
+
+import pytest
+
+from google.protobuf.descriptor_pb2 import DescriptorProto, \
+    FieldDescriptorProto
+
+from bonsai_ai.common.state_to_proto import SimStateError, \
+    convert_state_to_proto
+from bonsai_ai.inkling_factory import InklingMessageFactory
+
+
+def _schema():
+    schema = DescriptorProto()
+    schema.name = 'State'
+    for number, (name, field_type) in enumerate([
+            ('position', FieldDescriptorProto.TYPE_DOUBLE),
+            ('count', FieldDescriptorProto.TYPE_INT64),
+            ('active', FieldDescriptorProto.TYPE_BOOL),
+            ('label', FieldDescriptorProto.TYPE_STRING)]):
+        field = schema.field.add()
+        field.name = name
+        field.number = number + 1
+        field.type = field_type
+        field.label = FieldDescriptorProto.LABEL_OPTIONAL
+    return schema
+
+
+def _codec():
+    return InklingMessageFactory().codec_for_proto(_schema())
+
+
+def test_convert_state():
+    codec = _codec()
+    message = codec.new_message()
+    convert_state_to_proto(message, {
+        'position': 1.5, 'count': 3, 'active': True, 'label': 'foo'})
+    assert codec.to_dict(message) == {
+        'position': 1.5, 'count': 3, 'active': True, 'label': 'foo'}
+
+
+def test_convert_state_coerces():
+    codec = _codec()
+    message = codec.from_dict({
+        'position': 2, 'count': 4.0, 'active': 1, 'label': 5})
+    assert codec.to_dict(message) == {
+        'position': 2.0, 'count': 4, 'active': True, 'label': '5'}
+
+
+def test_convert_state_errors():
+    codec = _codec()
+    with pytest.raises(SimStateError) as e:
+        codec.from_dict({'position': 'x', 'count': 1, 'active': True,
+                         'label': ''})
+    assert "'position' to be a float" in str(e.value)
+
+    with pytest.raises(SimStateError) as e:
+        codec.from_dict({'position': 1.0, 'count': None, 'active': True,
+                         'label': ''})
+    assert "'count' to be an integer" in str(e.value)
+
+    with pytest.raises(SimStateError) as e:
+        codec.from_dict({'position': 1.0, 'count': 1, 'active': True})
+    assert 'field named "label"' in str(e.value)
+
+
+def test_converter_is_built_once():
+    factory = InklingMessageFactory()
+    codec = factory.codec_for_proto(_schema())
+    assert factory.codec_for_proto(_schema()).converter is codec.converter
+    assert [entry[0] for entry in codec.converter.fields] == \
+        ['position', 'count', 'active', 'label']
@@ -0,0 +1,165 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+import json
+import time
+
+import pytest
+import requests
+
+from bonsai_ai import Brain, Config, Predictor, Simulator
+from bonsai_ai.testing import BrainServer, ConstantPolicy, RandomPolicy, \
+    ScriptedPolicy, schema
+from bonsai_ai.testing.__main__ import server_for_args
+
+
+def _state(position=0.0):
+    return {'position': position, 'velocity': 0.0,
+            'angle': 0.0, 'rotation': 0.0}
+
+
+class CountingSim(Simulator):
+    def __init__(self, brain, name, terminal=False):
+        super(CountingSim, self).__init__(brain, name)
+        self.terminal = terminal
+        self.actions = []
+        self.episodes = 0
+
+    def episode_start(self, parameters):
+        self.episodes += 1
+        return _state()
+
+    def simulate(self, action):
+        self.actions.append(action)
+        return _state(), 1.0, self.terminal
+
+
+def _config(server, *args):
+    return Config(['test', '--accesskey=VALUE', '--username=alice',
+                   '--url={}'.format(server.url), '--brain=stand_in'] +
+                  list(args))
+
+
+def _run(sim, limit=10000):
+    for _ in range(limit):
+        if not sim.run():
+            return
+    pytest.fail('the server did not finish the simulator')
+
+
+def test_train_to_finished():
+    with BrainServer(episode_length=5, episodes=3) as server:
+        sim = CountingSim(Brain(_config(server)), 'cartpole_simulator')
+        _run(sim)
+        assert server.stats()['episodes'] == 3
+        assert server.stats()['predictions'] == 15
+        assert len(sim.actions) == 15
+        assert sim.actions[0] == {'command': 0}
+
+
+def test_terminal_states_end_episodes():
+    with BrainServer(episode_length=None, episodes=4) as server:
+        sim = CountingSim(Brain(_config(server)), 'cartpole_simulator',
+                          terminal=True)
+        _run(sim)
+        assert server.stats()['episodes'] == 4
+        assert len(sim.actions) == 4
+
+
+def test_batch_size():
+    policy = ScriptedPolicy([{'command': i} for i in range(8)])
+    with BrainServer(policy=policy, batch_size=4, episode_length=8,
+                     episodes=1) as server:
+        sim = CountingSim(Brain(_config(server)), 'cartpole_simulator')
+        _run(sim)
+        assert [a['command'] for a in sim.actions] == list(range(8))
+        assert server.stats()['predictions'] == 8
+
+
+def test_unknown_simulator_rejected():
+    with BrainServer(simulator_name='cartpole_simulator') as server:
+        brain = Brain(_config(server))
+        assert 'cartpole_simulator' in requests.get(
+            '{}/v1/alice/stand_in/sims'.format(server.url)).json()
+        sim = CountingSim(brain, 'other_simulator')
+        sim.run()
+        assert server.stats()['predictions'] == 0
+
+
+def test_predictor_scripted_policy():
+    policy = ScriptedPolicy(lambda state: {'command': int(state['position'])})
+    with BrainServer(policy=policy) as server:
+        predictor = Predictor(Brain(_config(server, '--predict=1')),
+                              'cartpole_simulator')
+        actions = predictor.get_actions([_state(i) for i in range(3)])
+        assert actions == [{'command': i} for i in range(3)]
+        assert predictor.get_action(_state(7)) == {'command': 7}
+        assert server.stats()['predictions'] == 4
+
+
+def test_latency():
+    with BrainServer(latency=0.05) as server:
+        predictor = Predictor(Brain(_config(server, '--predict=1')),
+                              'cartpole_simulator')
+        predictor.get_action(_state())
+        start = time.time()
+        predictor.get_action(_state())
+        assert time.time() - start >= 0.05
+
+
+def test_random_policy_bounds():
+    policy = RandomPolicy(low=-2, high=2, seed=1)
+    with BrainServer(policy=policy,
+                     action_schema=(('x', 'double'), ('n', 'int32'),
+                                    ('b', 'bool'))) as server:
+        predictor = Predictor(Brain(_config(server, '--predict=1')),
+                              'cartpole_simulator')
+        actions = predictor.get_actions([_state()] * 20)
+    assert all(-2 <= a['x'] <= 2 for a in actions)
+    assert all(a['n'] in (-2, -1, 0, 1, 2) for a in actions)
+    assert len(set(a['x'] for a in actions)) > 1
+
+
+def test_constant_policy_defaults():
+    policy = ConstantPolicy({'y': 2.5})
+    policy.reset(BrainServer(
+        policy=policy, action_schema=(('x', 'int32'), ('y', 'float')))
+        .action_codec.fields)
+    assert policy.action(None) == {'x': 0, 'y': 2.5}
+
+
+def test_schema():
+    desc = schema('State', (('x', 'double'), ('image', 'luminance')))
+    assert [f.name for f in desc.field] == ['x', 'image']
+    assert desc.field[1].type_name == 'bonsai.inkling_types.proto.Luminance'
+    with pytest.raises(ValueError):
+        schema('State', (('x', 'complex'),))
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        BrainServer(batch_size=0)
+    with pytest.raises(ValueError):
+        BrainServer(latency=-1)
+
+
+def test_cli(tmpdir):
+    script = tmpdir.join('actions.json')
+    script.write(json.dumps([{'move': 1}, {'move': 2}]))
+    server, args = server_for_args([
+        '--port', '9100', '--policy', 'scripted', '--script', str(script),
+        '--state', 'x:double,y:double', '--action-schema', 'move:int32',
+        '--batch-size', '2', '--latency', '0.5', '--episode-length', '0'])
+    assert args.port == 9100
+    assert [f.name for f in server.state_schema.field] == ['x', 'y']
+    assert server.batch_size == 2
+    assert server.latency == 0.5
+    assert server.episode_length is None
+    assert server.policy.action(None) == {'move': 1}
+    assert server.policy.action(None) == {'move': 2}
+
+
+def test_cli_errors(capsys):
+    with pytest.raises(SystemExit):
+        server_for_args(['--policy', 'scripted'])
+    with pytest.raises(SystemExit):
+        server_for_args(['--state', 'x'])
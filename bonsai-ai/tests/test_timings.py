@@ -0,0 +1,67 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+from bonsai_ai import Config
+from bonsai_ai.logger import Logger
+from bonsai_ai.timings import BUCKET_BOUNDS, PHASES, StepTimings
+
+
+def test_buckets():
+    timings = StepTimings()
+    for seconds in (1e-6, 2e-6, 0.003, 20.0):
+        timings.add('network', seconds)
+    network = timings.as_dict()['network']
+    counts = dict(network['buckets'])
+    assert counts[1e-6] == 1
+    assert counts[2.5e-6] == 2
+    assert counts[5e-3] == 3
+    assert counts[BUCKET_BOUNDS[-1]] == 3
+    assert counts[float('inf')] == 4
+    assert network['count'] == 4
+    assert network['max'] == 20.0
+    assert abs(network['total'] - 20.003003) < 1e-9
+
+
+def test_quantiles():
+    timings = StepTimings()
+    for i in range(100):
+        timings.add('simulate', 0.001 * (i + 1))
+    simulate = timings.as_dict()['simulate']
+    assert 0.025 <= simulate['p50'] <= 0.05
+    assert 0.05 <= simulate['p99'] <= 0.1
+    assert simulate['p99'] <= simulate['max'] == 0.1
+    assert abs(simulate['mean'] - 0.0505) < 1e-9
+
+
+def test_empty():
+    timings = StepTimings().as_dict()
+    assert list(timings) == list(PHASES)
+    assert all(t['count'] == 0 and t['p99'] == 0.0
+               for t in timings.values())
+    assert StepTimings().summary() == 'no steps timed'
+
+
+def test_summary_and_reset():
+    timings = StepTimings()
+    timings.add('network', 0.003)
+    timings.add('simulate', 0.001)
+    summary = timings.summary()
+    assert summary.startswith('network 75.0% ')
+    assert '| simulate 25.0% ' in summary
+    assert 'parse' not in summary
+
+    timings.add_step(0.004)
+    assert 'step' not in timings.summary()
+    assert timings.step().count == 1
+
+    timings.reset()
+    assert timings.total('network') == 0.0
+    assert timings.step().count == 0
+
+
+def test_performance_flag():
+    log = Logger()
+    try:
+        Config(['test', '--performance'])
+        assert log.is_enabled('perf')
+    finally:
+        log.set_enabled('perf', False)
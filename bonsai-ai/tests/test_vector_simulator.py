@@ -0,0 +1,132 @@
+# Copyright (C) 2018 Bonsai, Inc.
+
+# pylint: disable=missing-docstring
+
+import json
+import os
+
+import pytest
+import requests
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from bonsai_ai import Brain, VectorSimulator
+from bonsai_ai.proto.generator_simulator_api_pb2 import ServerToSimulator
+from conftest import CartSim
+
+
+class CartVectorSim(VectorSimulator):
+    def __init__(self, brain, name):
+        super(CartVectorSim, self).__init__(brain, name)
+        self.batches = []
+
+    def episode_start(self, parameters):
+        return CartSim.episode_start(self, parameters)
+
+    def simulate_batch(self, actions):
+        self.batches.append(actions)
+        state = {
+            "position": 1.0,
+            "velocity": 0.0,
+            "angle": 0.0,
+            "rotation": 0.0
+        }
+        count = len(actions)
+        terminals = [False] * (count - 1) + [True]
+        return ([state] * count, [1.0] * count, terminals)
+
+
+class NumpyCartVectorSim(CartVectorSim):
+    batch_format = 'numpy'
+
+    def simulate_batch(self, actions):
+        self.batches.append(actions)
+        states = numpy.zeros(len(actions), dtype=[
+            ('position', 'f4'), ('velocity', 'f4'),
+            ('angle', 'f4'), ('rotation', 'f4')])
+        states['position'] = actions['command']
+        return (states, numpy.ones(len(actions)),
+                numpy.zeros(len(actions), dtype=bool))
+
+
+class BrokenVectorSim(CartVectorSim):
+    def simulate_batch(self, actions):
+        states, rewards, terminals = \
+            super(BrokenVectorSim, self).simulate_batch(actions)
+        return (states[1:], rewards, terminals)
+
+
+def _run_to_prediction(sim):
+    while sim._impl._prev_message_type != ServerToSimulator.PREDICTION:
+        assert sim.run() is True
+
+
+@pytest.fixture
+def vector_brain(train_config):
+    requests.patch("http://127.0.0.1:9000/cartpole")
+    return Brain(train_config)
+
+
+def test_vector_sim_steps_batch(vector_brain):
+    sim = CartVectorSim(vector_brain, 'cartpole_simulator')
+    _run_to_prediction(sim)
+
+    # the recorded prediction message holds three predictions
+    assert len(sim.batches) == 1
+    assert sim.batches[0] == [{'command': 0}, {'command': 0}, {'command': 1}]
+    assert sim.iteration_count == 3
+    assert sim.episode_count == 1
+    assert sim.episode_reward == 3.0
+    # the terminal instance reset itself, the batch episode goes on
+    assert sim._impl._prev_step_terminal == [False]
+
+    steps = sim._impl._sim_steps
+    assert [step.terminal for step in steps] == [False, False, True]
+    assert all(step.reward == 1.0 for step in steps)
+
+    # the server stops the batch episode
+    assert sim.run() is True
+    assert sim._impl._prev_message_type == ServerToSimulator.STOP
+    assert sim.episode_count == 2
+    sim.close()
+
+
+@pytest.mark.skipif(numpy is None, reason='numpy is not installed')
+def test_vector_sim_numpy_batch(vector_brain):
+    sim = NumpyCartVectorSim(vector_brain, 'cartpole_simulator')
+    _run_to_prediction(sim)
+
+    actions = sim.batches[0]
+    assert isinstance(actions, numpy.ndarray)
+    assert actions.dtype.names == ('command',)
+    assert list(actions['command']) == [0, 0, 1]
+
+    steps = sim._impl._sim_steps
+    assert [step.state.position for step in steps] == [0.0, 0.0, 1.0]
+    assert [step.terminal for step in steps] == [False, False, False]
+    sim.close()
+
+
+def test_vector_sim_batch_size_mismatch(vector_brain):
+    sim = BrokenVectorSim(vector_brain, 'cartpole_simulator')
+    with pytest.raises(ValueError):
+        _run_to_prediction(sim)
+
+
+def test_vector_sim_records_each_step(record_json_config, temp_directory):
+    requests.patch("http://127.0.0.1:9000/cartpole")
+    sim = CartVectorSim(Brain(record_json_config), 'cartpole_simulator')
+    _run_to_prediction(sim)
+    sim.writer.close()
+    sim.close()
+
+    with open(sim.brain.config.record_file, 'r') as f:
+        records = [json.loads(line) for line in f.readlines()]
+    os.remove(sim.brain.config.record_file)
+
+    steps = [r for r in records if r['terminal'] is not None]
+    assert [r['action.command'] for r in steps] == [0, 0, 1]
+    assert [r['terminal'] for r in steps] == [False, False, True]
@@ -5,7 +5,15 @@ import json
 import os
 import io
 import sys
+import time
+
+import pytest
+
+from bonsai_ai.writer import CSVWriter, JSONWriter, NpzWriter, \
+    ParquetWriter, numpy, pyarrow
+from bonsai_ai.inkling_factory import InklingMessageFactory
 from bonsai_ai.proto.generator_simulator_api_pb2 import ServerToSimulator
+from bonsai_ai.testing import schema
 
 
 def test_json_writing(record_json_sim, temp_directory):
@@ -171,3 +179,216 @@ def test_predict_mode_record(record_csv_predict, temp_directory):
     record_csv_predict.close()
     os.remove(rcp.brain.config.record_file)
     os.rmdir("sub")
+
+
+def test_buffered_json_writing(record_buffered_sim, temp_directory):
+    sim = record_buffered_sim
+    assert sim.writer.buffered
+    while sim._impl._prev_message_type != ServerToSimulator.RESET:
+        sim.record_append({'foo': 23}, 'bar')
+        sim.run()
+
+    # every queued record is on disk once the writer is closed
+    sim.writer.close()
+    with open(sim.brain.config.record_file, 'r') as f:
+        json_content = [json.loads(l) for l in f.readlines()]
+
+    assert len(json_content) == 4
+    for l in json_content:
+        if l['sim_id'] is not None:
+            assert l['sim_id'] == 270022238
+        assert l['bar.foo'] == 23
+
+    sim.close()
+    os.remove(sim.brain.config.record_file)
+
+
+def _read_lines(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return f.readlines()
+
+
+def test_buffered_flush_by_count(temp_directory):
+    writer = JSONWriter('count.json', buffered=True, flush_records=3,
+                        flush_interval=60)
+    writer.enable_keys(['foo'])
+    for i in range(3):
+        writer.add({'foo': i})
+        writer.write()
+
+    deadline = time.time() + 5
+    while len(_read_lines('count.json')) < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(_read_lines('count.json')) == 3
+
+    writer.close()
+    os.remove('count.json')
+
+
+def test_buffered_flush_by_time(temp_directory):
+    writer = CSVWriter('time.csv', buffered=True, flush_records=1000,
+                       flush_interval=0.05)
+    writer.enable_keys(['foo'])
+    writer.add({'foo': 1})
+    writer.write()
+
+    deadline = time.time() + 5
+    while len(_read_lines('time.csv')) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert [l.strip() for l in _read_lines('time.csv')] == ['foo', '1']
+
+    writer.close()
+    os.remove('time.csv')
+
+
+def test_buffered_file_change(temp_directory):
+    writer = JSONWriter('first.json', buffered=True, flush_interval=60)
+    writer.enable_keys(['foo'])
+    writer.add({'foo': 1})
+    writer.write()
+    writer.record_file = 'second.json'
+    writer.add({'foo': 2})
+    writer.write()
+    writer.close()
+
+    assert [json.loads(l) for l in _read_lines('first.json')] == \
+        [{'foo': 1}]
+    assert [json.loads(l) for l in _read_lines('second.json')] == \
+        [{'foo': 2}]
+
+    # writing after close restarts the writer thread
+    writer.add({'foo': 3})
+    writer.write()
+    writer.close()
+    assert len(_read_lines('second.json')) == 2
+
+    os.remove('first.json')
+    os.remove('second.json')
+
+
+def test_buffered_write_error(temp_directory):
+    writer = JSONWriter('missing/error.json', buffered=True)
+    writer.enable_keys(['foo'])
+    writer.write()
+
+    with pytest.raises(IOError):
+        writer.close()
+
+
+@pytest.mark.skipif(numpy is None, reason='numpy is not installed')
+def test_npz_writing(record_npz_sim, temp_directory):
+    sim = record_npz_sim
+    while sim._impl._prev_message_type != ServerToSimulator.RESET:
+        sim.record_append({'foo': 23}, 'bar')
+        sim.run()
+    sim.writer.close()
+
+    assert NpzWriter.shard_files('foobar.npz') == ['foobar-00000.npz']
+    columns = NpzWriter.load('foobar.npz')
+    assert list(columns['bar.foo']) == [23] * 4
+    assert columns['bar.foo'].dtype == numpy.int64
+    assert columns['simulator'].dtype.kind == 'U'
+    assert set(columns['sim_id']) == {270022238}
+    # typed by the schema, with the first record of an episode missing
+    # its action and reward
+    assert columns['action.command'].dtype == numpy.int32
+    assert list(columns['action.command'].mask) == [True, False] * 2
+    assert columns['terminal'].dtype == numpy.bool_
+    assert columns['reward'].mask[0]
+    assert columns['state.position'].dtype == numpy.float32
+
+    sim.close()
+    os.remove('foobar-00000.npz')
+
+
+def _write_columns(writer, count):
+    writer.enable_keys(['x', 'n', 'done', 'name'], 'state')
+    for i in range(count):
+        writer.add({'x': i * 0.5, 'n': i, 'done': i % 2 == 0,
+                    'name': 'step{}'.format(i)}, 'state')
+        writer.write()
+    writer.close()
+
+
+def _check_columns(columns, count):
+    assert list(columns['state.x']) == [i * 0.5 for i in range(count)]
+    assert list(columns['state.n']) == list(range(count))
+    assert columns['state.n'].dtype == numpy.int64
+    assert columns['state.done'].dtype == numpy.bool_
+    assert list(columns['state.name']) == \
+        ['step{}'.format(i) for i in range(count)]
+
+
+def _write_typed_columns(writer):
+    codec = InklingMessageFactory().codec_for_proto(schema('State', [
+        ('n', 'int64'), ('done', 'bool'), ('frame', 'luminance')]))
+    writer.enable_fields(codec.fields, 'state')
+    writer.enable_keys(['extra'])
+    # the first shard has a missing value of each column, and the types
+    # of the later shards are kept although their values differ
+    rows = [({'n': None, 'done': None, 'frame': 'pixels'}, None),
+            ({'n': 1, 'done': True, 'frame': 'pixels'}, 1.5),
+            ({'n': 2, 'done': False, 'frame': 'pixels'}, 2),
+            ({'n': 3, 'done': True, 'frame': 'pixels'}, 3)]
+    for state, extra in rows:
+        writer.add(state, 'state')
+        writer.add({'extra': extra})
+        writer.write()
+    writer.close()
+
+
+def _check_typed_columns(columns):
+    assert sorted(columns) == ['extra', 'state.done', 'state.n']
+    assert columns['state.n'].dtype == numpy.int64
+    assert list(columns['state.n'].mask) == [True, False, False, False]
+    assert list(columns['state.n'][1:]) == [1, 2, 3]
+    assert columns['state.done'].dtype == numpy.bool_
+    assert columns['state.done'][1]
+    assert columns['extra'].dtype == numpy.float64
+    assert list(columns['extra'][1:]) == [1.5, 2.0, 3.0]
+
+
+@pytest.mark.skipif(numpy is None, reason='numpy is not installed')
+def test_npz_typed_columns(temp_directory):
+    _write_typed_columns(NpzWriter('typed.npz', rows_per_shard=2))
+    _check_typed_columns(NpzWriter.load('typed.npz'))
+    for shard in NpzWriter.shard_files('typed.npz'):
+        os.remove(shard)
+
+
+@pytest.mark.skipif(pyarrow is None, reason='pyarrow is not installed')
+def test_parquet_typed_columns(temp_directory):
+    _write_typed_columns(ParquetWriter('typed.parquet', rows_per_shard=2))
+    _check_typed_columns(ParquetWriter.load('typed.parquet'))
+    for shard in ParquetWriter.shard_files('typed.parquet'):
+        os.remove(shard)
+
+
+@pytest.mark.skipif(numpy is None, reason='numpy is not installed')
+def test_npz_shards(temp_directory):
+    _write_columns(NpzWriter('run.npz', rows_per_shard=4), 10)
+    assert NpzWriter.shard_files('run.npz') == \
+        ['run-00000.npz', 'run-00001.npz', 'run-00002.npz']
+    _check_columns(NpzWriter.load('run.npz'), 10)
+
+    # recording again appends shards, in a background thread this time
+    _write_columns(NpzWriter('run.npz', rows_per_shard=4, buffered=True), 2)
+    shards = NpzWriter.shard_files('run.npz')
+    assert shards[-1] == 'run-00003.npz'
+    assert len(NpzWriter.load('run.npz')['state.n']) == 12
+
+    for shard in shards:
+        os.remove(shard)
+
+
+@pytest.mark.skipif(pyarrow is None, reason='pyarrow is not installed')
+def test_parquet_shards(temp_directory):
+    _write_columns(ParquetWriter('run.parquet', rows_per_shard=4), 10)
+    shards = ParquetWriter.shard_files('run.parquet')
+    assert len(shards) == 3
+    _check_columns(ParquetWriter.load('run.parquet'), 10)
+
+    for shard in shards:
+        os.remove(shard)
@@ -3,6 +3,7 @@ import json
 import os
 import sys
 import weakref
+import zlib
 
 from aiohttp import web, WSMsgType, WSCloseCode, EofStream
 from bonsai_ai.proto.generator_simulator_api_pb2 import ServerToSimulator
@@ -119,7 +120,6 @@ class BonsaiWS:
     _fail_point = 10
     _fail_duration = 8
 
-    _prev = ServerToSimulator.UNKNOWN
     _dispatch = {
         ServerToSimulator.UNKNOWN: {
             SimulatorToServer.REGISTER: ServerToSimulator.ACKNOWLEDGE_REGISTER
@@ -165,14 +165,23 @@ class BonsaiWS:
 
     _count = 0
 
-    def _dispatch_mtype(self, incoming):
+    def _dispatch_mtype(self, prev, incoming):
         if self._PREDICT:
-            return self._dispatch_pred.get(self._prev, {}).get(
+            return self._dispatch_pred.get(prev, {}).get(
                 incoming, ServerToSimulator.UNKNOWN)
         else:
-            return self._dispatch.get(self._prev, {}).get(
+            return self._dispatch.get(prev, {}).get(
                 incoming, ServerToSimulator.UNKNOWN)
 
+    @staticmethod
+    def _predict_per_state(msg, from_sim):
+        """ Replies to each state of a prediction request with one of the
+        recorded predictions, in turn, as the service does """
+        recorded = list(msg.prediction_data)
+        del msg.prediction_data[:]
+        for i in range(len(from_sim.state_data)):
+            msg.prediction_data.add().CopyFrom(recorded[i % len(recorded)])
+
     def _validate_message(self, msg):
         ''' Add code here to confirm messages have been correctly
         populated in the client'''
@@ -270,7 +279,11 @@ class BonsaiWS:
 
     async def status(self, request):
         self.reset_flags()
-        return web.json_response(BRAIN_STATUS)
+        body = json.dumps(BRAIN_STATUS, sort_keys=True)
+        etag = '"{:08x}"'.format(zlib.crc32(body.encode()))
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.json_response(BRAIN_STATUS, headers={'ETag': etag})
 
     async def info(self, request):
         self.reset_flags()
@@ -294,7 +307,9 @@ class BonsaiWS:
 
     @count_me
     async def handle_msg(self, request):
-        self._prev = ServerToSimulator.UNKNOWN
+        # protocol state is tracked per connection, so that several
+        # simulators can be connected at the same time
+        prev = ServerToSimulator.UNKNOWN
         if self._UNAUTHORIZED:
             return web.Response(status=401, text="Unauthorized")
         
@@ -336,7 +351,7 @@ class BonsaiWS:
                     from_sim.ParseFromString(msg.data)
                     self._validate_message(from_sim)
                     sim_name = from_sim.register_data.simulator_name
-                    mtype = self._dispatch_mtype(from_sim.message_type)
+                    mtype = self._dispatch_mtype(prev, from_sim.message_type)
 
                     if self._FLAKY and \
                        self._count > self._fail_point and \
@@ -370,9 +385,12 @@ class BonsaiWS:
                         json_msg = json.dumps(msg_dict)
                         msg = ServerToSimulator()
                         Parse(json_msg, msg)
+                        if self._PREDICT and \
+                                mtype == ServerToSimulator.PREDICTION:
+                            self._predict_per_state(msg, from_sim)
                         await ws.send_bytes(msg.SerializeToString())
 
-                    self._prev = mtype
+                    prev = mtype
         finally:
             request.app['websockets'].discard(ws)
 
@@ -18,25 +18,11 @@ class LuminanceGymSimulator(GymSimulator):
         performs nice preprocessing.
         """
 
-        R = observation[:, :, 0]
-        G = observation[:, :, 1]
-        B = observation[:, :, 2]
-
-        # Calculates weighted apparent brightness values
-        # according to https://en.wikipedia.org/wiki/Relative_luminance
-        observation = 0.2126 * R + 0.7152 * G + 0.0722 * B
-
-        # Normalize the observations.
-        observation /= 255.0
-
-        # should be replaced with tranformed
+        # downsample first, so that only the kept pixels are converted
         observation = observation[::self.downsample, ::self.downsample]
 
-        observation = observation.ravel().tolist()
-
+        # Calculates weighted apparent brightness values, normalized to
+        # [0, 1], without leaving NumPy
         return {
-            'observation': Luminance(
-                int(self.env_width / self.downsample),
-                int(self.env_height / self.downsample),
-                observation)
+            'observation': Luminance.from_rgb_array(observation)
         }